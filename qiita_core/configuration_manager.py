@@ -42,6 +42,14 @@ class ConfigurationManager(object):
         Path to the working directory
     max_upload_size : int
         Max upload size
+    metadata_cache_size : int
+        Memory budget (in Mb) of the in-memory cache of metadata templates. 0
+        disables the cache
+    analysis_build_workers : int
+        The number of processes used to build the biom tables of an analysis
+    analysis_build_memory : int
+        Memory budget (in Mb) of the biom tables of an analysis being built at
+        the same time
     valid_upload_extension : str
         The extensions that are valid to upload, comma separated
     trq_owner : str
@@ -65,6 +73,12 @@ class ConfigurationManager(object):
         The host where the database lives
     port : int
         The port used to connect to the postgres database in the previous host
+    max_connections : int
+        The maximum number of postgres connections each Qiita process keeps
+        open at the same time
+    batch_page_size : int
+        The maximum number of statements sent to postgres in a single round
+        trip when executing batches of statements
     smtp_host : str
         The SMTP host from which mail will be sent
     smtp_port : int
@@ -190,6 +204,12 @@ class ConfigurationManager(object):
             raise ValueError("The WORKING_DIR (%s) folder doesn't exist" %
                              self.working_dir)
         self.max_upload_size = config.getint('main', 'MAX_UPLOAD_SIZE')
+        self.metadata_cache_size = config.getint(
+            'main', 'METADATA_CACHE_SIZE', fallback=256)
+        self.analysis_build_workers = config.getint(
+            'main', 'ANALYSIS_BUILD_WORKERS', fallback=4)
+        self.analysis_build_memory = config.getint(
+            'main', 'ANALYSIS_BUILD_MEMORY', fallback=4096)
         self.require_approval = config.getboolean('main', 'REQUIRE_APPROVAL')
 
         self.qiita_env = config.get('main', 'QIITA_ENV')
@@ -269,6 +289,10 @@ class ConfigurationManager(object):
         self.database = config.get('postgres', 'DATABASE')
         self.host = config.get('postgres', 'HOST')
         self.port = config.getint('postgres', 'PORT')
+        self.max_connections = config.getint('postgres', 'MAX_CONNECTIONS',
+                                             fallback=10)
+        self.batch_page_size = config.getint('postgres', 'BATCH_PAGE_SIZE',
+                                             fallback=100)
 
     def _get_redis(self, config):
         """Get the configuration of the redis section"""
@@ -49,6 +49,9 @@ class ConfigurationManagerTests(TestCase):
         self.assertEqual(obs.log_dir, "/tmp/")
         self.assertEqual(obs.base_url, "https://localhost")
         self.assertEqual(obs.max_upload_size, 100)
+        self.assertEqual(obs.metadata_cache_size, 256)
+        self.assertEqual(obs.analysis_build_workers, 4)
+        self.assertEqual(obs.analysis_build_memory, 4096)
         self.assertTrue(obs.require_approval)
         self.assertEqual(obs.qiita_env, "source activate qiita")
         self.assertEqual(obs.private_launcher, 'qiita-private-launcher')
@@ -74,6 +77,8 @@ class ConfigurationManagerTests(TestCase):
         self.assertEqual(obs.database, "qiita_test")
         self.assertEqual(obs.host, "localhost")
         self.assertEqual(obs.port, 5432)
+        self.assertEqual(obs.max_connections, 10)
+        self.assertEqual(obs.batch_page_size, 100)
 
         # Redis section
         self.assertEqual(obs.redis_host, "localhost")
@@ -182,6 +187,19 @@ class ConfigurationManagerTests(TestCase):
 
         self.assertEqual(obs.qiita_env, "")
 
+        # METADATA_CACHE_SIZE is optional
+        conf_setter('VALID_UPLOAD_EXTENSION', 'fastq')
+        self.conf.remove_option('main', 'METADATA_CACHE_SIZE')
+        obs._get_main(self.conf)
+        self.assertEqual(obs.metadata_cache_size, 256)
+
+        # ANALYSIS_BUILD_WORKERS and ANALYSIS_BUILD_MEMORY are optional
+        self.conf.remove_option('main', 'ANALYSIS_BUILD_WORKERS')
+        self.conf.remove_option('main', 'ANALYSIS_BUILD_MEMORY')
+        obs._get_main(self.conf)
+        self.assertEqual(obs.analysis_build_workers, 4)
+        self.assertEqual(obs.analysis_build_memory, 4096)
+
     def test_get_torque(self):
         obs = ConfigurationManager()
 
@@ -200,6 +218,13 @@ class ConfigurationManagerTests(TestCase):
         self.assertIsNone(obs.password)
         self.assertIsNone(obs.admin_password)
 
+        # MAX_CONNECTIONS and BATCH_PAGE_SIZE are optional
+        self.conf.remove_option('postgres', 'MAX_CONNECTIONS')
+        self.conf.remove_option('postgres', 'BATCH_PAGE_SIZE')
+        obs._get_postgres(self.conf)
+        self.assertEqual(obs.max_connections, 10)
+        self.assertEqual(obs.batch_page_size, 100)
+
     def test_get_portal(self):
         obs = ConfigurationManager()
         conf_setter = partial(self.conf.set, 'portal')
@@ -242,6 +267,18 @@ WORKING_DIR = /tmp/
 # Maximum upload size (in Gb)
 MAX_UPLOAD_SIZE = 100
 
+# Memory budget (in Mb) of the in-memory cache of sample and prep information
+# files. Set to 0 to disable the cache
+METADATA_CACHE_SIZE = 256
+
+# Number of processes used to build the biom tables of an analysis, one per
+# data type and algorithm
+ANALYSIS_BUILD_WORKERS = 4
+
+# Memory budget (in Mb) of the biom tables of an analysis being built at the
+# same time, estimated from the size of their input biom tables
+ANALYSIS_BUILD_MEMORY = 4096
+
 # Path to the base directory where the data files are going to be stored
 BASE_DATA_DIR = /tmp/
 
@@ -331,6 +368,12 @@ PASSWORD = andanotherpwd
 # The postgres password for the admin_user
 ADMIN_PASSWORD = thishastobesecure
 
+# The maximum number of connections each Qiita process keeps open
+MAX_CONNECTIONS = 10
+
+# The maximum number of statements sent to postgres in a single round trip
+BATCH_PAGE_SIZE = 100
+
 # ----------------------------- Torque settings -----------------------------
 [torque]
 # The email address of the submitter of Torque jobs
@@ -17,16 +17,23 @@ Classes
 # The full license is in the file LICENSE, distributed with this software.
 # -----------------------------------------------------------------------------
 from __future__ import division
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from itertools import product
-from os.path import join, exists
+from multiprocessing import get_context
+from multiprocessing.pool import ThreadPool
+from queue import Queue
+from os.path import join, exists, getsize
 from os import mkdir
 
 from future.utils import viewitems
-from biom import load_table
+from biom import load_table, Table
 from biom.util import biom_open
-from biom.exception import DisjointIDError
 from re import sub
+import h5py
+import numpy as np
 import pandas as pd
+from scipy.sparse import coo_matrix
 
 from qiita_core.exceptions import IncompetentQiitaDeveloperError
 from qiita_core.qiita_settings import qiita_config
@@ -34,6 +41,168 @@ import qiita_db as qdb
 from json import loads, dump
 
 
+def _load_biom_samples(fp, samples):
+    """Loads the given samples of a biom table
+
+    Parameters
+    ----------
+    fp : str
+        The filepath of the biom table
+    samples : set of str
+        The sample ids to load, the ones not in the table are ignored
+
+    Returns
+    -------
+    biom.Table or None
+        The table with only the given samples, or None if the table doesn't
+        have any of them
+
+    Notes
+    -----
+    HDF5 tables are stored by sample too, so only the columns of the given
+    samples are read from disk
+    """
+    if h5py.is_hdf5(fp):
+        with biom_open(fp) as f:
+            ids = [i.decode('utf-8') if isinstance(i, bytes) else i
+                   for i in f['sample/ids'][:]]
+            ids = [i for i in ids if i in samples]
+            if not ids:
+                return None
+            return Table.from_hdf5(f, ids=ids, axis='sample')
+
+    table = load_table(fp)
+    ids = set(table.ids()).intersection(samples)
+    if not ids:
+        return None
+    return table.filter(ids, axis='sample', inplace=False)
+
+
+def _merge_biom_tables(biom_fps, rename_dup_samples=False):
+    """Merges the given samples of multiple biom tables in a single table
+
+    Parameters
+    ----------
+    biom_fps : list of (int, str, list of str)
+        The artifact id, the filepath of its biom table and the samples to
+        keep of each table
+    rename_dup_samples : bool, optional
+        If True, the sample ids are prefixed with the artifact id so samples
+        in multiple tables are kept apart; otherwise their values are added.
+        Default: False
+
+    Returns
+    -------
+    biom.Table or None
+        The merged table or None if none of the tables has any of the samples
+
+    Notes
+    -----
+    This is equivalent to concatenating or merging the tables one after the
+    other but it is done in a single pass: the selected samples of each table
+    are read, their values are added to a sparse accumulator keyed by the
+    position of the sample and observation in the final table, and the table
+    is discarded before reading the next one. Thus, the memory used is bound
+    by the size of the final table instead of the size of the tables read.
+    The metadata of an observation or sample is the one of the first table
+    where it is found.
+    """
+    def _positions(ids, index, metadata, table_metadata):
+        positions = np.empty(len(ids), dtype=np.int64)
+        for i, _id in enumerate(ids):
+            pos = index.get(_id)
+            if pos is None:
+                pos = index[_id] = len(index)
+                metadata.append(
+                    None if table_metadata is None else table_metadata[i])
+            positions[i] = pos
+        return positions
+
+    obs_index, obs_md = {}, []
+    sample_index, sample_md = {}, []
+    rows, cols, data = [], [], []
+    table_type = None
+    for aid, fp, samples in biom_fps:
+        table = _load_biom_samples(fp, set(samples))
+        if table is None:
+            continue
+        if table_type is None:
+            table_type = table.type
+
+        sample_ids = table.ids()
+        if rename_dup_samples:
+            sample_ids = ["%d.%s" % (aid, _id) for _id in sample_ids]
+        opos = _positions(table.ids(axis='observation'), obs_index, obs_md,
+                          table.metadata(axis='observation'))
+        spos = _positions(sample_ids, sample_index, sample_md,
+                          table.metadata(axis='sample'))
+        matrix = table.matrix_data.tocoo()
+        rows.append(opos[matrix.row])
+        cols.append(spos[matrix.col])
+        data.append(matrix.data)
+
+    if not sample_index:
+        return None
+
+    # coo_matrix adds the values of duplicated (observation, sample) pairs,
+    # which is what merging tables with the same sample ids does
+    matrix = coo_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(obs_index), len(sample_index))).tocsr()
+    if all(md is None for md in obs_md):
+        obs_md = None
+    if all(md is None for md in sample_md):
+        sample_md = None
+
+    return Table(matrix, list(obs_index), list(sample_index),
+                 observation_metadata=obs_md, sample_metadata=sample_md,
+                 type=table_type)
+
+
+def _write_biom_table(biom_fps, rename_dup_samples, biom_fp, comment):
+    """Merges the given samples of multiple biom tables and writes the result
+
+    Parameters
+    ----------
+    biom_fps : list of (int, str, list of str)
+        The artifact id, the filepath of its biom table and the samples to
+        keep of each table
+    rename_dup_samples : bool
+        If True, the sample ids are prefixed with the artifact id
+    biom_fp : str
+        The filepath where the merged table is written
+    comment : str
+        The generated-by comment of the merged table
+
+    Returns
+    -------
+    list of str or None
+        The features of the merged table or None if it has no samples, in
+        which case nothing is written
+
+    Notes
+    -----
+    This function runs in the worker processes of
+    Analysis._build_biom_tables so it can't access the database
+    """
+    table = _merge_biom_tables(biom_fps, rename_dup_samples)
+    if table is None:
+        return None
+    with biom_open(biom_fp, 'w') as f:
+        table.to_hdf5(f, comment)
+    return list(table.ids(axis='observation'))
+
+
+def _put_build_result(finished, build, features):
+    """Pool callback of Analysis._build_biom_tables for a written table"""
+    finished.put((build, features, None))
+
+
+def _put_build_error(finished, build, error):
+    """Pool error callback of Analysis._build_biom_tables"""
+    finished.put((build, None, error))
+
+
 class Analysis(qdb.base.QiitaObject):
     """
     Analysis object to access to the Qiita Analysis information
@@ -245,6 +414,7 @@ class Analysis(qdb.base.QiitaObject):
             qdb.sql_connection.TRN.add(sql, args)
 
             qdb.sql_connection.TRN.execute()
+            cls._forget(_id)
 
     @classmethod
     def exists(cls, analysis_id):
@@ -908,7 +1078,19 @@ class Analysis(qdb.base.QiitaObject):
                            grouped_samples,
                            rename_dup_samples=False,
                            post_processing_cmds=None):
-        """Build tables and add them to the analysis"""
+        """Build tables and add them to the analysis
+
+        Notes
+        -----
+        The tables of the different labels are independent so they are
+        built in parallel by up to `qiita_config.analysis_build_workers`
+        processes, largest first. The memory needed by a table is estimated
+        as the size of its input biom files and a table is only started if
+        it fits, together with the tables being built, in
+        `qiita_config.analysis_build_memory`; the largest pending table is
+        started anyway if nothing else is being built. The post-processing
+        command of a table is started as soon as its table is written.
+        """
         with qdb.sql_connection.TRN:
             # creating per analysis output folder
             _, base_fp = qdb.util.get_mountpoint(self._table)[0]
@@ -916,165 +1098,228 @@ class Analysis(qdb.base.QiitaObject):
             if not exists(base_fp):
                 mkdir(base_fp)
 
-            biom_files = []
-            for label, tables in viewitems(grouped_samples):
-
-                data_type, algorithm = [
-                    l.strip() for l in label.split('||')]
-
-                new_table = None
-                artifact_ids = []
-                for aid, samples in tables:
-                    artifact = qdb.artifact.Artifact(aid)
-                    artifact_ids.append(str(aid))
-
-                    # the next loop is assuming that an artifact can have only
-                    # one biom, which is a safe assumption until we generate
-                    # artifacts from multiple bioms and even then we might
-                    # only have one biom
-                    biom_table_fp = None
-                    for x in artifact.filepaths:
+            # the next loop is assuming that an artifact can have only one
+            # biom, which is a safe assumption until we generate artifacts
+            # from multiple bioms and even then we might only have one biom
+            artifact_bioms = {}
+            for tables in grouped_samples.values():
+                for aid, _ in tables:
+                    if aid in artifact_bioms:
+                        continue
+                    artifact_bioms[aid] = None
+                    for x in qdb.artifact.Artifact(aid).filepaths:
                         if x['fp_type'] == 'biom':
-                            biom_table_fp = x['fp']
+                            artifact_bioms[aid] = x['fp']
                             break
-                    if not biom_table_fp:
+                    if not artifact_bioms[aid]:
                         raise RuntimeError(
                             "Artifact %s does not have a biom table associated"
                             % aid)
 
-                    # loading the found biom table
-                    biom_table = load_table(biom_table_fp)
-                    # filtering samples to keep those selected by the user
-                    biom_table_samples = set(biom_table.ids())
-                    selected_samples = biom_table_samples.intersection(samples)
-                    biom_table.filter(selected_samples, axis='sample',
-                                      inplace=True)
-                    if len(biom_table.ids()) == 0:
-                        continue
-
-                    if rename_dup_samples:
-                        ids_map = {_id: "%d.%s" % (aid, _id)
-                                   for _id in biom_table.ids()}
-                        biom_table.update_ids(ids_map, 'sample', True, True)
-
-                    if new_table is None:
-                        new_table = biom_table
-                    else:
-                        try:
-                            new_table = new_table.concat([biom_table])
-                        except DisjointIDError:
-                            new_table = new_table.merge(biom_table)
-
-                if not new_table or len(new_table.ids()) == 0:
-                    # if we get to this point the only reason for failure is
-                    # rarefaction
-                    raise RuntimeError("All samples filtered out from "
-                                       "analysis due to rarefaction level")
-
-                # write out the file
+            builds = []
+            for label, tables in viewitems(grouped_samples):
+                data_type, algorithm = [
+                    l.strip() for l in label.split('||')]
                 # data_type and algorithm values become part of the file
                 # name(s).
                 info = "%s_%s" % (
                     sub('[^0-9a-zA-Z]+', '', data_type),
                     sub('[^0-9a-zA-Z]+', '', algorithm))
                 fn = "%d_analysis_%s.biom" % (self._id, info)
-                biom_fp = join(base_fp, fn)
-                # save final biom here
-                with biom_open(biom_fp, 'w') as f:
-                    new_table.to_hdf5(
-                        f, "Generated by Qiita, analysis id: %d, info: %s" % (
-                            self._id, label))
+                biom_fps = [(aid, artifact_bioms[aid], samples)
+                            for aid, samples in tables]
+                builds.append({
+                    'label': label, 'data_type': data_type,
+                    'algorithm': algorithm, 'info': info,
+                    'biom_fp': join(base_fp, fn), 'inputs': biom_fps,
+                    'size': sum(getsize(fp) for _, fp, _ in biom_fps)})
+
+            n_workers = max(1, min(
+                qiita_config.analysis_build_workers, len(builds)))
+            budget = qiita_config.analysis_build_memory * 1024 * 1024
+            if n_workers > 1:
+                # spawning the workers so they don't inherit the database
+                # connections of this process
+                pool = get_context('spawn').Pool(processes=n_workers)
+            else:
+                pool = ThreadPool(processes=1)
+
+            # the pool callbacks report each finished table through this
+            # queue as (build, features, error)
+            finished = Queue()
+            pp_jobs = {}
+            pending = sorted(builds, key=lambda b: b['size'], reverse=True)
+            running = []
+            with pool, ThreadPoolExecutor(
+                    max_workers=n_workers) as pp_executor:
+                while pending or running:
+                    while pending and len(running) < n_workers:
+                        used = sum(b['size'] for b in running)
+                        build = next((b for b in pending
+                                      if used + b['size'] <= budget), None)
+                        if build is None:
+                            if running:
+                                break
+                            build = pending[0]
+                        pending.remove(build)
+                        running.append(build)
+                        pool.apply_async(
+                            _write_biom_table,
+                            (build['inputs'], rename_dup_samples,
+                             build['biom_fp'],
+                             "Generated by Qiita, analysis id: %d, info: %s"
+                             % (self._id, build['label'])),
+                            callback=partial(
+                                _put_build_result, finished, build),
+                            error_callback=partial(
+                                _put_build_error, finished, build))
+
+                    build, features, error = finished.get()
+                    running.remove(build)
+                    if error is not None:
+                        raise error
+                    if features is None:
+                        # if we get to this point the only reason for
+                        # failure is rarefaction
+                        raise RuntimeError(
+                            "All samples filtered out from analysis due "
+                            "to rarefaction level")
+
+                    # post_processing_cmds can be None, default, or a
+                    # dict of algorithm: merging_scheme, command
+                    if (post_processing_cmds is not None and
+                            build['algorithm'] in post_processing_cmds):
+                        cmd = self._post_processing_cmd(
+                            base_fp, build['info'], build['biom_fp'],
+                            features,
+                            *post_processing_cmds[build['algorithm']])
+                        pp_jobs[build['label']] = pp_executor.submit(
+                            qdb.processing_job._system_call, cmd)
 
+            biom_files = []
+            for build in builds:
                 # let's add the regular biom without post processing
-                biom_files.append((data_type, biom_fp, None))
-
-                # post_processing_cmds can be None, default, or a dict of
-                # algorithm: merging_scheme, command
-                if (post_processing_cmds is not None and
-                        algorithm in post_processing_cmds):
-                    merging_scheme, pp_cmd = post_processing_cmds[algorithm]
-                    # assuming all commands require archives, obtain
-                    # archives once, instead of for every cmd.
-                    features = load_table(biom_fp).ids(axis='observation')
-                    features = list(features)
-                    archives = qdb.archive.Archive.retrieve_feature_values(
-                        archive_merging_scheme=merging_scheme,
-                        features=features)
-
-                    # remove archives that SEPP could not match
-                    archives = {f: loads(archives[f])
-                                for f, plc
-                                in archives.items()
-                                if plc != ''}
-
-                    # since biom_fp uses base_fp as its location, assume it's
-                    # suitable for other files as well.
-                    output_dir = join(base_fp, info)
-                    if not exists(output_dir):
-                        mkdir(output_dir)
-
-                    fp_archive = join(output_dir,
-                                      'archive_%d.json' % (self._id))
-
-                    with open(fp_archive, 'w') as out_file:
-                        dump(archives, out_file)
-
-                    # assume archives file is passed as:
-                    # --fp_archive=<path_to_archives_file>
-                    # assume output dir is passed as:
-                    # --output_dir=<path_to_output_dir>
-                    # assume input biom file is passed as:
-                    # --fp_biom=<path_to_biom_file>
-
-                    # concatenate any other parameters into a string
-                    params = ' '.join(["%s=%s" % (k, v) for k, v in
-                                      pp_cmd['script_params'].items()])
-
-                    # append archives file and output dir parameters
-                    params = ("%s --fp_biom=%s --fp_archive=%s "
-                              "--output_dir=%s" % (
-                                  params, biom_fp, fp_archive, output_dir))
-
-                    # if environment is successfully activated,
-                    # run script with parameters
-                    # script_env e.g.: 'deactivate; source activate qiita'
-                    # script_path e.g.:
-                    # python 'qiita_db/test/support_files/worker.py'
-                    cmd = "%s %s %s" % (
-                        pp_cmd['script_env'], pp_cmd['script_path'], params)
-                    p_out, p_err, rv = qdb.processing_job._system_call(cmd)
-                    p_out = p_out.rstrip()
-                    # based on the set of commands ran, we could get a
-                    # rv !=0 but still have a successful return from the
-                    # command, thus checking both rv and p_out. Note that
-                    # p_out will return either an error message or
-                    # the file path to the new tree, depending on p's
-                    # return code.
-                    if rv != 0:
-                        raise ValueError('Error %d: %s' % (rv, p_out))
-                    p_out = loads(p_out)
-
-                    if p_out['archive'] is not None:
-                        biom_files.append(
-                            (data_type, p_out['biom'], p_out['archive']))
+                biom_files.append((build['data_type'], build['biom_fp'], None))
+
+                if build['label'] not in pp_jobs:
+                    continue
+                p_out, p_err, rv = pp_jobs[build['label']].result()
+                p_out = p_out.rstrip()
+                # based on the set of commands ran, we could get a
+                # rv !=0 but still have a successful return from the
+                # command, thus checking both rv and p_out. Note that
+                # p_out will return either an error message or
+                # the file path to the new tree, depending on p's
+                # return code.
+                if rv != 0:
+                    raise ValueError('Error %d: %s' % (rv, p_out))
+                p_out = loads(p_out)
+
+                if p_out['archive'] is not None:
+                    biom_files.append(
+                        (build['data_type'], p_out['biom'], p_out['archive']))
 
         # return the biom files, either with or without needed tree, to
         # the user.
         return biom_files
 
+    def _post_processing_cmd(self, base_fp, info, biom_fp, features,
+                             merging_scheme, pp_cmd):
+        """Prepares the post-processing command of a biom table
+
+        Parameters
+        ----------
+        base_fp : str
+            The output folder of the analysis
+        info : str
+            The data type and algorithm of the table, used in the file names
+        biom_fp : str
+            The filepath of the table
+        features : list of str
+            The features of the table
+        merging_scheme : str
+            The merging scheme of the archive of the features
+        pp_cmd : dict
+            The post-processing command
+
+        Returns
+        -------
+        str
+            The command to run
+        """
+        # assuming all commands require archives, obtain
+        # archives once, instead of for every cmd.
+        archives = qdb.archive.Archive.retrieve_feature_values(
+            archive_merging_scheme=merging_scheme,
+            features=features)
+
+        # remove archives that SEPP could not match
+        archives = {f: loads(archives[f])
+                    for f, plc
+                    in archives.items()
+                    if plc != ''}
+
+        # since biom_fp uses base_fp as its location, assume it's
+        # suitable for other files as well.
+        output_dir = join(base_fp, info)
+        if not exists(output_dir):
+            mkdir(output_dir)
+
+        fp_archive = join(output_dir,
+                          'archive_%d.json' % (self._id))
+
+        with open(fp_archive, 'w') as out_file:
+            dump(archives, out_file)
+
+        # assume archives file is passed as:
+        # --fp_archive=<path_to_archives_file>
+        # assume output dir is passed as:
+        # --output_dir=<path_to_output_dir>
+        # assume input biom file is passed as:
+        # --fp_biom=<path_to_biom_file>
+
+        # concatenate any other parameters into a string
+        params = ' '.join(["%s=%s" % (k, v) for k, v in
+                          pp_cmd['script_params'].items()])
+
+        # append archives file and output dir parameters
+        params = ("%s --fp_biom=%s --fp_archive=%s "
+                  "--output_dir=%s" % (
+                      params, biom_fp, fp_archive, output_dir))
+
+        # if environment is successfully activated,
+        # run script with parameters
+        # script_env e.g.: 'deactivate; source activate qiita'
+        # script_path e.g.:
+        # python 'qiita_db/test/support_files/worker.py'
+        return "%s %s %s" % (
+            pp_cmd['script_env'], pp_cmd['script_path'], params)
+
     def _build_mapping_file(self, samples, rename_dup_samples=False):
         """Builds the combined mapping file for all samples
-           Code modified slightly from qiime.util.MetadataMap.__add__"""
+           Code modified slightly from qiime.util.MetadataMap.__add__
+
+        Notes
+        -----
+        The artifacts of the same prep share their mapping file and the
+        artifacts of the same study share their study metadata, so each
+        mapping file is parsed and the metadata of each study is retrieved
+        only once"""
         with qdb.sql_connection.TRN:
             all_ids = set()
             to_concat = []
+            qiime_maps = {}
+            studies_info = {}
             for aid, samps in viewitems(samples):
-                qiime_map_fp = qdb.artifact.Artifact(
-                    aid).prep_templates[0].qiime_map_fp
+                artifact = qdb.artifact.Artifact(aid)
+                qiime_map_fp = artifact.prep_templates[0].qiime_map_fp
 
                 # Parse the mapping file
-                qm = qdb.metadata_template.util.load_template_to_dataframe(
-                    qiime_map_fp, index='#SampleID')
+                if qiime_map_fp not in qiime_maps:
+                    qiime_maps[qiime_map_fp] = \
+                        qdb.metadata_template.util.load_template_to_dataframe(
+                            qiime_map_fp, index='#SampleID')
+                qm = qiime_maps[qiime_map_fp].copy()
 
                 # if we are not going to merge the duplicated samples
                 # append the aid to the sample name
@@ -1089,14 +1334,17 @@ class Analysis(qdb.base.QiitaObject):
                     all_ids.update(samps)
 
                 # appending study metadata to the analysis
-                study = qdb.artifact.Artifact(aid).study
-                study_owner = study.owner
-                study_info = study.info
-                pi = study_info['principal_investigator']
-                qm['qiita_study_title'] = study.title
-                qm['qiita_study_alias'] = study.info['study_alias']
-                qm['qiita_owner'] = study_owner.info['name']
-                qm['qiita_principal_investigator'] = pi.name
+                study = artifact.study
+                if study.id not in studies_info:
+                    study_info = study.info
+                    studies_info[study.id] = {
+                        'qiita_study_title': study.title,
+                        'qiita_study_alias': study_info['study_alias'],
+                        'qiita_owner': study.owner.info['name'],
+                        'qiita_principal_investigator':
+                            study_info['principal_investigator'].name}
+                for column, value in viewitems(studies_info[study.id]):
+                    qm[column] = value
 
                 qm = qm.loc[samps]
                 to_concat.append(qm)
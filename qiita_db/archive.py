@@ -7,10 +7,70 @@
 # -----------------------------------------------------------------------------
 
 from __future__ import division
+from collections import OrderedDict
+from threading import Lock
 
 import qiita_db as qdb
 
 
+class FeatureValueCache(object):
+    """LRU cache of the archived values of the features
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of (merging scheme, feature) values kept
+
+    Notes
+    -----
+    The values are stored together with the version of their merging scheme
+    (qiita.archive_merging_scheme.archive_version) at the time they were read,
+    and only returned for that same version. As the version is increased
+    every time that the features of the merging scheme are inserted or
+    updated, in any process, the values of an older version are never
+    returned; they just age out of the cache
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, merging_scheme, version, feature):
+        """Retrieves the value of `feature` in `merging_scheme`, or None"""
+        key = (merging_scheme, feature)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def update(self, merging_scheme, version, values):
+        """Stores the given {feature: value} of `merging_scheme`"""
+        with self._lock:
+            for feature, value in values.items():
+                key = (merging_scheme, feature)
+                self._entries[key] = (version, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all the values"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# the cache shared by all the lookups of this process
+FEATURE_VALUE_CACHE = FeatureValueCache(20000)
+
+# the number of features looked up per statement
+FEATURE_BATCH_SIZE = 10000
+
+
 class Archive(qdb.base.QiitaObject):
     r"""Extra information for any features stored in a BIOM Artifact
 
@@ -60,9 +120,35 @@ class Archive(qdb.base.QiitaObject):
             qdb.sql_connection.TRN.add(sql, [ms])
             amsi = qdb.sql_connection.TRN.execute_fetchlast()
 
-            vals = [[amsi, _id, val] for _id, val in features.items()]
+            # the features are bulk loaded in a temporary table and then
+            # upserted in a single statement; note that the temporary table
+            # lives until the end of the transaction so it is emptied first
+            # in case that this is not the first insert of the transaction
+            qdb.sql_connection.TRN.add(
+                """CREATE TEMP TABLE IF NOT EXISTS archive_feature_value_load (
+                        archive_feature varchar,
+                        archive_feature_value varchar) ON COMMIT DROP""")
             qdb.sql_connection.TRN.add(
-                "SELECT archive_upsert(%s, %s, %s)", vals, many=True)
+                "TRUNCATE archive_feature_value_load")
+            qdb.sql_connection.TRN.copy_from(
+                'archive_feature_value_load',
+                ['archive_feature', 'archive_feature_value'],
+                features.items())
+            sql = """INSERT INTO qiita.archive_feature_value (
+                        archive_merging_scheme_id, archive_feature,
+                        archive_feature_value)
+                     SELECT %s, archive_feature, archive_feature_value
+                     FROM archive_feature_value_load
+                     ON CONFLICT (archive_merging_scheme_id, archive_feature)
+                     DO UPDATE SET archive_feature_value =
+                        EXCLUDED.archive_feature_value"""
+            qdb.sql_connection.TRN.add(sql, [amsi])
+
+            # the values cached by any process are outdated now
+            sql = """UPDATE qiita.archive_merging_scheme
+                     SET archive_version = archive_version + 1
+                     WHERE archive_merging_scheme_id = %s"""
+            qdb.sql_connection.TRN.add(sql, [amsi])
             qdb.sql_connection.TRN.execute()
 
     @classmethod
@@ -146,39 +232,92 @@ class Archive(qdb.base.QiitaObject):
         features : list of str, optional
             List of features to retrieve information from the archive
 
+        Returns
+        -------
+        dict of {str: str}
+            The values of the features
+
         Notes
         -----
         If archive_merging_scheme is None it will return all
         feature values
+
+        The features are sent to the database as arrays, in batches of
+        FEATURE_BATCH_SIZE, and the values are streamed back. When both
+        archive_merging_scheme and features are given, the values found are
+        kept in FEATURE_VALUE_CACHE and only the ones missing for the current
+        version of the merging scheme are looked up
         """
         with qdb.sql_connection.TRN:
+            values = {}
+            sql = """SELECT archive_feature, archive_feature_value
+                     FROM qiita.archive_feature_value
+                     LEFT JOIN qiita.archive_merging_scheme
+                        USING (archive_merging_scheme_id) {0}
+                     ORDER BY archive_merging_scheme, archive_feature"""
             extras = []
             vals = []
+            # the version of archive_merging_scheme, only needed when the
+            # values are cached
+            version = None
             if archive_merging_scheme is not None:
                 extras.append("""archive_merging_scheme = %s""")
                 vals.append(archive_merging_scheme)
-            if features is not None:
-                extras.append("""archive_feature IN %s""")
+
+            if features is None:
+                batches = [vals or None]
+            else:
                 # depending on the method calling test retrieve_feature_values
                 # the features elements can be string or bytes; making sure
                 # everything is string for SQL
-                vals.append(
-                    tuple([f.decode('ascii') if isinstance(f, bytes) else f
-                           for f in features]))
-
-            sql = """SELECT archive_feature, archive_feature_value
-                     FROM qiita.archive_feature_value
-                     LEFT JOIN qiita.archive_merging_scheme
-                        USING (archive_merging_scheme_id) {0}
-                     ORDER BY archive_merging_scheme, archive_feature"""
+                features = {f.decode('ascii') if isinstance(f, bytes) else f
+                            for f in features}
+                if archive_merging_scheme is not None:
+                    # the version is read before the values, so the values
+                    # read are at least as recent as the version
+                    qdb.sql_connection.TRN.add(
+                        """SELECT archive_version
+                           FROM qiita.archive_merging_scheme
+                           WHERE archive_merging_scheme = %s""",
+                        [archive_merging_scheme])
+                    res = qdb.sql_connection.TRN.execute_fetchflatten()
+                    if res:
+                        version = res[0]
+                        for f in features:
+                            value = FEATURE_VALUE_CACHE.get(
+                                archive_merging_scheme, version, f)
+                            if value is not None:
+                                values[f] = value
+                        features = features - set(values)
+                features = sorted(features)
+                sql = sql.format(
+                    """JOIN unnest(%s::varchar[]) AS f(archive_feature)
+                        USING (archive_feature) {0}""")
+                batches = [[features[i:i + FEATURE_BATCH_SIZE]] + vals
+                           for i in range(
+                               0, len(features), FEATURE_BATCH_SIZE)]
 
             if extras:
                 sql = sql.format('WHERE ' + ' AND '.join(extras))
-                qdb.sql_connection.TRN.add(sql, vals)
             else:
-                qdb.sql_connection.TRN.add(sql.format(''))
-
-            return dict(qdb.sql_connection.TRN.execute_fetchindex())
+                sql = sql.format('')
+
+            found = {}
+            for args in batches:
+                qdb.sql_connection.TRN.add(sql, args)
+                # the whole archive can be huge, so we stream it
+                for rows in qdb.sql_connection.TRN.execute_stream():
+                    found.update((feature, value) for feature, value in rows)
+
+            # the values are only cached once they are committed, so the
+            # values inserted by a transaction that is rolled back are not
+            if version is not None:
+                qdb.sql_connection.TRN.add_post_commit_func(
+                    FEATURE_VALUE_CACHE.update, archive_merging_scheme,
+                    version, found)
+            values.update(found)
+
+            return values
 
     @classmethod
     def insert_features(cls, merging_scheme, features):
@@ -11,12 +11,15 @@ from future.utils import viewitems
 from itertools import chain
 from datetime import datetime
 from os import remove
-from os.path import isfile, relpath
+from os.path import isfile, isdir, getsize, relpath
+from json import dumps
 from shutil import rmtree
-from collections import namedtuple
+from collections import namedtuple, deque, OrderedDict
+from threading import Lock
 from qiita_db.util import create_nested_path
 
 import networkx as nx
+import numpy as np
 
 import qiita_db as qdb
 
@@ -26,6 +29,263 @@ from qiita_core.qiita_settings import qiita_config
 TypeNode = namedtuple('TypeNode', ['id', 'job_id', 'name', 'type'])
 
 
+class JobGraphCache(object):
+    """LRU cache of the job graphs of the artifacts
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of graphs kept
+
+    Notes
+    -----
+    Each graph is stored together with the rows of
+    qiita.artifact_descendant_jobs it was built from, and it is only returned
+    while those rows don't change. Thus, any change in the status of a job, or
+    any job or artifact added to the graph, invalidates the cached graph, even
+    if the change was done by another process.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, jobs):
+        """Retrieves the graph stored under `key` if it was built from `jobs`
+        or None otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != jobs:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, jobs, graph):
+        """Stores `graph`, built from `jobs`, under `key`"""
+        with self._lock:
+            self._entries[key] = (jobs, graph)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all the graphs"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# the cache shared by all the artifacts of this process
+JOB_GRAPH_CACHE = JobGraphCache(1000)
+
+
+class ArtifactLineage(object):
+    r"""Compact, id based, representation of the lineage of an artifact
+
+    The artifacts are only identified by their ids and the edges are kept as
+    adjacency arrays, so the lineage doesn't need to instantiate any artifact
+    and its size grows with the number of ids and edges only. The Artifact
+    objects are only created when requested, all of them at once.
+
+    Parameters
+    ----------
+    ids : np.ndarray of int64
+        The sorted ids of the artifacts in the lineage
+    order : np.ndarray of int64
+        The positions in `ids` of the artifacts, parents before children
+    child_ptr, child_idx : np.ndarray of int64
+        The children of the artifact at position i of `ids` are at positions
+        child_idx[child_ptr[i]:child_ptr[i + 1]]
+    parent_ptr, parent_idx : np.ndarray of int64
+        The parents of the artifact at position i of `ids` are at positions
+        parent_idx[parent_ptr[i]:parent_ptr[i + 1]]
+
+    Attributes
+    ----------
+    ids
+    edges
+
+    Methods
+    -------
+    from_edge_list
+    children
+    parents
+    artifacts
+    to_networkx
+    """
+    def __init__(self, ids, order, child_ptr, child_idx, parent_ptr,
+                 parent_idx):
+        self._ids = ids
+        self._order = order
+        self._child_ptr = child_ptr
+        self._child_idx = child_idx
+        self._parent_ptr = parent_ptr
+        self._parent_idx = parent_idx
+
+    @classmethod
+    def from_edge_list(cls, artifact_id, edge_list):
+        """Builds the lineage from the given `edge_list`
+
+        Parameters
+        ----------
+        artifact_id : int
+            The artifact whose lineage is `edge_list`. It is the only artifact
+            of the lineage if `edge_list` is empty
+        edge_list : list of (int, int)
+            List of (parent_artifact_id, artifact_id)
+
+        Returns
+        -------
+        ArtifactLineage
+            The lineage stored in `edge_list`
+        """
+        edges = np.array(edge_list, dtype=np.int64).reshape(-1, 2)
+        edges = np.unique(edges, axis=0)
+        ids = np.unique(np.append(edges.ravel(), artifact_id))
+        n = len(ids)
+        src = np.searchsorted(ids, edges[:, 0])
+        dst = np.searchsorted(ids, edges[:, 1])
+
+        child_ptr = np.zeros(n + 1, dtype=np.int64)
+        child_ptr[1:] = np.cumsum(np.bincount(src, minlength=n))
+        child_idx = dst[np.argsort(src, kind='stable')]
+        parent_ptr = np.zeros(n + 1, dtype=np.int64)
+        parent_ptr[1:] = np.cumsum(np.bincount(dst, minlength=n))
+        parent_idx = src[np.argsort(dst, kind='stable')]
+
+        # Sort the artifacts so the parents go before their children, which
+        # is the order in which they have been generated
+        pending = np.diff(parent_ptr)
+        queue = deque(np.flatnonzero(pending == 0))
+        order = []
+        while queue:
+            i = queue.popleft()
+            order.append(i)
+            for c in child_idx[child_ptr[i]:child_ptr[i + 1]]:
+                pending[c] -= 1
+                if pending[c] == 0:
+                    queue.append(c)
+
+        return cls(ids, np.array(order, dtype=np.int64), child_ptr, child_idx,
+                   parent_ptr, parent_idx)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __contains__(self, artifact_id):
+        return self._position(artifact_id) is not None
+
+    def _position(self, artifact_id):
+        """Returns the position of `artifact_id` in the ids, or None"""
+        pos = np.searchsorted(self._ids, artifact_id)
+        if pos < len(self._ids) and self._ids[pos] == artifact_id:
+            return pos
+        return None
+
+    @property
+    def ids(self):
+        """The ids of the artifacts, parents before their children
+
+        Returns
+        -------
+        list of int
+            The artifact ids
+        """
+        return self._ids[self._order].tolist()
+
+    @property
+    def edges(self):
+        """The edges of the lineage
+
+        Returns
+        -------
+        list of (int, int)
+            The (parent_artifact_id, artifact_id) pairs
+        """
+        src = np.repeat(self._ids, np.diff(self._child_ptr))
+        return list(zip(src.tolist(), self._ids[self._child_idx].tolist()))
+
+    def children(self, artifact_id):
+        """The children of `artifact_id` in the lineage
+
+        Parameters
+        ----------
+        artifact_id : int
+            The artifact id
+
+        Returns
+        -------
+        list of int
+            The ids of the children of the artifact
+
+        Raises
+        ------
+        KeyError
+            If `artifact_id` is not part of the lineage
+        """
+        pos = self._position(artifact_id)
+        if pos is None:
+            raise KeyError(artifact_id)
+        return self._ids[
+            self._child_idx[self._child_ptr[pos]:self._child_ptr[pos + 1]]
+        ].tolist()
+
+    def parents(self, artifact_id):
+        """The parents of `artifact_id` in the lineage
+
+        Parameters
+        ----------
+        artifact_id : int
+            The artifact id
+
+        Returns
+        -------
+        list of int
+            The ids of the parents of the artifact
+
+        Raises
+        ------
+        KeyError
+            If `artifact_id` is not part of the lineage
+        """
+        pos = self._position(artifact_id)
+        if pos is None:
+            raise KeyError(artifact_id)
+        return self._ids[
+            self._parent_idx[self._parent_ptr[pos]:self._parent_ptr[pos + 1]]
+        ].tolist()
+
+    def artifacts(self):
+        """The artifacts of the lineage, parents before their children
+
+        Returns
+        -------
+        list of qiita_db.artifact.Artifact
+            The artifacts
+        """
+        return Artifact.instantiate_many(self.ids)
+
+    def to_networkx(self):
+        """The lineage as a graph of artifacts
+
+        Returns
+        -------
+        networkx.DiGraph
+            The graph representing the artifact lineage
+        """
+        nodes = {a.id: a for a in self.artifacts()}
+        lineage = nx.DiGraph()
+        lineage.add_nodes_from(nodes[a_id] for a_id in self.ids)
+        lineage.add_edges_from(
+            (nodes[p], nodes[c]) for p, c in self.edges)
+        return lineage
+
+
 class Artifact(qdb.base.QiitaObject):
     r"""Any kind of file (or group of files) stored in the system and its
     attributes
@@ -200,6 +460,7 @@ class Artifact(qdb.base.QiitaObject):
             A new instance of Artifact
         """
         with qdb.sql_connection.TRN:
+            qdb.util.refresh_study_listing_after_commit()
             visibility_id = qdb.util.convert_to_id("sandbox", "visibility")
             atype = artifact.artifact_type
             atype_id = qdb.util.convert_to_id(atype, "artifact_type")
@@ -241,7 +502,7 @@ class Artifact(qdb.base.QiitaObject):
     @classmethod
     def create(cls, filepaths, artifact_type, name=None, prep_template=None,
                parents=None, processing_parameters=None, move_files=True,
-               analysis=None, data_type=None):
+               analysis=None, data_type=None, checksums=None):
         r"""Creates a new artifact in the system
 
         The parameters depend on how the artifact was generated:
@@ -288,6 +549,9 @@ class Artifact(qdb.base.QiitaObject):
             The data_type of the artifact in the `analysis`. It is required if
             `analysis` is provided. It should not be provided if `analysis` is
             not provided.
+        checksums : list of int, optional
+            The checksums of `filepaths` computed by the plugin, if any. They
+            are verified after the artifact has been committed
 
         Returns
         -------
@@ -382,6 +646,7 @@ class Artifact(qdb.base.QiitaObject):
             qdb.sql_connection.TRN.execute()
 
         with qdb.sql_connection.TRN:
+            qdb.util.refresh_study_listing_after_commit()
             if parents:
                 dtypes = {p.data_type for p in parents}
                 # If an artifact has parents, it can be either from the
@@ -471,7 +736,8 @@ class Artifact(qdb.base.QiitaObject):
             # Associate the artifact with its filepaths
             fp_ids = qdb.util.insert_filepaths(
                 filepaths, instance.id, artifact_type,
-                move_files=move_files, copy=(not move_files))
+                move_files=move_files, copy=(not move_files),
+                checksums=checksums)
             sql = """INSERT INTO qiita.artifact_filepath
                         (artifact_id, filepath_id)
                      VALUES (%s, %s)"""
@@ -503,15 +769,16 @@ class Artifact(qdb.base.QiitaObject):
         with qdb.sql_connection.TRN:
             # This will fail if the artifact with id=artifact_id doesn't exist
             instance = cls(artifact_id)
+            qdb.util.refresh_study_listing_after_commit()
 
             # Check if the artifact is public
             if instance.visibility == 'public':
                 raise qdb.exceptions.QiitaDBArtifactDeletionError(
                     artifact_id, "it is public")
 
-            all_artifacts = list(instance.descendants.nodes())
-            all_artifacts.reverse()
-            all_ids = tuple([a.id for a in all_artifacts])
+            # the children go first
+            all_ids = tuple(reversed(instance.descendants_lineage.ids))
+            all_artifacts = cls.instantiate_many(all_ids)
 
             # Check if this or any of the children have been analyzed
             sql = """SELECT email, analysis_id
@@ -626,6 +893,8 @@ class Artifact(qdb.base.QiitaObject):
             # Delete the rows in the artifact table
             sql = "DELETE FROM qiita.artifact WHERE artifact_id IN %s"
             qdb.sql_connection.TRN.add(sql, [all_ids])
+            for aid in all_ids:
+                cls._forget(aid)
 
     @property
     def name(self):
@@ -734,6 +1003,7 @@ class Artifact(qdb.base.QiitaObject):
         only applies when the new visibility is more open than before.
         """
         with qdb.sql_connection.TRN:
+            qdb.util.refresh_study_listing_after_commit()
             # first let's check that this is a valid visibility
             vis_id = qdb.util.convert_to_id(value, "visibility")
             study = self.study
@@ -759,7 +1029,7 @@ class Artifact(qdb.base.QiitaObject):
             root_id = qdb.sql_connection.TRN.execute_fetchlast()
             root = qdb.artifact.Artifact(root_id)
             # these are the ids of all the children from the root
-            ids = [a.id for a in root.descendants.nodes()]
+            ids = root.descendants_lineage.ids
 
             sql = """UPDATE qiita.artifact
                      SET visibility_id = %s
@@ -911,6 +1181,8 @@ class Artifact(qdb.base.QiitaObject):
             sql_args = [[sample, self.id, accession]
                         for sample, accession in viewitems(values)]
             qdb.sql_connection.TRN.add(sql, sql_args, many=True)
+            # the EBI submission status is shown in the study listing
+            qdb.util.mark_study_listing_modified([self.study.id])
             qdb.sql_connection.TRN.execute()
 
     @property
@@ -990,6 +1262,117 @@ class Artifact(qdb.base.QiitaObject):
         return qdb.util.retrieve_filepaths(
             "artifact_filepath", "artifact_id", self.id, sort='ascending')
 
+    @classmethod
+    def download_manifests(cls, artifact_ids):
+        """The files that need to be zipped to download the given artifacts
+
+        Parameters
+        ----------
+        artifact_ids : list of int
+            The artifact ids
+
+        Returns
+        -------
+        dict of {int: list of (str, str, str, str)}
+            For each artifact, the path of each of its files (relative to the
+            base data directory if it is inside it), the path of the file in
+            the zip, its checksum ('-' if unknown) and its size
+
+        Notes
+        -----
+        The manifest lists the files of the artifact, except the tgz files as
+        their contents are listed too, the files inside the directories of
+        the artifact and the QIIME mapping files of its preparations.
+
+        The manifests are computed the first time that they are requested
+        and stored in qiita.artifact_download_manifest; the database drops
+        the manifest of an artifact whenever its files or the mapping files
+        of its preparations change. A manifest is only stored if its files
+        didn't change while it was computed, as the previous manifest could
+        have already been dropped, and if no other request stored it first.
+        """
+        with qdb.sql_connection.TRN:
+            manifests = {}
+            if not artifact_ids:
+                return manifests
+
+            sql = """SELECT artifact_id, manifest
+                     FROM qiita.artifact_download_manifest
+                     WHERE artifact_id IN %s"""
+            qdb.sql_connection.TRN.add(sql, [tuple(artifact_ids)])
+            for aid, manifest in qdb.sql_connection.TRN.execute_fetchindex():
+                manifests[aid] = [tuple(x) for x in manifest]
+
+            missing = [aid for aid in artifact_ids if aid not in manifests]
+            if missing:
+                # the keys are read before the files, so the manifests are
+                # at least as recent as the keys
+                sql = """SELECT artifact_id,
+                            qiita.artifact_download_manifest_key(artifact_id)
+                         FROM unnest(%s::bigint[]) AS artifact_id"""
+                qdb.sql_connection.TRN.add(sql, [missing])
+                keys = dict(qdb.sql_connection.TRN.execute_fetchindex())
+
+                basedir = qdb.util.get_db_files_base_dir()
+                for aid in missing:
+                    manifests[aid] = cls(aid)._download_manifest(basedir)
+
+                sql = """INSERT INTO qiita.artifact_download_manifest
+                            (artifact_id, manifest)
+                         SELECT %s, %s
+                         WHERE qiita.artifact_download_manifest_key(%s) = %s
+                         ON CONFLICT (artifact_id) DO NOTHING"""
+                qdb.sql_connection.TRN.add(
+                    sql, [[aid, dumps(manifests[aid]), aid, keys[aid]]
+                          for aid in missing], many=True)
+                qdb.sql_connection.TRN.execute()
+
+            return manifests
+
+    def _download_manifest(self, basedir):
+        """Computes the manifest of the artifact, see download_manifests
+
+        Parameters
+        ----------
+        basedir : str
+            The base directory of all db files
+
+        Returns
+        -------
+        list of (str, str, str, str)
+            The files of the artifact
+        """
+        basedir_len = len(basedir) + 1
+        to_download = []
+        for x in self.filepaths:
+            # ignore if tgz as they could create problems and the
+            # raw data is in the folder
+            if x['fp_type'] == 'tgz':
+                continue
+            if isdir(x['fp']):
+                # If we have a directory, we actually need to list all the
+                # files from the directory so NGINX can actually download all
+                # of them
+                to_download.extend(
+                    qdb.util.list_download_files(x['fp'], basedir))
+            elif x['fp'].startswith(basedir):
+                spath = x['fp'][basedir_len:]
+                to_download.append(
+                    (spath, spath, str(x['checksum']), str(x['fp_size'])))
+            else:
+                to_download.append(
+                    (x['fp'], x['fp'], str(x['checksum']), str(x['fp_size'])))
+
+        for pt in self.prep_templates:
+            qmf = pt.qiime_map_fp
+            if qmf is not None:
+                sqmf = qmf
+                if qmf.startswith(basedir):
+                    sqmf = qmf[basedir_len:]
+                fname = 'mapping_files/%s_mapping_file.txt' % self.id
+                to_download.append((sqmf, fname, '-', str(getsize(qmf))))
+        return to_download
+
     @property
     def html_summary_fp(self):
         """Returns the HTML summary filepath
@@ -1095,27 +1478,17 @@ class Artifact(qdb.base.QiitaObject):
         networkx.DiGraph
             The graph representing the artifact lineage stored in `edge_list`
         """
-        lineage = nx.DiGraph()
         # In case the edge list is empty, only 'self' is present in the graph
-        if edge_list:
-            # By creating all the artifacts here we are saving DB calls
-            nodes = {a_id: Artifact(a_id)
-                     for a_id in set(chain.from_iterable(edge_list))}
-
-            for parent, child in edge_list:
-                lineage.add_edge(nodes[parent], nodes[child])
-        else:
-            lineage.add_node(self)
-
-        return lineage
+        return ArtifactLineage.from_edge_list(
+            self.id, edge_list).to_networkx()
 
     @property
-    def ancestors(self):
-        """Returns the ancestors of the artifact
+    def ancestors_lineage(self):
+        """Returns the ancestors of the artifact, by id
 
         Returns
         -------
-        networkx.DiGraph
+        ArtifactLineage
             The ancestors of the artifact
         """
         with qdb.sql_connection.TRN:
@@ -1123,15 +1496,15 @@ class Artifact(qdb.base.QiitaObject):
                      FROM qiita.artifact_ancestry(%s)"""
             qdb.sql_connection.TRN.add(sql, [self.id])
             edges = qdb.sql_connection.TRN.execute_fetchindex()
-        return self._create_lineage_graph_from_edge_list(edges)
+        return ArtifactLineage.from_edge_list(self.id, edges)
 
     @property
-    def descendants(self):
-        """Returns the descendants of the artifact
+    def descendants_lineage(self):
+        """Returns the descendants of the artifact, by id
 
         Returns
         -------
-        networkx.DiGraph
+        ArtifactLineage
             The descendants of the artifact
         """
         with qdb.sql_connection.TRN:
@@ -1139,7 +1512,31 @@ class Artifact(qdb.base.QiitaObject):
                      FROM qiita.artifact_descendants(%s)"""
             qdb.sql_connection.TRN.add(sql, [self.id])
             edges = qdb.sql_connection.TRN.execute_fetchindex()
-        return self._create_lineage_graph_from_edge_list(edges)
+        return ArtifactLineage.from_edge_list(self.id, edges)
+
+    @property
+    def ancestors(self):
+        """Returns the ancestors of the artifact
+
+        Returns
+        -------
+        networkx.DiGraph
+            The ancestors of the artifact
+        """
+        with qdb.sql_connection.TRN:
+            return self.ancestors_lineage.to_networkx()
+
+    @property
+    def descendants(self):
+        """Returns the descendants of the artifact
+
+        Returns
+        -------
+        networkx.DiGraph
+            The descendants of the artifact
+        """
+        with qdb.sql_connection.TRN:
+            return self.descendants_lineage.to_networkx()
 
     @property
     def descendants_with_jobs(self):
@@ -1149,110 +1546,134 @@ class Artifact(qdb.base.QiitaObject):
         -------
         networkx.DiGraph
             The descendants of the artifact
-        """
-        def _add_edge(edges, src, dest):
-            """Aux function to add the edge (src, dest) to edges"""
-            edge = (src, dest)
-            if edge not in edges:
-                edges.add(edge)
 
+        Notes
+        -----
+        All the jobs are retrieved with a single query and the graph is kept
+        in JOB_GRAPH_CACHE until any of those jobs changes, so the returned
+        graph is frozen as it is shared by all the callers.
+        """
         with qdb.sql_connection.TRN:
-            sql = """SELECT processing_job_id, input_id, output_id
-                     FROM qiita.artifact_descendants_with_jobs(%s)"""
+            sql = """SELECT processing_job_id, processing_job_status,
+                            command_name, hidden, pending, input_ids,
+                            output_ids, children_ids, output_names,
+                            output_types
+                     FROM qiita.artifact_descendant_jobs(%s)"""
             qdb.sql_connection.TRN.add(sql, [self.id])
-            sql_edges = qdb.sql_connection.TRN.execute_fetchindex()
-
-            lineage = nx.DiGraph()
-            edges = set()
-            nodes = {}
-            if sql_edges:
-                for jid, pid, cid in sql_edges:
-                    if jid not in nodes:
-                        nodes[jid] = ('job',
-                                      qdb.processing_job.ProcessingJob(jid))
-                    if pid not in nodes:
-                        nodes[pid] = ('artifact', qdb.artifact.Artifact(pid))
-                    if cid not in nodes:
-                        nodes[cid] = ('artifact', qdb.artifact.Artifact(cid))
-                    edges.add((nodes[pid], nodes[jid]))
-                    edges.add((nodes[jid], nodes[cid]))
-            else:
-                nodes[self.id] = ('artifact', self)
-                lineage.add_node(nodes[self.id])
-
-            # The code above returns all the jobs that have been successfully
-            # executed. We need to add all the jobs that are in all the other
-            # status. Approach: Loop over all the artifacts and add all the
-            # jobs that have been attached to them.
-            visited = set()
-            queue = list(nodes.keys())
-            while queue:
-                current = queue.pop(0)
-                if current not in visited:
-                    visited.add(current)
-                    n_type, n_obj = nodes[current]
-                    if n_type == 'artifact':
-                        # Add all the jobs to the queue
-                        for job in n_obj.jobs():
-                            queue.append(job.id)
-                            if job.id not in nodes:
-                                nodes[job.id] = ('job', job)
-
-                    elif n_type == 'job':
-                        # Ignore the generate summary jobs
-                        if n_obj.command.name == 'Generate HTML summary':
-                            continue
-                        jstatus = n_obj.status
-                        # If the job is in success we don't need to do anything
-                        # else since it would've been added by the code above
-                        if jstatus != 'success':
-                            # Connect the job with his input artifacts, the
-                            # input artifacts may or may not exist yet, so we
-                            # need to check both the input_artifacts and the
-                            # pending properties
-                            for in_art in n_obj.input_artifacts:
-                                _add_edge(edges, nodes[in_art.id],
-                                          nodes[n_obj.id])
-
-                            pending = n_obj.pending
-                            for pred_id in pending:
-                                for pname in pending[pred_id]:
-                                    in_node_id = '%s:%s' % (
-                                        pred_id, pending[pred_id][pname])
-                                    _add_edge(edges, nodes[in_node_id],
-                                              nodes[n_obj.id])
-
-                            if jstatus != 'error':
-                                # If the job is not errored, we can add the
-                                # future outputs and the children jobs to
-                                # the graph.
-
-                                # Add all the job outputs as new nodes
-                                for o_name, o_type in n_obj.command.outputs:
-                                    node_id = '%s:%s' % (n_obj.id, o_name)
-                                    node = TypeNode(
-                                        id=node_id, job_id=n_obj.id,
-                                        name=o_name, type=o_type)
-                                    queue.append(node_id)
-                                    if node_id not in nodes:
-                                        nodes[node_id] = ('type', node)
-
-                                # Add all his children jobs to the queue
-                                for cjob in n_obj.children:
-                                    queue.append(cjob.id)
-                                    if cjob.id not in nodes:
-                                        nodes[cjob.id] = ('job', cjob)
-                    elif n_type == 'type':
-                        # Connect this 'future artifact' with the job that will
-                        # generate it
-                        _add_edge(edges, nodes[n_obj.job_id], nodes[current])
-                    else:
-                        raise ValueError('Unrecognized type: %s' % n_type)
-
-        # Add all edges to the lineage graph - adding the edges creates the
-        # nodes in networkx
-        for source, dest in edges:
-            lineage.add_edge(source, dest)
+            jobs = [tuple(r)
+                    for r in qdb.sql_connection.TRN.execute_fetchindex()]
+
+            key = (qiita_config.portal, self.id)
+            lineage = JOB_GRAPH_CACHE.get(key, jobs)
+            if lineage is None:
+                lineage = nx.freeze(self._create_job_graph(jobs))
+                JOB_GRAPH_CACHE.put(key, jobs, lineage)
+
+        return lineage
+
+    def _create_job_graph(self, jobs):
+        """Generates the artifact/job graph from the descendant jobs
+
+        Parameters
+        ----------
+        jobs : list of tuple
+            The rows returned by qiita.artifact_descendant_jobs
+
+        Returns
+        -------
+        networkx.DiGraph
+            The graph of the descendants of the artifact and their jobs
+        """
+        jobs = {j[0]: j for j in jobs}
+        consumers = {}
+        for jid, j in viewitems(jobs):
+            for a_id in j[5]:
+                consumers.setdefault(a_id, []).append(jid)
+
+        # The nodes are identified by (node type, id) until all the edges are
+        # known, and a dict is used as an ordered set of edges
+        edges = OrderedDict()
+        # First, add all the artifacts generated from this one together with
+        # the jobs that generated them
+        queue = deque([self.id])
+        artifacts = [self.id]
+        seen = {self.id}
+        while queue:
+            a_id = queue.popleft()
+            for jid in consumers.get(a_id, []):
+                for out_id in jobs[jid][6]:
+                    edges[(('artifact', a_id), ('job', jid))] = None
+                    edges[(('job', jid), ('artifact', out_id))] = None
+                    if out_id not in seen:
+                        seen.add(out_id)
+                        artifacts.append(out_id)
+                        queue.append(out_id)
+
+        # Then, add all the jobs that are attached to those artifacts in any
+        # other status, together with the outputs that the jobs that didn't
+        # fail will generate and their children jobs. Note that the hidden
+        # jobs are ignored, unless they already generated some artifact.
+        types = {}
+        pending = []
+        queue = deque(
+            jid for jid in chain.from_iterable(
+                consumers.get(a_id, []) for a_id in artifacts)
+            if not jobs[jid][3] or jobs[jid][6])
+        visited = set()
+        while queue:
+            jid = queue.popleft()
+            if jid in visited or jid not in jobs:
+                continue
+            visited.add(jid)
+            _, status, cmd_name, _, job_pending, inputs, _, children, \
+                out_names, out_types = jobs[jid]
+            # Ignore the generate summary jobs, and the jobs in success as
+            # they have been added above
+            if cmd_name == 'Generate HTML summary' or status == 'success':
+                continue
+
+            node = ('job', jid)
+
+            # Connect the job with its input artifacts, the input artifacts
+            # may or may not exist yet, so we need to check both the inputs
+            # and the pending outputs of its predecessors
+            for a_id in inputs:
+                edges[(('artifact', a_id), node)] = None
+            for pred_id, params in viewitems(job_pending or {}):
+                for out_name in params.values():
+                    pending.append(('%s:%s' % (pred_id, out_name), node))
+
+            if status != 'error':
+                # Add all the job outputs as new nodes, and all its children
+                # jobs to the queue
+                for o_name, o_type in zip(out_names, out_types):
+                    t_id = '%s:%s' % (jid, o_name)
+                    types[t_id] = TypeNode(
+                        id=t_id, job_id=jid, name=o_name, type=o_type)
+                    edges[(node, ('type', t_id))] = None
+                queue.extend(children)
+
+        # The outputs of the predecessors are known now
+        for t_id, node in pending:
+            if t_id in types:
+                edges[(('type', t_id), node)] = None
+
+        # Create all the objects at once
+        nodes = set(chain.from_iterable(edges))
+        a_ids = sorted(i for t, i in nodes if t == 'artifact')
+        j_ids = sorted(i for t, i in nodes if t == 'job')
+        objects = {('type', t_id): ('type', t) for t_id, t in viewitems(types)}
+        objects.update(
+            (('artifact', a.id), ('artifact', a))
+            for a in Artifact.instantiate_many(a_ids))
+        objects.update(
+            (('job', j.id), ('job', j))
+            for j in qdb.processing_job.ProcessingJob.instantiate_many(j_ids))
+
+        lineage = nx.DiGraph()
+        lineage.add_node(('artifact', self))
+        lineage.add_edges_from(
+            (objects[src], objects[dest]) for src, dest in edges)
 
         return lineage
 
@@ -48,8 +48,10 @@ class QiitaObject(object):
     create
     delete
     exists
+    instantiate_many
     _check_subclass
     _check_id
+    _check_many
     __eq__
     __neq__
 
@@ -136,6 +138,109 @@ class QiitaObject(object):
             qdb.sql_connection.TRN.add(sql, [id_])
             return qdb.sql_connection.TRN.execute_fetchlast()
 
+    @classmethod
+    def _check_many(cls, ids):
+        r"""Checks the existence and portal of several ids in a single query
+
+        Parameters
+        ----------
+        ids : list of object
+            The IDs to test
+
+        Returns
+        -------
+        dict of {object: bool}
+            For each ID present on the database, whether it is accessible in
+            the current portal. IDs not present on the database are missing
+            from the dict.
+
+        Notes
+        -----
+        Subclasses overwriting `_check_id` should overwrite this function too.
+        """
+        with qdb.sql_connection.TRN:
+            if cls._portal_table is None:
+                sql = """SELECT {0}_id, TRUE
+                         FROM qiita.{0}
+                         WHERE {0}_id IN %s""".format(cls._table)
+                args = [tuple(ids)]
+            else:
+                sql = """SELECT t.{0}_id, EXISTS(
+                            SELECT *
+                            FROM qiita.{1} p
+                                JOIN qiita.portal_type USING (portal_type_id)
+                            WHERE p.{0}_id = t.{0}_id AND portal = %s)
+                         FROM qiita.{0} t
+                         WHERE t.{0}_id IN %s""".format(cls._table,
+                                                        cls._portal_table)
+                args = [qiita_config.portal, tuple(ids)]
+            qdb.sql_connection.TRN.add(sql, args)
+            return dict(qdb.sql_connection.TRN.execute_fetchindex())
+
+    @classmethod
+    def _forget(cls, id_):
+        r"""Removes `id_` from the identity map of the current transaction
+
+        Parameters
+        ----------
+        id_ : object
+            The ID of the object that has been deleted
+
+        Notes
+        -----
+        Subclasses should call this function from their `delete` method, so
+        the deleted object can't be instantiated again within the transaction
+        """
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.identity_map.pop((cls._table, id_), None)
+
+    @classmethod
+    def instantiate_many(cls, ids):
+        r"""Instantiates several objects checking all of them at once
+
+        Parameters
+        ----------
+        ids : iterable of int, long, str, or unicode
+            The object identifiers
+
+        Returns
+        -------
+        list of QiitaObject
+            The objects, in the same order as `ids`
+
+        Raises
+        ------
+        QiitaDBUnknownIDError
+            If any of the ids does not correspond to any object
+        QiitaDBError
+            If any of the objects is inaccessible in the current portal
+        """
+        cls._check_subclass()
+        ids = [int(i) if isinstance(i, str) and i.isdigit() else i
+               for i in ids]
+        with qdb.sql_connection.TRN:
+            identity_map = qdb.sql_connection.TRN.identity_map
+            portal = qiita_config.portal
+            missing = {i for i in ids
+                       if portal not in identity_map.get((cls._table, i), ())}
+            if missing:
+                found = cls._check_many(missing)
+                for i in ids:
+                    if i not in missing:
+                        continue
+                    if i not in found:
+                        raise qdb.exceptions.QiitaDBUnknownIDError(
+                            i, cls._table)
+                    if not found[i]:
+                        raise qdb.exceptions.QiitaDBError(
+                            "%s with id %s inaccessible in current portal: %s"
+                            % (cls.__name__, i, portal))
+                for i in missing:
+                    identity_map.setdefault((cls._table, i), set()).add(portal)
+
+            # the checks are served from the identity map at this point
+            return [cls(i) for i in ids]
+
     def _check_portal(self, id_):
         """Checks that object is accessible in current portal
 
@@ -187,13 +292,21 @@ class QiitaObject(object):
 
         with qdb.sql_connection.TRN:
             self._check_subclass()
-            if not self._check_id(id_):
-                raise qdb.exceptions.QiitaDBUnknownIDError(id_, self._table)
-
-            if not self._check_portal(id_):
-                raise qdb.exceptions.QiitaDBError(
-                    "%s with id %d inaccessible in current portal: %s"
-                    % (self.__class__.__name__, id_, qiita_config.portal))
+            # The objects already checked in the current transaction are
+            # registered in its identity map, so we don't check them again
+            key = (self._table, id_)
+            identity_map = qdb.sql_connection.TRN.identity_map
+            if qiita_config.portal not in identity_map.get(key, ()):
+                if not self._check_id(id_):
+                    raise qdb.exceptions.QiitaDBUnknownIDError(
+                        id_, self._table)
+
+                if not self._check_portal(id_):
+                    raise qdb.exceptions.QiitaDBError(
+                        "%s with id %d inaccessible in current portal: %s"
+                        % (self.__class__.__name__, id_, qiita_config.portal))
+
+                identity_map.setdefault(key, set()).add(qiita_config.portal)
 
         self._id = id_
 
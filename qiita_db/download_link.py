@@ -76,6 +76,7 @@ class DownloadLink(qdb.base.QiitaObject):
             sql = """DELETE FROM qiita.{0} WHERE jti=%s""".format(cls._table)
             qdb.sql_connection.TRN.add(sql, [jti])
             qdb.sql_connection.TRN.execute()
+            cls._forget(jti)
 
     @classmethod
     def exists(cls, jti):
@@ -318,6 +318,11 @@ def drop_and_rebuild_tst_database(drop_labcontrol=False):
     """
     with qdb.sql_connection.TRN:
         r_client.flushdb()
+        # the modification counters of the metadata templates are going to
+        # start over, so the cached templates can't be trusted anymore
+        qdb.metadata_template.cache.METADATA_CACHE.clear()
+        qdb.archive.FEATURE_VALUE_CACHE.clear()
+        qdb.artifact.JOB_GRAPH_CACHE.clear()
         # Drop the schema, note that we are also going to drop labman because
         # if not it will raise an error if you have both systems on your
         # computer due to foreing keys
@@ -11,6 +11,7 @@ from string import ascii_letters, digits
 import datetime
 from random import SystemRandom
 import functools
+from time import time
 from traceback import format_exception
 
 from tornado.web import RequestHandler
@@ -21,6 +22,83 @@ from qiita_core.exceptions import (IncorrectPasswordError, IncorrectEmailError,
 import qiita_db as qdb
 
 
+# Requests allowed per day to the password grant type tokens
+DAILY_REQUEST_LIMIT = 5000
+# Seconds a validated client token is trusted without asking redis again.
+# Plugins call the heartbeat and step handlers continuously, so this saves
+# most of the redis round trips of the plugin API
+TOKEN_CACHE_TTL = 10
+# token: time until which it is trusted, as returned by time()
+_TOKEN_CACHE = {}
+
+# Validates the token in KEYS[1] and, if it is a password grant type token,
+# decrements its daily limit in the same round trip. Returns nil if the token
+# doesn't exist or {grant_type, remaining requests, milliseconds to expire}.
+# The daily limit is initialized to ARGV[1] requests if it doesn't exist
+_VALIDATE_TOKEN_LUA = """
+local info = redis.call('HMGET', KEYS[1], 'grant_type', 'client_id', 'user')
+if not info[1] then
+    return nil
+end
+local remaining = -1
+if info[1] == 'password' then
+    local limit_key = info[2] .. '_' .. info[3] .. '_daily_limit'
+    if redis.call('EXISTS', limit_key) == 0 then
+        redis.call('SETEX', limit_key, 86400, ARGV[1])
+        remaining = tonumber(ARGV[1])
+    else
+        remaining = redis.call('DECR', limit_key)
+    end
+end
+return {info[1], remaining, redis.call('PTTL', KEYS[1])}
+"""
+_validate_token_script = None
+
+
+def _validate_token(token):
+    """Validates the token, applying the daily limit of password tokens
+
+    Parameters
+    ----------
+    token : str
+        The access token
+
+    Returns
+    -------
+    str or None
+        The error message if the token is not valid, None otherwise
+    """
+    global _validate_token_script
+
+    now = time()
+    if _TOKEN_CACHE.get(token, 0) > now:
+        return None
+
+    if _validate_token_script is None:
+        _validate_token_script = r_client.register_script(_VALIDATE_TOKEN_LUA)
+    res = _validate_token_script(keys=[token], args=[DAILY_REQUEST_LIMIT])
+    if not res:
+        # token has timed out or never existed
+        return 'Oauth2 error: token has timed out'
+
+    grant_type, remaining, pttl = res
+    if grant_type == b'password':
+        # the requests of password tokens are counted, so they can't be
+        # served from the cache
+        if int(remaining) <= 0:
+            return 'Oauth2 error: daily request limit reached'
+        return None
+
+    if len(_TOKEN_CACHE) > 10000:
+        for key in [k for k, v in _TOKEN_CACHE.items() if v <= now]:
+            del _TOKEN_CACHE[key]
+    # never trust the token beyond its expiration; pttl is negative if the
+    # token has no expiration
+    ttl = TOKEN_CACHE_TTL if pttl < 0 else min(TOKEN_CACHE_TTL, pttl / 1000)
+    _TOKEN_CACHE[token] = now + ttl
+    return None
+
+
 def _oauth_error(handler, error_msg, error):
     """Set expected status and error formatting for Oauth2 style error
 
@@ -82,29 +160,10 @@ def authenticate_oauth(f):
                          'invalid_grant')
             return
 
-        token = token_info[1]
-        db_token = r_client.hgetall(token)
-        if not db_token:
-            # token has timed out or never existed
-            _oauth_error(handler, 'Oauth2 error: token has timed out',
-                         'invalid_grant')
+        error_msg = _validate_token(token_info[1])
+        if error_msg is not None:
+            _oauth_error(handler, error_msg, 'invalid_grant')
             return
-        # Check daily rate limit for key if password style key
-        if db_token[b'grant_type'] == b'password':
-            limit_key = '%s_%s_daily_limit' % (
-                db_token[b'client_id'].decode('ascii'),
-                db_token[b'user'].decode('ascii'))
-            limiter = r_client.get(limit_key)
-            if limiter is None:
-                # Set limit to 5,000 requests per day
-                r_client.setex(limit_key, 86400, 5000)
-            else:
-                r_client.decr(limit_key)
-                if int(r_client.get(limit_key)) <= 0:
-                    _oauth_error(
-                        handler, 'Oauth2 error: daily request limit reached',
-                        'invalid_grant')
-                    return
 
         return f(handler, *args, **kwargs)
     return wrapper
@@ -221,15 +280,14 @@ class TokenAuthHandler(OauthBaseHandler):
         if user:
             token_info['user'] = user
 
-        r_client.hmset(token, token_info)
-        r_client.expire(token, timeout)
+        pipe = r_client.pipeline()
+        pipe.hmset(token, token_info)
+        pipe.expire(token, timeout)
         if grant_type == 'password':
-            # Check if client has access limit key, and if not, create it
+            # Create the client access limit key if it doesn't exist
             limit_key = '%s_%s_daily_limit' % (client_id, user)
-            limiter = r_client.get(limit_key)
-            if limiter is None:
-                # Set limit to 5,000 requests per day
-                r_client.setex(limit_key, 86400, 5000)
+            pipe.set(limit_key, DAILY_REQUEST_LIMIT, ex=86400, nx=True)
+        pipe.execute()
 
         self.write({'access_token': token,
                     'token_type': 'Bearer',
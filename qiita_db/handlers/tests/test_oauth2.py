@@ -9,6 +9,7 @@ from unittest import main
 from json import loads
 
 from qiita_core.qiita_settings import r_client
+from qiita_db.handlers import oauth2
 
 from qiita_pet.test.tornado_test_base import TestHandlerBase
 
@@ -47,13 +48,35 @@ class OAuth2BaseHandlerTests(TestHandlerBase):
             'Authorization': 'Bearer ' + self.client_token})
         self.assertEqual(obs.code, 200)
 
+    def test_authenticate_header_client_cached(self):
+        oauth2._TOKEN_CACHE.clear()
+        obs = self.get('/qiita_db/artifacts/1/', headers={
+            'Authorization': 'Bearer ' + self.client_token})
+        self.assertEqual(obs.code, 200)
+        self.assertIn(self.client_token, oauth2._TOKEN_CACHE)
+
+        # the validated token is served from the cache
+        r_client.delete(self.client_token)
+        obs = self.get('/qiita_db/artifacts/1/', headers={
+            'Authorization': 'Bearer ' + self.client_token})
+        self.assertEqual(obs.code, 200)
+
+        oauth2._TOKEN_CACHE.clear()
+        obs = self.get('/qiita_db/artifacts/1/', headers={
+            'Authorization': 'Bearer ' + self.client_token})
+        self.assertEqual(obs.code, 400)
+        exp = {'error': 'invalid_grant',
+               'error_description': 'Oauth2 error: token has timed out'}
+        self.assertEqual(loads(obs.body), exp)
+
     def test_authenticate_header_username(self):
         obs = self.get('/qiita_db/artifacts/1/', headers={
             'Authorization': 'Bearer ' + self.user_token})
         self.assertEqual(obs.code, 200)
 
-        # Check rate limiting works
+        # Check rate limiting works, password tokens are never cached
         self.assertEqual(int(r_client.get(self.user_rate_key)), 1)
+        self.assertNotIn(self.user_token, oauth2._TOKEN_CACHE)
         r_client.setex('testuser_test@foo.bar_daily_limit', 1, 0)
         obs = self.get('/qiita_db/artifacts/100/', headers={
             'Authorization': 'Bearer ' + self.user_token})
@@ -24,20 +24,25 @@ Methods
 # -----------------------------------------------------------------------------
 from __future__ import division
 
-from os import stat, rename
-from os.path import join, relpath, basename
-from time import strftime, localtime
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from os import stat, rename, listdir, remove
+from os.path import join, relpath, basename, exists
+from time import strftime, localtime, perf_counter
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 from base64 import b64encode
 from urllib.parse import quote
-from io import BytesIO
+from io import BytesIO, StringIO
 from datetime import datetime
-from collections import defaultdict, Counter
-from tarfile import open as topen, TarInfo
+from collections import defaultdict, Counter, OrderedDict
+from tarfile import (open as topen, TarInfo, BLOCKSIZE, DEFAULT_FORMAT,
+                     ENCODING, NUL)
+from gzip import compress as gzip_compress
+import zlib
 from hashlib import md5
 from re import sub
-from json import loads, dump, dumps
+from json import loads, load, dump, dumps
 
 from qiita_db.util import create_nested_path
 from qiita_core.qiita_settings import qiita_config, r_client
@@ -152,7 +157,7 @@ def validate_filepath_access_by_user(user, filepath_id):
                 if (a.visibility == 'public' or a.study.has_access(user)):
                     return True
                 else:
-                    for c in a.descendants.nodes():
+                    for c in a.descendants_lineage.artifacts():
                         if ((c.visibility == 'public' or
                              c.study.has_access(user))):
                             return True
@@ -167,84 +172,249 @@ def validate_filepath_access_by_user(user, filepath_id):
         return False
 
 
-def update_redis_stats():
-    """Generate the system stats and save them in redis
+def _get_template_counts():
+    """Counts the studies and samples, by status, using aggregate queries
 
     Returns
     -------
-    list of str
-        artifact filepaths that are not present in the file system
+    dict
+        The number_studies, number_of_samples, per_data_type_stats,
+        num_studies_ebi, num_samples_ebi and number_samples_ebi_prep stats
+
+    Notes
+    -----
+    Only the studies with a sample template are counted. The status of a prep
+    template is inferred from the visibility of its artifact, as
+    PrepTemplate.status does
     """
-    STUDY = qdb.study.Study
+    with qdb.sql_connection.TRN:
+        # samples submitted to EBI-ENA, per study
+        sql = """SELECT study_id, COUNT(ebi_sample_accession)
+                 FROM qiita.study_sample
+                 GROUP BY study_id"""
+        qdb.sql_connection.TRN.add(sql)
+        ebi_samples = dict(qdb.sql_connection.TRN.execute_fetchindex())
+
+        # distinct samples per study and prep status; the preps without
+        # samples are also returned as they still define the study status
+        sql = """SELECT study_id,
+                        CASE WHEN visibility IN (
+                            'public', 'private', 'awaiting_approval')
+                            THEN visibility ELSE 'sandbox' END AS status,
+                        COUNT(DISTINCT pts.sample_id)
+                 FROM qiita.study_prep_template
+                    JOIN qiita.prep_template USING (prep_template_id)
+                    LEFT JOIN qiita.artifact USING (artifact_id)
+                    LEFT JOIN qiita.visibility USING (visibility_id)
+                    LEFT JOIN qiita.prep_template_sample pts USING (
+                        prep_template_id)
+                 WHERE study_id IN (SELECT study_id FROM qiita.study_sample)
+                 GROUP BY study_id, status"""
+        qdb.sql_connection.TRN.add(sql)
+        samples_status = defaultdict(dict)
+        for study_id, status, count in (
+                qdb.sql_connection.TRN.execute_fetchindex()):
+            samples_status[study_id][status] = count
+
+        # samples in public preps, per data type
+        sql = """SELECT data_type, COUNT(pts.sample_id)
+                 FROM qiita.prep_template
+                    JOIN qiita.data_type USING (data_type_id)
+                    JOIN qiita.artifact USING (artifact_id)
+                    JOIN qiita.visibility USING (visibility_id)
+                    JOIN qiita.prep_template_sample pts USING (
+                        prep_template_id)
+                    JOIN qiita.study_prep_template USING (prep_template_id)
+                 WHERE visibility = 'public'
+                    AND study_id IN (SELECT study_id FROM qiita.study_sample)
+                 GROUP BY data_type"""
+        qdb.sql_connection.TRN.add(sql)
+        per_data_type_stats = Counter(
+            dict(qdb.sql_connection.TRN.execute_fetchindex()))
+
+        # experiments (samples in preps) submitted to EBI-ENA
+        sql = """SELECT COUNT(pts.ebi_experiment_accession)
+                 FROM qiita.prep_template_sample pts
+                    JOIN qiita.study_prep_template USING (prep_template_id)
+                 WHERE study_id IN (SELECT study_id FROM qiita.study_sample)"""
+        qdb.sql_connection.TRN.add(sql)
+        number_samples_ebi_prep = qdb.sql_connection.TRN.execute_fetchlast()
 
     number_studies = {'public': 0, 'private': 0, 'sandbox': 0}
     number_of_samples = {'public': 0, 'private': 0, 'sandbox': 0}
-    num_studies_ebi = 0
-    num_samples_ebi = 0
-    number_samples_ebi_prep = 0
-    stats = []
-    missing_files = []
-    per_data_type_stats = Counter()
-    for study in STUDY.iter():
-        st = study.sample_template
-        if st is None:
-            continue
-
-        # counting samples submitted to EBI-ENA
-        len_samples_ebi = sum([esa is not None
-                               for esa in st.ebi_sample_accessions.values()])
-        if len_samples_ebi != 0:
-            num_studies_ebi += 1
-            num_samples_ebi += len_samples_ebi
-
-        samples_status = defaultdict(set)
-        for pt in study.prep_templates():
-            pt_samples = list(pt.keys())
-            pt_status = pt.status
-            if pt_status == 'public':
-                per_data_type_stats[pt.data_type()] += len(pt_samples)
-            samples_status[pt_status].update(pt_samples)
-            # counting experiments (samples in preps) submitted to EBI-ENA
-            number_samples_ebi_prep += sum([
-                esa is not None
-                for esa in pt.ebi_experiment_accessions.values()])
-
+    for study_id in ebi_samples:
+        status = samples_status.get(study_id, {})
         # counting studies
-        if 'public' in samples_status:
+        if 'public' in status:
             number_studies['public'] += 1
-        elif 'private' in samples_status:
+        elif 'private' in status:
             number_studies['private'] += 1
         else:
             # note that this is a catch all for other status; at time of
             # writing there is status: awaiting_approval
             number_studies['sandbox'] += 1
 
-        # counting samples; note that some of these lines could be merged with
-        # the block above but I decided to split it in 2 for clarity
-        if 'public' in samples_status:
-            number_of_samples['public'] += len(samples_status['public'])
-        if 'private' in samples_status:
-            number_of_samples['private'] += len(samples_status['private'])
-        if 'sandbox' in samples_status:
-            number_of_samples['sandbox'] += len(samples_status['sandbox'])
-
-        # processing filepaths
-        for artifact in study.artifacts():
-            for adata in artifact.filepaths:
-                try:
-                    s = stat(adata['fp'])
-                except OSError:
-                    missing_files.append(adata['fp'])
+        # counting samples
+        for level in number_of_samples:
+            number_of_samples[level] += status.get(level, 0)
+
+    return {'number_studies': number_studies,
+            'number_of_samples': number_of_samples,
+            'per_data_type_stats': per_data_type_stats,
+            'num_studies_ebi': sum(1 for n in ebi_samples.values() if n),
+            'num_samples_ebi': sum(ebi_samples.values()),
+            'number_samples_ebi_prep': number_samples_ebi_prep}
+
+
+def _stat_filepath(fp):
+    """Returns the size and the modification month of the file, or None"""
+    try:
+        s = stat(fp)
+    except OSError:
+        return None
+    return s.st_size, strftime('%Y-%m', localtime(s.st_mtime))
+
+
+def _get_filepath_stats(full=False, n_workers=16):
+    """Retrieves the size of the artifact files of each study
+
+    Parameters
+    ----------
+    full : bool, optional
+        If True, all the files are checked. Otherwise, only the files of the
+        studies whose artifact files changed since the last run are checked.
+        Defaults to False
+    n_workers : int, optional
+        The number of threads checking the files. Defaults to 16
+
+    Returns
+    -------
+    dict of {str: dict of {str: int}}, list of str
+        The total size, in bytes, keyed by filepath type and by month of
+        modification; and the artifact filepaths that are not present in the
+        file system
+
+    Notes
+    -----
+    The sizes of each study are cached in redis together with a signature of
+    its artifact files, so they are only checked again if the signature
+    changes. The studies with missing files are never cached, so their files
+    are checked in every run.
+    """
+    cache_key = '%s:stats:study_files' % qiita_config.portal
+    with qdb.sql_connection.TRN:
+        sql = """SELECT study_id, md5(string_agg(
+                    artifact_id || ':' || filepath_id, ','
+                    ORDER BY artifact_id, filepath_id))
+                 FROM qiita.study_artifact
+                    JOIN qiita.artifact_filepath USING (artifact_id)
+                 WHERE study_id IN (SELECT study_id FROM qiita.study_sample)
+                 GROUP BY study_id"""
+        qdb.sql_connection.TRN.add(sql)
+        signatures = {str(sid): signature for sid, signature in
+                      qdb.sql_connection.TRN.execute_fetchindex()}
+
+    cached = {} if full else {
+        k.decode('utf-8'): loads(v)
+        for k, v in r_client.hgetall(cache_key).items()}
+    sizes = {sid: cached[sid]['sizes'] for sid, signature in
+             signatures.items()
+             if sid in cached and cached[sid]['signature'] == signature}
+    outdated = [int(sid) for sid in signatures if sid not in sizes]
+
+    missing_files = []
+    if outdated:
+        with qdb.sql_connection.TRN:
+            sql = """SELECT study_id, artifact_id, filepath, filepath_type,
+                            mountpoint, subdirectory
+                     FROM qiita.study_artifact
+                        JOIN qiita.artifact_filepath USING (artifact_id)
+                        JOIN qiita.filepath USING (filepath_id)
+                        JOIN qiita.filepath_type USING (filepath_type_id)
+                        JOIN qiita.data_directory USING (data_directory_id)
+                     WHERE study_id IN %s"""
+            qdb.sql_connection.TRN.add(sql, [tuple(outdated)])
+            db_dir = qdb.util.get_db_files_base_dir()
+            files = [(str(sid), ft, qdb.util._path_builder(db_dir, fp, m, sd,
+                                                           aid))
+                     for sid, aid, fp, ft, m, sd in
+                     qdb.sql_connection.TRN.execute_fetchindex()]
+
+        study_sizes = defaultdict(lambda: defaultdict(Counter))
+        incomplete = set()
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            results = executor.map(_stat_filepath, [f[2] for f in files])
+            for (sid, ft, fp), res in zip(files, results):
+                if res is None:
+                    missing_files.append(fp)
+                    incomplete.add(sid)
                 else:
-                    stats.append(
-                        (adata['fp_type'], s.st_size, strftime('%Y-%m',
-                         localtime(s.st_mtime))))
+                    study_sizes[sid][ft][res[1]] += res[0]
 
-    num_users = qdb.util.get_count('qiita.qiita_user')
-    num_processing_jobs = qdb.util.get_count('qiita.processing_job')
+        updated = {}
+        for sid in map(str, outdated):
+            sizes[sid] = {ft: dict(c) for ft, c in study_sizes[sid].items()}
+            if sid not in incomplete:
+                updated[sid] = dumps({'signature': signatures[sid],
+                                      'sizes': sizes[sid]})
+        if updated:
+            r_client.hmset(cache_key, updated)
+
+    # forget the studies that are gone or no longer have files
+    gone = [sid for sid in cached if sid not in signatures]
+    if gone:
+        r_client.hdel(cache_key, *gone)
+
+    summary = defaultdict(Counter)
+    for study in sizes.values():
+        for ft, months in study.items():
+            summary[ft].update(months)
+
+    return summary, missing_files
 
-    lat_longs = dumps(get_lat_longs())
 
+def update_redis_stats(full=False):
+    """Generate the system stats and save them in redis
+
+    Parameters
+    ----------
+    full : bool, optional
+        If True, the size of all the artifact files is checked, ignoring the
+        sizes cached in previous runs. Defaults to False
+
+    Returns
+    -------
+    list of str
+        artifact filepaths that are not present in the file system
+
+    Notes
+    -----
+    The time spent, in seconds, on each phase is stored in the `timings`
+    stat.
+    """
+    timings = OrderedDict()
+    start = perf_counter()
+    counts = _get_template_counts()
+    per_data_type_stats = counts['per_data_type_stats']
+    num_users = qdb.util.get_count('qiita.qiita_user')
+    num_processing_jobs = qdb.util.get_count('qiita.processing_job')
+    # the samples are written as they are streamed, so they are never all
+    # held in memory as python objects
+    lat_longs = StringIO()
+    lat_longs.write('[')
+    for i, lat_long in enumerate(get_lat_longs()):
+        if i:
+            lat_longs.write(', ')
+        lat_longs.write(dumps(lat_long))
+    lat_longs.write(']')
+    lat_longs = lat_longs.getvalue()
+    timings['counts'] = round(perf_counter() - start, 3)
+
+    start = perf_counter()
+    study_sizes, missing_files = _get_filepath_stats(full=full)
+    timings['filesystem'] = round(perf_counter() - start, 3)
+
+    start = perf_counter()
     summary = {}
     all_dates = []
     # these are some filetypes that are too small to plot alone so we'll merge
@@ -252,15 +422,16 @@ def update_redis_stats():
     group_other = {'html_summary', 'tgz', 'directory', 'raw_fasta', 'log',
                    'biom', 'raw_sff', 'raw_qual', 'qza', 'html_summary_dir',
                    'qza', 'plain_text', 'raw_barcodes'}
-    for ft, size, ym in stats:
+    for ft, months in study_sizes.items():
         if ft in group_other:
             ft = 'other'
         if ft not in summary:
             summary[ft] = {}
-        if ym not in summary[ft]:
-            summary[ft][ym] = 0
-            all_dates.append(ym)
-        summary[ft][ym] += size
+        for ym, size in months.items():
+            if ym not in summary[ft]:
+                summary[ft][ym] = 0
+                all_dates.append(ym)
+            summary[ft][ym] += size
     all_dates = sorted(set(all_dates))
 
     # sorting summaries
@@ -310,38 +481,46 @@ def update_redis_stats():
     plot.seek(0)
     img = 'data:image/png;base64,' + quote(b64encode(plot.getbuffer()))
 
+    timings['plot'] = round(perf_counter() - start, 3)
+
     time = datetime.now().strftime('%m-%d-%y %H:%M:%S')
 
+    start = perf_counter()
     portal = qiita_config.portal
     # making sure per_data_type_stats has some data so hmset doesn't fail
     if per_data_type_stats == {}:
         per_data_type_stats['No data'] = 0
 
     vals = [
-        ('number_studies', number_studies, r_client.hmset),
-        ('number_of_samples', number_of_samples, r_client.hmset),
+        ('number_studies', counts['number_studies'], r_client.hmset),
+        ('number_of_samples', counts['number_of_samples'], r_client.hmset),
         ('per_data_type_stats', dict(per_data_type_stats), r_client.hmset),
         ('num_users', num_users, r_client.set),
         ('lat_longs', (lat_longs), r_client.set),
-        ('num_studies_ebi', num_studies_ebi, r_client.set),
-        ('num_samples_ebi', num_samples_ebi, r_client.set),
-        ('number_samples_ebi_prep', number_samples_ebi_prep, r_client.set),
+        ('num_studies_ebi', counts['num_studies_ebi'], r_client.set),
+        ('num_samples_ebi', counts['num_samples_ebi'], r_client.set),
+        ('number_samples_ebi_prep', counts['number_samples_ebi_prep'],
+         r_client.set),
         ('img', img, r_client.set),
         ('time', time, r_client.set),
-        ('num_processing_jobs', num_processing_jobs, r_client.set)]
+        ('num_processing_jobs', num_processing_jobs, r_client.set),
+        ('timings', timings, r_client.hmset)]
     for k, v, f in vals:
         redis_key = '%s:stats:%s' % (portal, k)
         # important to "flush" variables to avoid errors
         r_client.delete(redis_key)
         f(redis_key, v)
 
-    # preparing vals to insert into DB
+    # preparing vals to insert into DB; the time spent saving the stats is
+    # only known once they are saved, so it is only stored in redis
     vals = dumps(dict([x[:-1] for x in vals]))
     with qdb.sql_connection.TRN:
         sql = """INSERT INTO qiita.stats_daily (stats, stats_timestamp)
                  VALUES (%s, NOW())"""
         qdb.sql_connection.TRN.add(sql, [vals])
         qdb.sql_connection.TRN.execute()
+    r_client.hset('%s:stats:timings' % portal, 'save',
+                  round(perf_counter() - start, 3))
 
     return missing_files
 
@@ -349,16 +528,20 @@ def update_redis_stats():
 def get_lat_longs():
     """Retrieve the latitude and longitude of all the public samples in the DB
 
-    Returns
-    -------
-    list of [float, float]
-        The latitude and longitude for each sample in the database
+    Yields
+    ------
+    list of [int, float, float]
+        The study id, latitude and longitude of each sample in the database
+
+    Notes
+    -----
+    The samples are streamed from the database, so the generator should be
+    consumed at once; the transaction is kept open until it is exhausted
     """
     with qdb.sql_connection.TRN:
         # getting all the public studies
         studies = qdb.study.Study.get_by_status('public')
 
-        results = []
         if studies:
             # we are going to create multiple union selects to retrieve the
             # latigute and longitude of all available studies. Note that
@@ -375,13 +558,84 @@ def get_lat_longs():
             sql = ' UNION '.join(sql)
             qdb.sql_connection.TRN.add(sql)
 
-            # note that we are returning set to remove duplicates
-            results = qdb.sql_connection.TRN.execute_fetchindex()
+            # the UNION spans all the public samples, so we stream it
+            for rows in qdb.sql_connection.TRN.execute_stream():
+                for row in rows:
+                    yield list(row)
+
+
+def _get_prep_categories(prep_ids, categories):
+    """Retrieves the distinct values of some categories of the given preps
+
+    Parameters
+    ----------
+    prep_ids : list of int
+        The prep template ids
+    categories : list of str
+        The categories to retrieve
+
+    Returns
+    -------
+    dict of {int: dict of {str: str}}
+        The comma separated distinct values of each category, keyed by prep
+        template id and category. If a prep doesn't have the category, its
+        value is the empty string
+    """
+    if not prep_ids:
+        return {}
+    columns = ', '.join(
+        ["array_remove(array_agg(DISTINCT sample_values->>%s), NULL)"] *
+        len(categories))
+    sql = ' UNION ALL '.join(
+        ["""SELECT {0}, {1}
+            FROM qiita.prep_{0}
+            WHERE sample_id != 'qiita_sample_column_names'""".format(
+            pid, columns) for pid in prep_ids])
+    with qdb.sql_connection.TRN:
+        qdb.sql_connection.TRN.add(sql, list(categories) * len(prep_ids))
+        return {row[0]: {c: ', '.join(v) for c, v in zip(categories, row[1:])}
+                for row in qdb.sql_connection.TRN.execute_fetchindex()}
 
-        return results
 
+def _compress_tar_member(fp, arcname, member_fp, level=6):
+    """Writes the tar member of a file as an independent gzip member
 
-def generate_biom_and_metadata_release(study_status='public'):
+    Parameters
+    ----------
+    fp : str
+        The path of the file
+    arcname : str
+        The name of the file in the tar
+    member_fp : str
+        The path where the compressed member is written
+    level : int, optional
+        The gzip compression level. Defaults to 6
+
+    Notes
+    -----
+    A gzip file can hold several members, which are decompressed as a single
+    stream, so the compressed members of a tar can be built independently
+    (and in parallel) and then concatenated
+    """
+    with topen(fileobj=BytesIO(), mode='w') as tar:
+        info = tar.gettarinfo(fp, arcname=arcname)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    tmp_fp = '%s.tmp' % member_fp
+    with open(tmp_fp, 'wb') as out:
+        out.write(compressor.compress(info.tobuf(
+            DEFAULT_FORMAT, ENCODING, 'surrogateescape')))
+        with open(fp, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                out.write(compressor.compress(chunk))
+        remainder = info.size % BLOCKSIZE
+        if remainder:
+            out.write(compressor.compress(NUL * (BLOCKSIZE - remainder)))
+        out.write(compressor.flush())
+    rename(tmp_fp, member_fp)
+
+
+def generate_biom_and_metadata_release(study_status='public',
+                                       incremental=True, n_workers=None):
     """Generate a list of biom/meatadata filepaths and a tgz of those files
 
     Parameters
@@ -390,6 +644,19 @@ def generate_biom_and_metadata_release(study_status='public'):
         The study status to search for. Note that this should always be set
         to 'public' but having this exposed helps with testing. The other
         options are 'private' and 'sandbox'
+    incremental : bool, optional
+        Whether to reuse the compressed files of the previous release whose
+        checksum hasn't changed. Defaults to True
+    n_workers : int, optional
+        The number of threads compressing the files. Defaults to the number
+        of CPUs
+
+    Notes
+    -----
+    Each file is compressed as an independent gzip member, in parallel, and
+    the members are kept next to the release, together with a manifest of the
+    checksum (from qiita.filepath) and size of the file they hold. The md5 of
+    the release is computed while it is written.
     """
     studies = qdb.study.Study.get_by_status(study_status)
     qiita_config = ConfigurationManager()
@@ -399,9 +666,14 @@ def generate_biom_and_metadata_release(study_status='public'):
     time = datetime.now().strftime('%m-%d-%y %H:%M:%S')
 
     data = []
+    # the prep info file of each prep and the filepath id of each file
+    prep_fps = {}
+    fp_ids = {}
     for s in studies:
-        # [0] latest is first, [1] only getting the filepath
-        sample_fp = relpath(s.sample_template.get_filepaths()[0][1], bdir)
+        # [0] latest is first
+        sample_fp_id, sample_fp = s.sample_template.get_filepaths()[0]
+        sample_fp = relpath(sample_fp, bdir)
+        fp_ids[sample_fp] = sample_fp_id
 
         for a in s.artifacts(artifact_type='BIOM'):
             if a.processing_parameters is None or a.visibility != study_status:
@@ -415,59 +687,120 @@ def generate_biom_and_metadata_release(study_status='public'):
                 if x['fp_type'] != 'biom' or 'only-16s' in x['fp']:
                     continue
                 fp = relpath(x['fp'], bdir)
+                fp_ids[fp] = x['fp_id']
                 for pt in a.prep_templates:
-                    categories = pt.categories()
-                    platform = ''
-                    target_gene = ''
-                    if 'platform' in categories:
-                        platform = ', '.join(
-                            set(pt.get_category('platform').values()))
-                    if 'target_gene' in categories:
-                        target_gene = ', '.join(
-                            set(pt.get_category('target_gene').values()))
-                    for _, prep_fp in pt.get_filepaths():
-                        if 'qiime' not in prep_fp:
-                            break
-                    prep_fp = relpath(prep_fp, bdir)
-                    # format: (biom_fp, sample_fp, prep_fp, qiita_artifact_id,
-                    #          platform, target gene, merging schemes,
-                    #          artifact software/version,
-                    #          parent sofware/version)
-                    data.append((fp, sample_fp, prep_fp, a.id, platform,
-                                 target_gene, merging_schemes, software,
-                                 parent_softwares))
+                    if pt.id not in prep_fps:
+                        for prep_fp_id, prep_fp in pt.get_filepaths():
+                            if 'qiime' not in prep_fp:
+                                break
+                        prep_fps[pt.id] = relpath(prep_fp, bdir)
+                        fp_ids[prep_fps[pt.id]] = prep_fp_id
+                    data.append((fp, sample_fp, pt.id, a.id, merging_schemes,
+                                 software, parent_softwares))
+
+    categories = _get_prep_categories(
+        list(prep_fps), ['platform', 'target_gene'])
+    # format: (biom_fp, sample_fp, prep_fp, qiita_artifact_id,
+    #          platform, target gene, merging schemes,
+    #          artifact software/version,
+    #          parent sofware/version)
+    data = [(fp, sample_fp, prep_fps[ptid], aid,
+             categories[ptid]['platform'], categories[ptid]['target_gene'],
+             ms, asv, psv)
+            for fp, sample_fp, ptid, aid, ms, asv, psv in data]
+
+    checksums = {}
+    if fp_ids:
+        with qdb.sql_connection.TRN:
+            sql = """SELECT filepath_id, checksum
+                     FROM qiita.filepath
+                     WHERE filepath_id IN %s"""
+            qdb.sql_connection.TRN.add(sql, [tuple(set(fp_ids.values()))])
+            checksums = dict(qdb.sql_connection.TRN.execute_fetchindex())
 
     # writing text and tgz file
     ts = datetime.now().strftime('%m%d%y-%H%M%S')
     tgz_dir = join(working_dir, 'releases')
-    create_nested_path(tgz_dir)
+    members_dir = join(tgz_dir, '%s-%s-members' % (portal, study_status))
+    create_nested_path(members_dir)
+    manifest_fp = join(members_dir, 'manifest.json')
     tgz_name = join(tgz_dir, '%s-%s-building.tgz' % (portal, study_status))
     tgz_name_final = join(tgz_dir, '%s-%s.tgz' % (portal, study_status))
+
+    previous = {}
+    if incremental and exists(manifest_fp):
+        with open(manifest_fp) as f:
+            previous = load(f)
+
+    # the members of the tar, in order, and the files to compress
+    manifest = {}
+    arcnames = []
+    for row in data:
+        for arcname in row[:3]:
+            arcnames.append(arcname)
+            if arcname in manifest:
+                continue
+            entry = {'checksum': checksums.get(fp_ids[arcname]),
+                     'size': stat(join(bdir, arcname)).st_size}
+            entry['member'] = '%s.gz' % md5(('%s:%s:%s' % (
+                arcname, entry['checksum'], entry['size'])).encode(
+                    'utf-8')).hexdigest()
+            manifest[arcname] = entry
+
     txt_lines = [
         "biom fp\tsample fp\tprep fp\tqiita artifact id\tplatform\t"
         "target gene\tmerging scheme\tartifact software\tparent software"]
-    with topen(tgz_name, "w|gz") as tgz:
-        for biom_fp, sample_fp, prep_fp, aid, pform, tg, ms, asv, psv in data:
-            txt_lines.append("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s" % (
-                biom_fp, sample_fp, prep_fp, aid, pform, tg, ms, asv, psv))
-            tgz.add(join(bdir, biom_fp), arcname=biom_fp, recursive=False)
-            tgz.add(join(bdir, sample_fp), arcname=sample_fp, recursive=False)
-            tgz.add(join(bdir, prep_fp), arcname=prep_fp, recursive=False)
-        info = TarInfo(name='%s-%s-%s.txt' % (portal, study_status, ts))
-        txt_hd = BytesIO()
-        txt_hd.write(bytes('\n'.join(txt_lines), 'ascii'))
-        txt_hd.seek(0)
-        info.size = len(txt_hd.read())
-        txt_hd.seek(0)
-        tgz.addfile(tarinfo=info, fileobj=txt_hd)
-
-    with open(tgz_name, "rb") as f:
-        md5sum = md5()
-        for c in iter(lambda: f.read(4096), b""):
-            md5sum.update(c)
+    txt_lines.extend(["%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s" % row
+                      for row in data])
+    txt = bytes('\n'.join(txt_lines), 'ascii')
+    info = TarInfo(name='%s-%s-%s.txt' % (portal, study_status, ts))
+    info.size = len(txt)
+    remainder = info.size % BLOCKSIZE
+    txt = info.tobuf(DEFAULT_FORMAT, ENCODING, 'surrogateescape') + txt + (
+        NUL * (BLOCKSIZE - remainder) if remainder else b'')
+
+    md5sum = md5()
+    if n_workers is None:
+        # the compression releases the GIL, so it scales with the CPUs
+        n_workers = cpu_count()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {}
+        for arcname, entry in manifest.items():
+            member_fp = join(members_dir, entry['member'])
+            reuse = (entry['checksum'] is not None and
+                     previous.get(arcname) == entry and exists(member_fp))
+            if not reuse:
+                futures[arcname] = executor.submit(
+                    _compress_tar_member, join(bdir, arcname), arcname,
+                    member_fp)
+
+        with open(tgz_name, 'wb') as out:
+            def write(chunk):
+                out.write(chunk)
+                md5sum.update(chunk)
+
+            for arcname in arcnames:
+                if arcname in futures:
+                    futures[arcname].result()
+                member_fp = join(members_dir, manifest[arcname]['member'])
+                with open(member_fp, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        write(chunk)
+            # the text file and the end of the tar, with the same format
+            # as tarfile writes them
+            write(gzip_compress(txt))
+            write(gzip_compress(NUL * (BLOCKSIZE * 2)))
 
     rename(tgz_name, tgz_name_final)
 
+    # keeping only the members of this release
+    with open(manifest_fp, 'w') as f:
+        dump(manifest, f)
+    in_use = {e['member'] for e in manifest.values()}
+    for fn in listdir(members_dir):
+        if fn != 'manifest.json' and fn not in in_use:
+            remove(join(members_dir, fn))
+
     vals = [
         ('filepath', tgz_name_final[len(working_dir):], r_client.set),
         ('md5sum', md5sum.hexdigest(), r_client.set),
@@ -8,7 +8,9 @@
 
 from . import constants
 from . import util
+from . import cache
 from . import sample_template
 from . import prep_template
 
-__all__ = ["sample_template", "prep_template", "util", "constants"]
+__all__ = ["sample_template", "prep_template", "util", "constants",
+           "cache"]
@@ -36,10 +36,10 @@ Methods
 # -----------------------------------------------------------------------------
 
 from __future__ import division
-from future.utils import viewitems
+from future.utils import viewitems, viewvalues
 from itertools import chain
+from collections import defaultdict
 from copy import deepcopy
-from datetime import datetime
 from json import loads, dumps
 
 import pandas as pd
@@ -58,6 +58,74 @@ from string import ascii_letters, digits
 QIITA_COLUMN_NAME = 'qiita_sample_column_names'
 
 
+def _bump_modification_counter(table_name):
+    r"""Adds to the current transaction the bump of the modification counter
+    of the template stored in `table_name`
+
+    Parameters
+    ----------
+    table_name : str
+        The name of the table of the template, e.g. sample_1
+
+    Notes
+    -----
+    The counter is stored with the column names of the template and it is
+    used to know if the copies of the template in the metadata cache are
+    up to date. The counter is bumped only once per transaction, as all the
+    changes of the transaction are committed at once, but the copies of the
+    template kept by this process are dropped on every call
+    """
+    identity_map = qdb.sql_connection.TRN.identity_map
+    if ('modification', table_name) not in identity_map:
+        sql = """UPDATE qiita.{0}
+                 SET sample_values = sample_values || jsonb_build_object(
+                    'modification',
+                    nextval('qiita.metadata_template_modification_seq'))
+                 WHERE sample_id = '{1}'""".format(
+                    table_name, QIITA_COLUMN_NAME)
+        qdb.sql_connection.TRN.add(sql)
+        identity_map[('modification', table_name)] = True
+    _invalidate_cached_template(table_name)
+
+
+def _update_sample_values(table_name, values):
+    r"""Adds to the current transaction the update of the given values of
+    the samples of the template stored in `table_name`
+
+    Parameters
+    ----------
+    table_name : str
+        The name of the table of the template, e.g. sample_1
+    values : dict of {str: dict of {str: object}}
+        The new values of each sample, keyed by sample id and column
+
+    Notes
+    -----
+    All the values are sent as a single JSON document that is applied in a
+    single statement; remember that || is a jsonb to update or add a new
+    key/value
+    """
+    sql = """UPDATE qiita.{0} AS t
+             SET sample_values = t.sample_values || c.sample_values
+             FROM jsonb_each(%s::jsonb) AS c(sample_id, sample_values)
+             WHERE t.sample_id = c.sample_id""".format(table_name)
+    qdb.sql_connection.TRN.add(sql, [dumps(values)])
+    _bump_modification_counter(table_name)
+
+
+def _invalidate_cached_template(table_name):
+    r"""Drops the copies of the template stored in `table_name` kept by this
+    process, both in the current transaction and in the metadata cache
+
+    Parameters
+    ----------
+    table_name : str
+        The name of the table of the template, e.g. sample_1
+    """
+    qdb.sql_connection.TRN.identity_map.pop(('sample_ids', table_name), None)
+    qdb.metadata_template.cache.METADATA_CACHE.invalidate(table_name)
+
+
 class BaseSample(qdb.base.QiitaObject):
     r"""Sample object that accesses the db to get the information of a sample
     belonging to a PrepTemplate or a SampleTemplate.
@@ -139,6 +207,42 @@ class BaseSample(qdb.base.QiitaObject):
         self._md_template = md_template
         self._dynamic_table = "%s%d" % (self._table_prefix,
                                         self._md_template.id)
+        # only set in the read-only views, see _view
+        self._values = None
+        self._categories = None
+
+    @classmethod
+    def _view(cls, sample_id, md_template, values, categories):
+        r"""Creates a read-only view of a sample from already retrieved values
+
+        Parameters
+        ----------
+        sample_id : str
+            The sample id
+        md_template : MetadataTemplate
+            The metadata template in which the sample is present
+        values : dict of {str: object}
+            The metadata values of the sample, as stored in the database
+        categories : set of str
+            The metadata categories of `md_template`
+
+        Returns
+        -------
+        BaseSample
+            The sample, which won't access the database when read
+
+        Notes
+        -----
+        The sample and the template are not checked against the database, as
+        the values are expected to come straight from it
+        """
+        sample = cls.__new__(cls)
+        sample._id = sample_id
+        sample._md_template = md_template
+        sample._dynamic_table = "%s%d" % (cls._table_prefix, md_template.id)
+        sample._values = values
+        sample._categories = categories
+        return sample
 
     def __hash__(self):
         r"""Defines the hash function so samples are hashable"""
@@ -187,6 +291,9 @@ class BaseSample(qdb.base.QiitaObject):
         set of str
             The set of all available metadata categories
         """
+        if self._categories is not None:
+            return set(self._categories)
+
         with qdb.sql_connection.TRN:
             sql = """SELECT sample_values->>'columns'
                      FROM qiita.{0}
@@ -207,6 +314,9 @@ class BaseSample(qdb.base.QiitaObject):
         dict of {str: str}
             A dictionary of the form {category: value}
         """
+        if self._values is not None:
+            return dict(self._values)
+
         with qdb.sql_connection.TRN:
             sql = """SELECT sample_values
                      FROM qiita.{0}
@@ -250,21 +360,34 @@ class BaseSample(qdb.base.QiitaObject):
         --------
         get
         """
-        with qdb.sql_connection.TRN:
-            key = key.lower()
-            if key not in self._get_categories():
-                # The key is not available for the sample, so raise a KeyError
-                raise KeyError(
-                    "Metadata category %s does not exists for sample %s"
-                    " in template %d" % (key, self._id, self._md_template.id))
-
-            sql = """SELECT sample_values->>'{0}' as {0}
-                     FROM qiita.{1}
-                     WHERE sample_id = %s""".format(
-                key, self._dynamic_table)
-            qdb.sql_connection.TRN.add(sql, [self._id])
-
-            return qdb.sql_connection.TRN.execute_fetchlast()
+        key = key.lower()
+        if self._values is not None:
+            exists = key in self._categories
+            value = self._values.get(key)
+            # match the text representation returned by postgres' ->>
+            if value is not None and not isinstance(value, str):
+                value = dumps(value)
+        else:
+            with qdb.sql_connection.TRN:
+                # checking the category and retrieving the value in a single
+                # query; note that ? in pgsql jsonb checks that the string is
+                # in the array
+                sql = """SELECT c.sample_values->'columns' ? %s,
+                            s.sample_values->>%s
+                         FROM qiita.{0} c
+                            LEFT JOIN qiita.{0} s ON s.sample_id = %s
+                         WHERE c.sample_id = '{1}'""".format(
+                            self._dynamic_table, QIITA_COLUMN_NAME)
+                qdb.sql_connection.TRN.add(sql, [key, key, self._id])
+                exists, value = qdb.sql_connection.TRN.execute_fetchindex()[0]
+
+        if not exists:
+            # The key is not available for the sample, so raise a KeyError
+            raise KeyError(
+                "Metadata category %s does not exists for sample %s"
+                " in template %d" % (key, self._id, self._md_template.id))
+
+        return value
 
     def setitem(self, column, value):
         """Sets `value` as value for the given `column`
@@ -281,7 +404,14 @@ class BaseSample(qdb.base.QiitaObject):
         ------
         QiitaDBColumnError
             If the column does not exist in the table
+        QiitaDBOperationNotPermittedError
+            If the sample is a read-only view
         """
+        if self._values is not None:
+            raise qdb.exceptions.QiitaDBOperationNotPermittedError(
+                "Sample %s is a read-only view, use the template to modify "
+                "it" % self._id)
+
         with qdb.sql_connection.TRN:
             # Check if the column exist in the table
             if column not in self._get_categories():
@@ -294,6 +424,7 @@ class BaseSample(qdb.base.QiitaObject):
                      WHERE sample_id = %s""".format(self._dynamic_table)
 
             qdb.sql_connection.TRN.add(sql, [dumps({column: value}), self.id])
+            _bump_modification_counter(self._dynamic_table)
             qdb.sql_connection.TRN.execute()
 
     def __setitem__(self, column, value):
@@ -462,6 +593,46 @@ class MetadataTemplate(qdb.base.QiitaObject):
             qdb.sql_connection.TRN.add(sql, [id_])
             return qdb.sql_connection.TRN.execute_fetchlast()
 
+    @classmethod
+    def _check_many(cls, ids):
+        r"""Checks that several MetadataTemplate ids exist in a single query"""
+        with qdb.sql_connection.TRN:
+            sql = """SELECT DISTINCT {1}, TRUE
+                     FROM qiita.{0}
+                     WHERE {1} IN %s""".format(cls._table, cls._id_column)
+            qdb.sql_connection.TRN.add(sql, [tuple(ids)])
+            return dict(qdb.sql_connection.TRN.execute_fetchindex())
+
+    @classmethod
+    def _forget(cls, id_):
+        r"""Removes `id_` from the identity map of the current transaction
+        and drops the cached copies of the template
+
+        Parameters
+        ----------
+        id_ : int
+            The ID of the template that has been deleted
+        """
+        super(MetadataTemplate, cls)._forget(id_)
+        _invalidate_cached_template(cls._table_name(id_))
+
+    @classmethod
+    def _samples_modified(cls, obj_id):
+        r"""Adds to the current transaction the steps needed after adding or
+        deleting samples of the template
+
+        Parameters
+        ----------
+        obj_id : int
+            The id of the metadata template
+
+        Notes
+        -----
+        The samples are bulk loaded, so the subclasses react to their changes
+        here, once per call, instead of with row triggers
+        """
+        pass
+
     @classmethod
     def _table_name(cls, obj_id):
         r"""Returns the dynamic table name
@@ -609,12 +780,6 @@ class MetadataTemplate(qdb.base.QiitaObject):
             if not headers:
                 raise ValueError("Your info file only has sample_name")
 
-            # Insert values on template_sample table
-            values = [[obj_id, s_id] for s_id in sample_ids]
-            sql = """INSERT INTO qiita.{0} ({1}, sample_id)
-                     VALUES (%s, %s)""".format(cls._table, cls._id_column)
-            qdb.sql_connection.TRN.add(sql, values, many=True)
-
             # Create table with custom columns
             table_name = cls._table_name(obj_id)
             sql = """CREATE TABLE qiita.{0} (
@@ -624,17 +789,25 @@ class MetadataTemplate(qdb.base.QiitaObject):
 
             values = dumps({"columns": md_template.columns.tolist()})
             sql = """INSERT INTO qiita.{0} (sample_id, sample_values)
-                     VALUES ('{1}', %s)""".format(
-                        table_name, QIITA_COLUMN_NAME)
+                     VALUES ('{1}', %s::jsonb || jsonb_build_object(
+                        'modification',
+                        nextval('qiita.metadata_template_modification_seq')))
+                  """.format(table_name, QIITA_COLUMN_NAME)
             qdb.sql_connection.TRN.add(sql, [values])
 
-            values = [(k, df.to_json()) for k, df in md_template.iterrows()]
-            sql = """INSERT INTO qiita.{0} (sample_id, sample_values)
-                     VALUES (%s, %s)""".format(table_name)
-            qdb.sql_connection.TRN.add(sql, values, many=True)
+            # Bulk load the samples on the template_sample table and on the
+            # table with the custom columns
+            qdb.sql_connection.TRN.copy_from(
+                'qiita.%s' % cls._table, [cls._id_column, 'sample_id'],
+                ((obj_id, s_id) for s_id in sample_ids))
+            qdb.sql_connection.TRN.copy_from(
+                'qiita.%s' % table_name, ['sample_id', 'sample_values'],
+                qdb.metadata_template.util.iter_sample_rows(md_template))
+            cls._samples_modified(obj_id)
 
             # Execute all the steps
             qdb.sql_connection.TRN.execute()
+            _invalidate_cached_template(table_name)
 
     @classmethod
     def metadata_headers(cls):
@@ -700,6 +873,8 @@ class MetadataTemplate(qdb.base.QiitaObject):
             for sn in sample_names:
                 qdb.sql_connection.TRN.add(sql1, [sn])
                 qdb.sql_connection.TRN.add(sql2, [sn, self.id])
+            self._samples_modified(self.id)
+            _bump_modification_counter(self._table_name(self._id))
             qdb.sql_connection.TRN.execute()
 
             # making sure we don't delete all the samples
@@ -761,10 +936,11 @@ class MetadataTemplate(qdb.base.QiitaObject):
             columns.remove(column_name)
             values = '{"columns": %s}' % dumps(columns)
             sql = """UPDATE {0}
-                     SET sample_values = %s
+                     SET sample_values = sample_values || %s
                      WHERE sample_id = '{1}'""".format(
                         table_name, QIITA_COLUMN_NAME)
             qdb.sql_connection.TRN.add(sql, [values])
+            _bump_modification_counter(self._table_name(self._id))
 
             qdb.sql_connection.TRN.execute()
 
@@ -863,7 +1039,7 @@ class MetadataTemplate(qdb.base.QiitaObject):
 
                 values = dumps({"columns": cols})
                 sql = """UPDATE qiita.{0}
-                         SET sample_values = %s
+                         SET sample_values = sample_values || %s
                          WHERE sample_id = '{1}'""".format(
                             table_name, QIITA_COLUMN_NAME)
                 qdb.sql_connection.TRN.add(sql, [values])
@@ -871,16 +1047,11 @@ class MetadataTemplate(qdb.base.QiitaObject):
                 if existing_samples:
                     # The values for the new columns are the only ones that get
                     # added to the database. None of the existing values will
-                    # be modified (see update for that functionality). Remember
-                    # that || is a jsonb to update or add a new key/value
+                    # be modified (see update for that functionality)
                     md_filtered = md_template[new_cols].loc[existing_samples]
-                    for sid, df in md_filtered.iterrows():
-                        values = dict(df.items())
-                        sql = """UPDATE qiita.{0}
-                                 SET sample_values = sample_values || %s
-                                 WHERE sample_id = %s""".format(
-                                    self._table_name(self._id))
-                        qdb.sql_connection.TRN.add(sql, [dumps(values), sid])
+                    _update_sample_values(
+                        table_name, {sid: dict(df.items())
+                                     for sid, df in md_filtered.iterrows()})
 
             if new_samples:
                 warnings.warn(
@@ -894,19 +1065,17 @@ class MetadataTemplate(qdb.base.QiitaObject):
                 # from the new samples
                 md_filtered = md_template.loc[new_samples]
 
-                # Insert new samples to the study sample table
-                values = [[self._id, s_id] for s_id in new_samples]
-                sql = """INSERT INTO qiita.{0} ({1}, sample_id)
-                         VALUES (%s, %s)""".format(self._table,
-                                                   self._id_column)
-                qdb.sql_connection.TRN.add(sql, values, many=True)
+                # Insert new samples to the study sample table and to the
+                # info file
+                qdb.sql_connection.TRN.copy_from(
+                    'qiita.%s' % self._table, [self._id_column, 'sample_id'],
+                    ((self._id, s_id) for s_id in new_samples))
+                qdb.sql_connection.TRN.copy_from(
+                    'qiita.%s' % table_name, ['sample_id', 'sample_values'],
+                    qdb.metadata_template.util.iter_sample_rows(md_filtered))
+                self._samples_modified(self.id)
 
-                # inserting new samples to the info file
-                values = [(k, row.to_json())
-                          for k, row in md_filtered.iterrows()]
-                sql = """INSERT INTO qiita.{0} (sample_id, sample_values)
-                         VALUES (%s, %s)""".format(table_name)
-                qdb.sql_connection.TRN.add(sql, values, many=True)
+            _bump_modification_counter(table_name)
 
             # Execute all the steps
             qdb.sql_connection.TRN.execute()
@@ -930,19 +1099,61 @@ class MetadataTemplate(qdb.base.QiitaObject):
         cls._check_subclass()
         return qdb.util.exists_table(cls._table_name(obj_id))
 
+    def _get_modification_counter(self):
+        r"""Returns the modification counter of the metadata template
+
+        Returns
+        -------
+        str or None
+            The modification counter, which changes every time the template
+            is modified
+        """
+        with qdb.sql_connection.TRN:
+            sql = """SELECT sample_values->>'modification'
+                     FROM qiita.{0}
+                     WHERE sample_id = '{1}'""".format(
+                        self._table_name(self._id), QIITA_COLUMN_NAME)
+            qdb.sql_connection.TRN.add(sql)
+            return qdb.sql_connection.TRN.execute_fetchlast()
+
     def _get_sample_ids(self):
         r"""Returns all the available samples for the metadata template
 
         Returns
         -------
-        set of str
+        frozenset of str
             The set of all available sample ids
+
+        Notes
+        -----
+        The sample ids are only retrieved from the database if the template
+        has been modified since the last time that they were retrieved;
+        within a transaction they are not even checked again unless the
+        template is modified in the same transaction
         """
         with qdb.sql_connection.TRN:
-            sql = "SELECT sample_id FROM qiita.{0} WHERE {1}=%s".format(
-                self._table, self._id_column)
-            qdb.sql_connection.TRN.add(sql, [self._id])
-            return set(qdb.sql_connection.TRN.execute_fetchflatten())
+            table_name = self._table_name(self._id)
+            identity_map = qdb.sql_connection.TRN.identity_map
+            sample_ids = identity_map.get(('sample_ids', table_name))
+            if sample_ids is not None:
+                return sample_ids
+
+            cache = qdb.metadata_template.cache.METADATA_CACHE
+            modification = self._get_modification_counter()
+            if modification is not None:
+                sample_ids = cache.get_sample_ids(table_name, modification)
+
+            if sample_ids is None:
+                sql = "SELECT sample_id FROM qiita.{0} WHERE {1}=%s".format(
+                    self._table, self._id_column)
+                qdb.sql_connection.TRN.add(sql, [self._id])
+                sample_ids = frozenset(
+                    qdb.sql_connection.TRN.execute_fetchflatten())
+                if modification is not None:
+                    cache.put_sample_ids(table_name, modification, sample_ids)
+
+            identity_map[('sample_ids', table_name)] = sample_ids
+            return sample_ids
 
     def __len__(self):
         r"""Returns the number of samples in the metadata template
@@ -1049,29 +1260,54 @@ class MetadataTemplate(qdb.base.QiitaObject):
         """
         return self.__iter__()
 
+    def _get_sample_views(self):
+        r"""Retrieves all the samples of the template in a single query
+
+        Returns
+        -------
+        list of Sample
+            Read-only views of all the samples of the template
+        """
+        with qdb.sql_connection.TRN:
+            sql = "SELECT sample_id, sample_values FROM qiita.{0}".format(
+                self._table_name(self._id))
+            qdb.sql_connection.TRN.add(sql)
+            rows = dict(qdb.sql_connection.TRN.execute_fetchindex())
+
+        categories = frozenset(rows.pop(QIITA_COLUMN_NAME)['columns'])
+        return [self._sample_cls._view(sample_id, self, values, categories)
+                for sample_id, values in viewitems(rows)]
+
     def values(self):
         r"""Iterator over the metadata values
 
         Returns
         -------
         Iterator
-            Iterator over Sample obj
+            Iterator over read-only Sample obj
+
+        Notes
+        -----
+        The samples are retrieved in a single query, so they don't reflect any
+        change done to the template after calling this method
         """
-        with qdb.sql_connection.TRN:
-            return iter(self._sample_cls(sample_id, self)
-                        for sample_id in self._get_sample_ids())
+        return iter(self._get_sample_views())
 
     def items(self):
-        r"""Iterator over (sample_id, values) tuples, in sample id order
+        r"""Iterator over (sample_id, values) tuples
 
         Returns
         -------
         Iterator
-            Iterator over (sample_ids, values) tuples
+            Iterator over (sample_ids, read-only Sample obj) tuples
+
+        Notes
+        -----
+        The samples are retrieved in a single query, so they don't reflect any
+        change done to the template after calling this method
         """
-        with qdb.sql_connection.TRN:
-            return iter((sample_id, self._sample_cls(sample_id, self))
-                        for sample_id in self._get_sample_ids())
+        return iter((sample.id, sample)
+                    for sample in self._get_sample_views())
 
     def get(self, key):
         r"""Returns the metadata values for sample id `key`, or None if the
@@ -1169,12 +1405,32 @@ class MetadataTemplate(qdb.base.QiitaObject):
             The metadata in the template,indexed on sample id
         """
         with qdb.sql_connection.TRN:
+            table_name = self._table_name(self._id)
+            # Retrieve the columns and the modification counter, which
+            # tells us if the copy in the cache (if any) is up to date
+            sql = """SELECT sample_values->>'columns',
+                        sample_values->>'modification'
+                     FROM qiita.{0}
+                     WHERE sample_id = '{1}'""".format(
+                        table_name, QIITA_COLUMN_NAME)
+            qdb.sql_connection.TRN.add(sql)
+            results = qdb.sql_connection.TRN.execute_fetchindex()
+            cols, modification = [], None
+            if results:
+                cols = sorted(loads(results[0][0]))
+                modification = results[0][1]
+
+            cache = qdb.metadata_template.cache.METADATA_CACHE
+            if modification is not None:
+                frame = cache.get(table_name, modification)
+                if frame is not None:
+                    return frame.to_dataframe()
+
             # Retrieve all the information from the database
-            cols = self.categories()
             sql = """SELECT sample_id, sample_values
                      FROM qiita.{0}
                      WHERE sample_id != '{1}'""".format(
-                        self._table_name(self._id), QIITA_COLUMN_NAME)
+                        table_name, QIITA_COLUMN_NAME)
             qdb.sql_connection.TRN.add(sql)
             # this query is going to return a tuple
             # (sample_id, dict of columns/values); however it's important to
@@ -1186,21 +1442,31 @@ class MetadataTemplate(qdb.base.QiitaObject):
             #    for more info google: "performance pandas from_dict"
             # 2. generate a matrix rows/samples, cols/values and load them
             #    via pandas.DataFrame, which actually has good performace
-            data = []
-            for sid, values in qdb.sql_connection.TRN.execute_fetchindex():
-                # creating row of values, first insert sample id
-                vals = [sid]
-                # then loop over all the possible values making sure that if
-                # the column doesn't exist in that sample, it gets a None
-                for c in cols:
-                    v = None
-                    if c in values:
-                        v = values[c]
-                    vals.append(v)
-                # append the row to the full matrix
-                data.append(vals)
-            cols.insert(0, 'sample_id')
-            df = pd.DataFrame(data, columns=cols, dtype=str)
+            # The rows are streamed from the database and each batch is
+            # converted to a DataFrame right away, so we never hold all the
+            # JSON documents of the template in memory
+            df_cols = ['sample_id'] + cols
+            chunks = []
+            for rows in qdb.sql_connection.TRN.execute_stream():
+                data = []
+                for sid, values in rows:
+                    # creating row of values, first insert sample id
+                    vals = [sid]
+                    # then loop over all the possible values making sure that
+                    # if the column doesn't exist in that sample, it gets a
+                    # None
+                    for c in cols:
+                        v = None
+                        if c in values:
+                            v = values[c]
+                        vals.append(v)
+                    # append the row to the matrix of this batch
+                    data.append(vals)
+                chunks.append(pd.DataFrame(data, columns=df_cols, dtype=str))
+            if chunks:
+                df = pd.concat(chunks, ignore_index=True)
+            else:
+                df = pd.DataFrame([], columns=df_cols, dtype=str)
             df.set_index('sample_id', inplace=True)
 
             # Make sure that we are changing np.NaN by Nones
@@ -1210,6 +1476,10 @@ class MetadataTemplate(qdb.base.QiitaObject):
                 id_column_name = 'qiita_study_id'
             df[id_column_name] = str(self.id)
 
+            if modification is not None:
+                CF = qdb.metadata_template.cache.ColumnarFrame
+                cache.put(table_name, modification, CF.from_dataframe(df))
+
             return df
 
     def add_filepath(self, filepath, fp_id=None):
@@ -1278,6 +1548,45 @@ class MetadataTemplate(qdb.base.QiitaObject):
                 self.validate(self.columns_restrictions)
                 self.generate_files(new_samples, new_columns)
 
+    def _get_values(self, columns, sample_ids):
+        r"""Returns the values of some columns and samples of the template
+
+        Parameters
+        ----------
+        columns : list of str
+            The columns to retrieve
+        sample_ids : list of str
+            The samples to retrieve
+
+        Returns
+        -------
+        pandas DataFrame
+            The values of `columns` for `sample_ids`, indexed by sample id and
+            in the same order as the parameters
+
+        Notes
+        -----
+        The values are retrieved in the same way as in to_dataframe, so both
+        methods return the same values for the same cells
+        """
+        with qdb.sql_connection.TRN:
+            # only the requested keys of each JSON document are sent back
+            sql = """SELECT sample_id, (
+                        SELECT COALESCE(jsonb_object_agg(key, value), '{{}}')
+                        FROM jsonb_each(sample_values)
+                        WHERE key = ANY(%s))
+                     FROM qiita.{0}
+                     WHERE sample_id = ANY(%s)""".format(
+                        self._table_name(self._id))
+            qdb.sql_connection.TRN.add(sql, [columns, sample_ids])
+            data = [[sid] + [values.get(c) for c in columns]
+                    for sid, values in
+                    qdb.sql_connection.TRN.execute_fetchindex()]
+
+        df = pd.DataFrame(data, columns=['sample_id'] + columns, dtype=str)
+        df.set_index('sample_id', inplace=True)
+        return df.loc[sample_ids]
+
     def _update(self, md_template):
         r"""Update values in the template
 
@@ -1304,113 +1613,80 @@ class MetadataTemplate(qdb.base.QiitaObject):
             passed md_template
         """
         with qdb.sql_connection.TRN:
-            # Retrieving current metadata
-            current_map = self.to_dataframe()
-
             # simple validations of sample ids and column names
-            samples_diff = set(md_template.index).difference(current_map.index)
+            samples_diff = set(md_template.index).difference(
+                self._get_sample_ids())
             if samples_diff:
                 raise qdb.exceptions.QiitaDBError(
                     'The new template differs from what is stored '
                     'in database by these samples names: %s'
                     % ', '.join(samples_diff))
 
-            if not set(current_map.columns).issuperset(md_template.columns):
+            current_columns = self.categories()
+            if not set(current_columns).issuperset(md_template.columns):
                 columns_diff = set(md_template.columns).difference(
-                    current_map.columns)
+                    current_columns)
                 raise qdb.exceptions.QiitaDBError(
                     'Some of the columns in your template are not present in '
                     'the system. Use "extend" if you want to add more columns '
                     'to the template. Missing columns: %s'
                     % ', '.join(columns_diff))
 
-            # In order to speed up some computation, let's compare only the
-            # common columns and rows. current_map.columns and
-            # current_map.index are supersets of md_template.columns and
-            # md_template.index, respectivelly, so this will not fail
-            current_map = current_map[
-                md_template.columns].loc[md_template.index]
+            # In order to speed up some computation, let's retrieve only the
+            # columns and rows present in md_template; as we checked above
+            # that they exist this will not fail
+            current_map = self._get_values(
+                md_template.columns.tolist(), md_template.index.tolist())
 
             # Get the values that we need to change
             # diff_map is a DataFrame that hold boolean values. If a cell is
             # True, means that the md_template is different from the
             # current_map while False means that the cell has the same value
             diff_map = current_map != md_template
-            # ne_stacked holds a MultiIndexed DataFrame in which the first
-            # level of indexing is the sample_name and the second one is the
-            # columns. We only have 1 column, which holds if that
-            # (sample, column) pair has been modified or not (i.e. cell)
-            ne_stacked = diff_map.stack()
-            # by using ne_stacked to index itself, we get only the columns
-            # that did change (see boolean indexing in pandas docs)
-            changed = ne_stacked[ne_stacked]
-            if changed.empty:
+            # rows and cols hold the positions of the cells that changed, so
+            # we can retrieve their sample, column and new value without
+            # looping over the DataFrame
+            rows, cols = np.where(diff_map.values)
+            if not len(rows):
                 warnings.warn(
                     "There are no differences between the data stored in the "
                     "DB and the new data provided",
                     qdb.exceptions.QiitaDBWarning)
                 return None, None
 
-            changed.index.names = ['sample_name', 'column']
-            # the combination of np.where and boolean indexing produces
-            # a numpy array with only the values that actually changed
-            # between the current_map and md_template
-            changed_to = md_template.values[np.where(diff_map)]
-            # now we are going to take that map and create a new DataFrame
-            # which is going to have a double level index (sample_id /
-            # column_name) with a single column 'to'; this will looks something
-            # like:
-            #                                               to
-            # sample_name column
-            # XX.Sample1  sample_type                            6
-            # XX.Sample2  sample_type                            5
-            #             host_subject_id             the only one
-            # XX.Sample3  sample_type                           10
-            #             physical_specimen_location  new location
-            to_update = pd.DataFrame({'to': changed_to}, index=changed.index)
-            # reset_index will expand the multi-index and convert the example
-            # to:
-            #    sample_name            column                 to
-            # 0  XX.Sample1                 sample_type             6
-            # 1  XX.Sample2                 sample_type             5
-            # 2  XX.Sample2             host_subject_id  the only one
-            # 3  XX.Sample3                 sample_type            10
-            # 4  XX.Sample3  physical_specimen_location  new location
-            to_update.reset_index(inplace=True)
-            new_columns = []
-            samples_updated = []
-            for sid, df in to_update.groupby('sample_name'):
-                samples_updated.append(sid)
-                # getting just columns: column and to, and then using column
-                # as index will generate this for XX.Sample2:
-                #                        to
-                # column
-                # sample_type                 5
-                # host_subject_id  the only one
-                df = df[['column', 'to']].set_index('column')
-                # finally to_dict in XX.Sample2:
-                # {'to': {'host_subject_id': 'the only one',
-                #         'sample_type': '5'}}
-                values = df.to_dict()['to']
-                new_columns.extend(values.keys())
-                sql = """UPDATE qiita.{0}
-                         SET sample_values = sample_values || %s
-                         WHERE sample_id = %s""".format(
-                            self._table_name(self._id))
-                qdb.sql_connection.TRN.add(sql, [dumps(values), sid])
+            # now we are going to group the changes by sample; this will looks
+            # something like:
+            # {'XX.Sample1': {'sample_type': '6'},
+            #  'XX.Sample2': {'sample_type': '5',
+            #                 'host_subject_id': 'the only one'}}
+            changed_to = md_template.values[rows, cols]
+            changed_samples = md_template.index.values[rows]
+            changed_columns = md_template.columns.values[cols]
+            to_update = defaultdict(dict)
+            for sid, column, value in zip(
+                    changed_samples, changed_columns, changed_to):
+                # indexing the numpy array returns numpy scalars (e.g. for
+                # the int columns) that json can't serialize
+                if isinstance(value, np.generic):
+                    value = value.item()
+                to_update[str(sid)][str(column)] = value
+            samples_updated = set(changed_samples)
+            new_columns = set(changed_columns)
 
-            nc = list(set(new_columns).union(set(self.categories())))
-            table_name = self._table_name(self.id)
+            table_name = self._table_name(self._id)
+            _update_sample_values(table_name, to_update)
+
+            nc = list(new_columns.union(current_columns))
             values = dumps({"columns": nc})
             sql = """UPDATE qiita.{0}
-                     SET sample_values = %s
+                     SET sample_values = sample_values || %s
                      WHERE sample_id = '{1}'""".format(
                         table_name, QIITA_COLUMN_NAME)
             qdb.sql_connection.TRN.add(sql, [values])
 
             qdb.sql_connection.TRN.execute()
 
-        return set(samples_updated), set(new_columns)
+        return samples_updated, new_columns
 
     def update(self, md_template):
         r"""Update values in the template
@@ -1487,16 +1763,21 @@ class MetadataTemplate(qdb.base.QiitaObject):
             can be thrown by the contained Samples.
         """
         with qdb.sql_connection.TRN:
+            table_name = self._table_name(self._id)
             if not set(self.keys()).issuperset(samples_and_values):
                 missing = set(self.keys()) - set(samples_and_values)
-                table_name = self._table_name(self._id)
                 raise qdb.exceptions.QiitaDBUnknownIDError(missing, table_name)
 
+            if category not in self.categories():
+                raise qdb.exceptions.QiitaDBColumnError(
+                    "Column %s does not exist in %s" % (category, table_name))
+
+            values = {}
             for k, v in viewitems(samples_and_values):
-                sample = self[k]
                 if isinstance(v, np.generic):
-                    v = np.asscalar(v)
-                sample.setitem(category, v)
+                    v = v.item()
+                values[k] = {category: v}
+            _update_sample_values(table_name, values)
 
             qdb.sql_connection.TRN.execute()
 
@@ -1636,14 +1917,43 @@ class MetadataTemplate(qdb.base.QiitaObject):
         restriction_dict : dict of {str: Restriction}
             A dictionary with the restrictions that apply to the metadata
 
+        Returns
+        -------
+        list of (str, str, str)
+            The sample id, column and value of the values that can't be
+            casted to the type required by their restriction
+
         Raises
         ------
         QiitaDBWarning
             If the values aren't castable
         """
         warning_msg = []
+        errors = []
         columns = self.categories()
         wrong_msg = 'Sample "%s", column "%s", wrong value "%s"'
+        restricted = {}
+        for restriction in viewvalues(restriction_dict):
+            if set(restriction.columns).issubset(columns):
+                restricted.update(restriction.columns)
+
+        if restricted:
+            # retrieve all the restricted columns at once, missing values
+            # are returned as 'None', as in get_category
+            names = sorted(restricted)
+            sql = """SELECT sample_id, {0}
+                     FROM qiita.{1}
+                     WHERE sample_id != '{2}'""".format(
+                ', '.join(["COALESCE(sample_values->>%s, 'None')"] *
+                          len(names)),
+                self._table_name(self._id), QIITA_COLUMN_NAME)
+            with qdb.sql_connection.TRN:
+                qdb.sql_connection.TRN.add(sql, names)
+                rows = qdb.sql_connection.TRN.execute_fetchindex()
+            values = pd.DataFrame(
+                [row[1:] for row in rows], columns=names, dtype=str,
+                index=[row[0] for row in rows])
+
         for label, restriction in viewitems(restriction_dict):
             missing = set(restriction.columns).difference(columns)
             if missing:
@@ -1651,40 +1961,10 @@ class MetadataTemplate(qdb.base.QiitaObject):
                     "%s: %s" % (restriction.error_msg,
                                 ', '.join(sorted(missing))))
             else:
-                valid_null = qdb.metadata_template.constants.EBI_NULL_VALUES
-                for column, datatype in viewitems(restriction.columns):
-                    # sorting by key (sample id) so we always check in the
-                    # same order, helpful for testing
-                    cats_by_column = self.get_category(column)
-                    for sample in sorted(cats_by_column):
-                        val = cats_by_column[sample]
-                        # ignore if valid null value
-                        if val in valid_null:
-                            continue
-                        # test values
-                        if datatype == datetime:
-                            val = str(val)
-                            formats = [
-                                # 4 digits year
-                                '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
-                                '%Y-%m-%d %H', '%Y-%m-%d', '%Y-%m', '%Y'
-                                ]
-                            date = None
-                            for fmt in formats:
-                                try:
-                                    date = datetime.strptime(val, fmt)
-                                    break
-                                except ValueError:
-                                    pass
-                            if date is None:
-                                warning_msg.append(
-                                    wrong_msg % (sample, column, val))
-                        else:
-                            try:
-                                datatype(val)
-                            except (ValueError, TypeError):
-                                warning_msg.append(
-                                    wrong_msg % (sample, column, val))
+                wrong = qdb.metadata_template.util.get_invalid_values(
+                    values, restriction.columns)
+                errors.extend(wrong)
+                warning_msg.extend(wrong_msg % w for w in wrong)
 
         if warning_msg:
             warnings.warn(
@@ -1693,6 +1973,8 @@ class MetadataTemplate(qdb.base.QiitaObject):
                 " of these fields." % ";\n\t".join(warning_msg),
                 qdb.exceptions.QiitaDBWarning)
 
+        return errors
+
     @classmethod
     def _identify_forbidden_words_in_column_names(cls, column_names):
         """Return a list of forbidden words found in column_names.
@@ -0,0 +1,340 @@
+r"""
+Metadata template cache (:mod: `qiita_db.metadata_template.cache`)
+==================================================================
+
+..currentmodule:: qiita_db.metadata_template.cache
+
+This module provides an in-memory cache of the sample and prep information
+files, so :meth:`MetadataTemplate.to_dataframe` doesn't have to rebuild the
+DataFrame from the database every time it is called for the same template.
+
+The templates are stored in a compact columnar form: each column keeps an
+array of integer codes plus the unique values of the column, which is a lot
+smaller than a DataFrame of python strings as most metadata columns only have
+a handful of distinct values. Each entry is stored together with the
+modification counter of the template, which is bumped every time the template
+is modified; thus, an entry is only used if its counter matches the one
+currently stored in the database.
+
+Classes
+-------
+
+..autosummary::
+    :toctree: generated/
+
+    ColumnarFrame
+    MetadataTemplateCache
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from collections import OrderedDict
+from sys import getsizeof
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from qiita_core.qiita_settings import qiita_config
+
+
+class ColumnarFrame(object):
+    """Compact, immutable, representation of a DataFrame of metadata
+
+    Parameters
+    ----------
+    index : pandas.Index
+        The index (sample ids) of the DataFrame
+    columns : list of str
+        The column names, in order
+    dtypes : dict of {str: dtype}
+        The dtype of each column
+    codes : list of np.ndarray of np.int32
+        The codes of each column, as positions in the corresponding `uniques`
+    uniques : list of np.ndarray of objects
+        The unique values of each column. If the column has missing values,
+        the missing value is the last element of the array and its code is -1
+
+    Attributes
+    ----------
+    nbytes : int
+        An estimation of the memory used by the frame, in bytes
+    """
+    def __init__(self, index, columns, dtypes, codes, uniques):
+        self._index = index
+        self._columns = columns
+        self._dtypes = dtypes
+        self._codes = codes
+        self._uniques = uniques
+        self.nbytes = (
+            self._index.nbytes +
+            sum(getsizeof(v) for v in self._index) +
+            sum(c.nbytes for c in self._codes) +
+            sum(u.nbytes + sum(getsizeof(v) for v in u)
+                for u in self._uniques))
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Encodes the given DataFrame
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            The DataFrame to encode
+
+        Returns
+        -------
+        ColumnarFrame
+            The encoded DataFrame
+        """
+        codes = []
+        uniques = []
+        for column in df.columns:
+            values = df[column].values
+            col_codes, col_uniques = pd.factorize(values)
+            col_uniques = np.asarray(col_uniques, dtype=object)
+            missing = col_codes == -1
+            if missing.any():
+                # pandas doesn't keep the missing values in the uniques so
+                # we store the first one as the last element; a code of -1
+                # points to it
+                col_uniques = np.append(
+                    col_uniques, np.array([values[missing][0]], dtype=object))
+            codes.append(col_codes.astype(np.int32))
+            uniques.append(col_uniques)
+
+        return cls(df.index.copy(), df.columns.tolist(), df.dtypes.to_dict(),
+                   codes, uniques)
+
+    def to_dataframe(self):
+        """Decodes the frame
+
+        Returns
+        -------
+        pandas.DataFrame
+            A new DataFrame with the same contents as the encoded one
+        """
+        data = OrderedDict(
+            (column, uniques[codes])
+            for column, codes, uniques in zip(
+                self._columns, self._codes, self._uniques))
+        df = pd.DataFrame(data, index=self._index.copy(),
+                          columns=self._columns, dtype=object)
+        return df.astype(self._dtypes, copy=False)
+
+
+class MetadataTemplateCache(object):
+    """LRU cache of metadata templates with a memory budget
+
+    The cache holds three kinds of entries per template: the full template,
+    as a ColumnarFrame, the set of its sample ids and a summary of the
+    template (see qiita_db.util.get_artifacts_information). All of them are
+    evicted as the budget requires and all of them are invalidated together.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum memory, in bytes, that the cached templates can use. If 0,
+        nothing is cached
+
+    Attributes
+    ----------
+    max_bytes : int
+        The maximum memory, in bytes, that the cached templates can use
+    hits : int
+        The number of times that a template was found in the cache
+    misses : int
+        The number of times that a template was not found in the cache
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, modification):
+        """Retrieves the frame stored under `key`
+
+        Parameters
+        ----------
+        key : str
+            The name of the template table
+        modification : str
+            The current modification counter of the template
+
+        Returns
+        -------
+        ColumnarFrame or None
+            The cached frame or None if the template is not cached or if the
+            cached copy is outdated
+        """
+        return self._get(key, modification)
+
+    def get_sample_ids(self, key, modification):
+        """Retrieves the sample ids of the template stored under `key`
+
+        Parameters
+        ----------
+        key : str
+            The name of the template table
+        modification : str
+            The current modification counter of the template
+
+        Returns
+        -------
+        frozenset of str or None
+            The cached sample ids or None if they are not cached or if the
+            cached copy is outdated
+        """
+        return self._get((key, 'sample_ids'), modification)
+
+    def put(self, key, modification, frame):
+        """Stores `frame` under `key`, evicting the least recently used
+        entries if needed
+
+        Parameters
+        ----------
+        key : str
+            The name of the template table
+        modification : str
+            The modification counter of the template
+        frame : ColumnarFrame
+            The frame to store
+        """
+        self._put(key, modification, frame, frame.nbytes)
+
+    def put_sample_ids(self, key, modification, sample_ids):
+        """Stores the sample ids of the template `key`, evicting the least
+        recently used entries if needed
+
+        Parameters
+        ----------
+        key : str
+            The name of the template table
+        modification : str
+            The modification counter of the template
+        sample_ids : frozenset of str
+            The sample ids to store
+        """
+        nbytes = getsizeof(sample_ids) + sum(getsizeof(s) for s in sample_ids)
+        self._put((key, 'sample_ids'), modification, sample_ids, nbytes)
+
+    def get_summary(self, key, modification):
+        """Retrieves the summary of the template stored under `key`
+
+        Parameters
+        ----------
+        key : str
+            The name of the template table
+        modification : str
+            The current modification counter of the template
+
+        Returns
+        -------
+        dict or None
+            The cached summary or None if it is not cached or if the cached
+            copy is outdated
+        """
+        return self._get((key, 'summary'), modification)
+
+    def put_summary(self, key, modification, summary):
+        """Stores the summary of the template `key`, evicting the least
+        recently used entries if needed
+
+        Parameters
+        ----------
+        key : str
+            The name of the template table
+        modification : str
+            The modification counter of the template
+        summary : dict of {str: object}
+            The summary to store
+        """
+        nbytes = getsizeof(summary) + sum(
+            getsizeof(v) for v in summary.values())
+        self._put((key, 'summary'), modification, summary, nbytes)
+
+    def invalidate(self, key):
+        """Removes all the entries of the template `key`, if present
+
+        Parameters
+        ----------
+        key : str
+            The name of the template table
+        """
+        with self._lock:
+            self._remove(key)
+            self._remove((key, 'sample_ids'))
+            self._remove((key, 'summary'))
+
+    def clear(self):
+        """Removes all the entries from the cache and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _get(self, key, modification):
+        """Retrieves the value stored under `key` if it is up to date"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != modification:
+                # the template has been modified since it was cached
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _put(self, key, modification, value, nbytes):
+        """Stores `value` under `key`, evicting the least recently used
+        entries until it fits"""
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+
+            while self._nbytes + nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+            self._entries[key] = (modification, value, nbytes)
+            self._nbytes += nbytes
+
+    def _remove(self, key):
+        """Removes `key` from the cache; the lock must be held"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry[2]
+
+    @property
+    def stats(self):
+        """The usage statistics of the cache
+
+        Returns
+        -------
+        dict
+            The number of hits, misses, entries and bytes used by the cache
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'nbytes': self._nbytes,
+                    'max_bytes': self.max_bytes}
+
+
+# the cache shared by all the templates of this process
+METADATA_CACHE = MetadataTemplateCache(
+    qiita_config.metadata_cache_size * 1024 * 1024)
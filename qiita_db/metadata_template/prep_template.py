@@ -131,6 +131,7 @@ class PrepTemplate(MetadataTemplate):
             # the recognized investigation types
             if investigation_type is not None:
                 cls.validate_investigation_type(investigation_type)
+            qdb.util.refresh_study_listing_after_commit()
 
             # Check if the data_type is the id or the string
             if isinstance(data_type, int):
@@ -240,6 +241,7 @@ class PrepTemplate(MetadataTemplate):
 
             if not cls.exists(id_):
                 raise qdb.exceptions.QiitaDBUnknownIDError(id_, cls.__name__)
+            qdb.util.refresh_study_listing_after_commit()
 
             sql = """SELECT (
                         SELECT artifact_id
@@ -279,6 +281,7 @@ class PrepTemplate(MetadataTemplate):
             qdb.sql_connection.TRN.add(sql, args)
 
             qdb.sql_connection.TRN.execute()
+            cls._forget(id_)
 
     def data_type(self, ret_id=False):
         """Returns the data_type or the data_type id
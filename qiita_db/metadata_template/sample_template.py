@@ -149,8 +149,15 @@ class SampleTemplate(MetadataTemplate):
             sql = "DELETE FROM qiita.{0} WHERE {1} = %s".format(
                 cls._table, cls._id_column)
             qdb.sql_connection.TRN.add(sql, args)
+            cls._samples_modified(id_)
 
             qdb.sql_connection.TRN.execute()
+            cls._forget(id_)
+
+    @classmethod
+    def _samples_modified(cls, obj_id):
+        # the number of samples of the study is shown in the study listing
+        qdb.util.mark_study_listing_modified([obj_id])
 
     @property
     def study_id(self):
@@ -0,0 +1,139 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+import qiita_db as qdb
+
+
+class TestColumnarFrame(TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame(
+            [['a', 'x', None], ['b', 'x', '1'], ['a', 'x', None]],
+            index=pd.Index(['1.S1', '1.S2', '1.S3'], name='sample_id'),
+            columns=['col_b', 'col_a', 'col_c'], dtype=str)
+
+    def test_round_trip(self):
+        CF = qdb.metadata_template.cache.ColumnarFrame
+        frame = CF.from_dataframe(self.df)
+        obs = frame.to_dataframe()
+        assert_frame_equal(obs, self.df)
+        # the order of the columns and the index name are kept
+        self.assertEqual(obs.columns.tolist(), ['col_b', 'col_a', 'col_c'])
+        self.assertEqual(obs.index.name, 'sample_id')
+        self.assertGreater(frame.nbytes, 0)
+
+    def test_to_dataframe_new_copy(self):
+        CF = qdb.metadata_template.cache.ColumnarFrame
+        frame = CF.from_dataframe(self.df)
+        obs = frame.to_dataframe()
+        obs.loc['1.S1', 'col_b'] = 'modified'
+        obs.sort_index(axis=1, inplace=True)
+        assert_frame_equal(frame.to_dataframe(), self.df)
+
+    def test_empty(self):
+        CF = qdb.metadata_template.cache.ColumnarFrame
+        df = pd.DataFrame([], columns=['col_a'], dtype=str)
+        df.index.name = 'sample_id'
+        obs = CF.from_dataframe(df).to_dataframe()
+        self.assertEqual(len(obs), 0)
+        self.assertEqual(obs.columns.tolist(), ['col_a'])
+
+
+class TestMetadataTemplateCache(TestCase):
+    def setUp(self):
+        CF = qdb.metadata_template.cache.ColumnarFrame
+        self.frame = CF.from_dataframe(pd.DataFrame(
+            [['a', 'b']], index=['1.S1'], columns=['col_a', 'col_b'],
+            dtype=str))
+        self.cache = qdb.metadata_template.cache.MetadataTemplateCache(
+            self.frame.nbytes * 2)
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get('sample_1', '1'))
+        self.cache.put('sample_1', '1', self.frame)
+        self.assertIs(self.cache.get('sample_1', '1'), self.frame)
+        self.assertEqual(self.cache.stats, {
+            'hits': 1, 'misses': 1, 'entries': 1,
+            'nbytes': self.frame.nbytes, 'max_bytes': self.frame.nbytes * 2})
+
+    def test_get_modified(self):
+        self.cache.put('sample_1', '1', self.frame)
+        # the counter changed, so the entry is outdated and it is removed
+        self.assertIsNone(self.cache.get('sample_1', '2'))
+        self.assertIsNone(self.cache.get('sample_1', '1'))
+        self.assertEqual(self.cache.stats['misses'], 2)
+        self.assertEqual(self.cache.stats['entries'], 0)
+        self.assertEqual(self.cache.stats['nbytes'], 0)
+
+    def test_put_evicts_lru(self):
+        self.cache.put('sample_1', '1', self.frame)
+        self.cache.put('prep_1', '2', self.frame)
+        # using sample_1 so prep_1 is the least recently used
+        self.cache.get('sample_1', '1')
+        self.cache.put('prep_2', '3', self.frame)
+        self.assertIsNone(self.cache.get('prep_1', '2'))
+        self.assertIs(self.cache.get('sample_1', '1'), self.frame)
+        self.assertIs(self.cache.get('prep_2', '3'), self.frame)
+        self.assertEqual(self.cache.stats['nbytes'], self.frame.nbytes * 2)
+
+    def test_put_too_big(self):
+        cache = qdb.metadata_template.cache.MetadataTemplateCache(0)
+        cache.put('sample_1', '1', self.frame)
+        self.assertIsNone(cache.get('sample_1', '1'))
+        self.assertEqual(cache.stats['entries'], 0)
+
+    def test_sample_ids(self):
+        cache = qdb.metadata_template.cache.MetadataTemplateCache(1024 * 1024)
+        ids = frozenset(['1.S1', '1.S2'])
+        self.assertIsNone(cache.get_sample_ids('sample_1', '1'))
+        cache.put('sample_1', '1', self.frame)
+        cache.put_sample_ids('sample_1', '1', ids)
+        self.assertEqual(cache.get_sample_ids('sample_1', '1'), ids)
+        # the frame and the sample ids are different entries
+        self.assertIs(cache.get('sample_1', '1'), self.frame)
+        self.assertEqual(cache.stats['entries'], 2)
+        self.assertIsNone(cache.get_sample_ids('sample_1', '2'))
+        self.assertIs(cache.get('sample_1', '1'), self.frame)
+
+        cache.put_sample_ids('sample_1', '1', ids)
+        cache.invalidate('sample_1')
+        self.assertEqual(cache.stats['entries'], 0)
+
+    def test_summary(self):
+        cache = qdb.metadata_template.cache.MetadataTemplateCache(1024 * 1024)
+        summary = {'prep_samples': 2, 'platform': 'Illumina'}
+        self.assertIsNone(cache.get_summary('prep_1', '1'))
+        cache.put_summary('prep_1', '1', summary)
+        cache.put_sample_ids('prep_1', '1', frozenset(['1.S1', '1.S2']))
+        self.assertEqual(cache.get_summary('prep_1', '1'), summary)
+        self.assertIsNone(cache.get_summary('prep_1', '2'))
+
+        cache.put_summary('prep_1', '2', summary)
+        cache.invalidate('prep_1')
+        self.assertEqual(cache.stats['entries'], 0)
+
+    def test_invalidate_clear(self):
+        self.cache.put('sample_1', '1', self.frame)
+        self.cache.put('prep_1', '2', self.frame)
+        self.cache.invalidate('sample_1')
+        # invalidating something that is not cached is fine
+        self.cache.invalidate('sample_1')
+        self.assertIsNone(self.cache.get('sample_1', '1'))
+        self.assertEqual(self.cache.stats['entries'], 1)
+        self.cache.clear()
+        self.assertEqual(self.cache.stats, {
+            'hits': 0, 'misses': 0, 'entries': 0, 'nbytes': 0,
+            'max_bytes': self.frame.nbytes * 2})
+
+
+if __name__ == '__main__':
+    main()
@@ -517,6 +517,29 @@ class TestSampleTemplate(TestCase):
         obs = self.tester._get_sample_ids()
         self.assertEqual(obs, self.exp_sample_ids)
 
+    def test_get_sample_ids_cached(self):
+        st = qdb.metadata_template.sample_template.SampleTemplate.create(
+            self.metadata, self.new_study)
+        sid = '%s.Sample1' % self.new_study.id
+        with qdb.sql_connection.TRN:
+            obs = st._get_sample_ids()
+            # within the transaction, the same set is returned
+            self.assertIs(st._get_sample_ids(), obs)
+            self.assertIn(sid, st)
+            self.assertEqual(len(st), 3)
+
+            # modifying the template refreshes the set
+            st.delete_samples([sid])
+            self.assertNotIn(sid, st)
+            self.assertEqual(len(st), 2)
+
+        # in a new transaction, the set comes from the cache as the template
+        # has not been modified
+        cache = qdb.metadata_template.cache.METADATA_CACHE
+        hits = cache.stats['hits']
+        self.assertEqual(len(st), 2)
+        self.assertEqual(cache.stats['hits'], hits + 1)
+
     def test_len(self):
         """Len returns the correct number of sample ids"""
         self.assertEqual(len(self.tester), 27)
@@ -695,6 +718,27 @@ class TestSampleTemplate(TestCase):
         for o, e in zip(sorted(list(obs)), sorted(exp)):
             self.assertEqual(o, e)
 
+    def test_items_views(self):
+        samples = dict(self.tester.items())
+        sample = samples['1.SKB8.640193']
+        exp = qdb.metadata_template.sample_template.Sample(
+            '1.SKB8.640193', self.tester)
+        # the views return the same as the samples retrieved on demand
+        self.assertEqual(sample, exp)
+        self.assertEqual(sample['season_environment'],
+                         exp['season_environment'])
+        self.assertEqual(sample._to_dict(), exp._to_dict())
+        self.assertEqual(set(sample.keys()), set(exp.keys()))
+        self.assertIn('season_environment', sample)
+        self.assertIsNone(sample.get('not_a_category'))
+        with self.assertRaises(KeyError):
+            sample['not_a_category']
+
+        # but they can't be modified
+        with self.assertRaises(
+                qdb.exceptions.QiitaDBOperationNotPermittedError):
+            sample.setitem('season_environment', 'summer')
+
     def test_get(self):
         """get returns the correct sample object"""
         obs = self.tester.get('1.SKM7.640188')
@@ -1274,6 +1318,42 @@ class TestSampleTemplate(TestCase):
         self.assertEqual(self.tester['1.SKD6.640190']['country'], "3")
         self.assertEqual(self.tester['1.SKM7.640188']['country'], negtest)
 
+    def test_update_category_single_statement(self):
+        """Updates all the samples with the same number of statements"""
+        st = qdb.metadata_template.sample_template.SampleTemplate.create(
+            self.metadata, self.new_study)
+        TRN = qdb.sql_connection.TRN
+
+        def _update(values):
+            before = TRN.statements_executed
+            st.update_category('description', {
+                '%d.%s' % (self.new_study.id, s): v
+                for s, v in values.items()})
+            return TRN.statements_executed - before
+
+        modification = st._get_modification_counter()
+        with TRN:
+            # the modification counter is only bumped by the first update of
+            # the transaction
+            _update({'Sample1': 'first'})
+            bumped = st._get_modification_counter()
+            self.assertNotEqual(bumped, modification)
+            one = _update({'Sample1': 'd1'})
+            three = _update({'Sample1': 'd2', 'Sample2': 'd3',
+                             'Sample3': 'd4'})
+            self.assertEqual(one, three)
+            self.assertEqual(st._get_modification_counter(), bumped)
+
+        obs = st.get_category('description')
+        exp = {'%d.Sample1' % self.new_study.id: 'd2',
+               '%d.Sample2' % self.new_study.id: 'd3',
+               '%d.Sample3' % self.new_study.id: 'd4'}
+        self.assertEqual(obs, exp)
+
+        # the next transaction bumps it again
+        _update({'Sample1': 'd5'})
+        self.assertNotEqual(st._get_modification_counter(), bumped)
+
     def test_update_equal(self):
         """It doesn't fail with the exact same template"""
         # Create a new sample tempalte
@@ -1328,6 +1408,49 @@ class TestSampleTemplate(TestCase):
         obs = {s_id: st[s_id]._to_dict() for s_id in st}
         self.assertEqual(obs, exp)
 
+    def test_update_single_statement(self):
+        """Updates all the samples with the same number of statements"""
+        st = qdb.metadata_template.sample_template.SampleTemplate.create(
+            self.metadata, self.new_study)
+        TRN = qdb.sql_connection.TRN
+
+        def _update(values):
+            md = pd.DataFrame.from_dict(
+                {'%d.%s' % (self.new_study.id, s): {'description': v}
+                 for s, v in values.items()}, orient='index', dtype=str)
+            before = TRN.statements_executed
+            st._update(md)
+            return TRN.statements_executed - before
+
+        with TRN:
+            # the first update leaves the caches in the same state for the
+            # next ones
+            _update({'Sample1': 'first'})
+            one = _update({'Sample1': 'd1'})
+            three = _update({'Sample1': 'd2', 'Sample2': 'd3',
+                             'Sample3': 'd4'})
+            self.assertEqual(one, three)
+
+        obs = st.get_category('description')
+        exp = {'%d.Sample1' % self.new_study.id: 'd2',
+               '%d.Sample2' % self.new_study.id: 'd3',
+               '%d.Sample3' % self.new_study.id: 'd4'}
+        self.assertEqual(obs, exp)
+
+    def test_update_int_column(self):
+        """Updates a column whose new values are numpy ints"""
+        st = qdb.metadata_template.sample_template.SampleTemplate.create(
+            self.metadata, self.new_study)
+        new_metadata = pd.DataFrame.from_dict(
+            {'Sample1': {'taxon_id': 9607}, 'Sample2': {'taxon_id': 9608}},
+            orient='index')
+        st.update(new_metadata)
+        obs = st.get_category('taxon_id')
+        exp = {'%d.Sample1' % self.new_study.id: 9607,
+               '%d.Sample2' % self.new_study.id: 9608,
+               '%d.Sample3' % self.new_study.id: '9606'}
+        self.assertEqual(obs, exp)
+
     def test_update_numpy(self):
         """Update values in existing mapping file with numpy values"""
         ST = qdb.metadata_template.sample_template.SampleTemplate
@@ -1361,6 +1484,10 @@ class TestSampleTemplate(TestCase):
                 'columns': sorted(['bool_col', 'date_col'])}]]
         # making sure they are always in the same order
         obs[2][1]['columns'] = sorted(obs[2][1]['columns'])
+        # the modification counter comes from a sequence so its value depends
+        # on the tests run before; we only care that it is there
+        self.assertIn('modification', obs[2][1])
+        del obs[2][1]['modification']
         self.assertEqual(sorted(obs), sorted(exp))
 
     def test_generate_files(self):
@@ -1699,6 +1826,31 @@ class TestSampleTemplate(TestCase):
         for s_id in exp_sample_ids:
             self.assertEqual(st[s_id]._to_dict(), exp_dict[s_id])
 
+    def test_extend_new_columns_single_statement(self):
+        """Fills the new columns with the same number of statements"""
+        st = qdb.metadata_template.sample_template.SampleTemplate.create(
+            self.metadata, self.new_study)
+        TRN = qdb.sql_connection.TRN
+
+        def _extend(column, samples):
+            md = self.metadata.loc[samples].copy()
+            md[column] = pd.Series('val', index=md.index)
+            before = TRN.statements_executed
+            npt.assert_warns(qdb.exceptions.QiitaDBWarning, st.extend, md)
+            return TRN.statements_executed - before
+
+        with TRN:
+            # the first extend leaves the caches in the same state for the
+            # next ones
+            _extend('first', ['Sample1'])
+            one = _extend('one', ['Sample1'])
+            three = _extend('three', ['Sample1', 'Sample2', 'Sample3'])
+            self.assertEqual(one, three)
+
+        self.assertEqual(st.get_category('three'),
+                         {'%s.Sample%d' % (st.id, i): 'val'
+                          for i in range(1, 4)})
+
     def test_extend_new_samples_and_columns(self):
         """extend correctly adds new samples and columns at the same time"""
         st = qdb.metadata_template.sample_template.SampleTemplate.create(
@@ -1977,6 +2129,32 @@ class TestSampleTemplate(TestCase):
             'anonymized_name', 'tot_org_carb', 'description_duplicate',
             'env_feature', 'scientific_name', 'qiita_study_id'})
 
+    def test_to_dataframe_cache(self):
+        cache = qdb.metadata_template.cache.METADATA_CACHE
+        st = qdb.metadata_template.sample_template.SampleTemplate.create(
+            self.metadata, self.new_study)
+        # creating the template also generates its files, so it is already
+        # in the cache
+        hits, misses = cache.stats['hits'], cache.stats['misses']
+        exp = st.to_dataframe()
+        self.assertEqual(cache.stats['hits'], hits + 1)
+        self.assertEqual(cache.stats['misses'], misses)
+
+        # modifying the returned dataframe doesn't modify the cached one
+        exp_copy = exp.copy()
+        exp['description'] = 'modified'
+        assert_frame_equal(st.to_dataframe(), exp_copy)
+        self.assertEqual(cache.stats['hits'], hits + 2)
+
+        # modifying the template invalidates the cached copy
+        st.update_category('description', {
+            '%s.Sample1' % self.new_study.id: 'New description'})
+        obs = st.to_dataframe()
+        self.assertEqual(cache.stats['misses'], misses + 1)
+        self.assertEqual(
+            obs.loc['%s.Sample1' % self.new_study.id, 'description'],
+            'New description')
+
     def test_check_restrictions(self):
         obs = self.tester.check_restrictions(
             [STC['EBI']])
@@ -2172,6 +2350,18 @@ class TestSampleTemplate(TestCase):
                          'wrong value "None"' % self.new_study.id)
             self.assertIn(exp_error, message)
 
+    def test_validate_return(self):
+        self.metadata.set_value('Sample1', 'collection_timestamp',
+                                'wrong date')
+        self.metadata.set_value('Sample2', 'latitude', 'wrong latitude')
+        with catch_warnings(record=True):
+            st = qdb.metadata_template.sample_template.SampleTemplate.create(
+                self.metadata, self.new_study)
+            obs = st.validate(STC)
+        exp = [('%s.Sample1' % st.id, 'collection_timestamp', 'wrong date'),
+               ('%s.Sample2' % st.id, 'latitude', 'wrong latitude')]
+        self.assertCountEqual(obs, exp)
+
     def test_validate_errors_timestampA_year4digits(self):
         self.metadata.set_value('Sample1', 'collection_timestamp',
                                 '2016-09-20 12:00')
@@ -2303,8 +2493,21 @@ class TestSampleTemplate(TestCase):
                         'taxon_id': '9606',
                         'scientific_name': 'homo sapiens'}}
         md_ext = pd.DataFrame.from_dict(md_dict, orient='index', dtype=str)
+
+        def _listed_samples():
+            with qdb.sql_connection.TRN:
+                qdb.sql_connection.TRN.add(
+                    """SELECT number_samples_collected
+                       FROM qiita.study_listing
+                       WHERE study_id = 1""")
+                return qdb.sql_connection.TRN.execute_fetchlast()
+
+        # adding or deleting samples refreshes the study listing
+        n_samples = _listed_samples()
         npt.assert_warns(QE.QiitaDBWarning, st.extend, md_ext)
+        self.assertEqual(_listed_samples(), n_samples + 3)
         st.delete_samples(['1.Sample4'])
+        self.assertEqual(_listed_samples(), n_samples + 2)
         self.assertNotIn('1.Sample4', st.keys())
         self.assertIn('1.Sample5', st.keys())
         self.assertIn('1.Sample6', st.keys())
@@ -10,6 +10,7 @@ from six import StringIO
 from inspect import currentframe, getfile
 from os.path import dirname, abspath, join
 from unittest import TestCase, main
+from datetime import datetime
 import warnings
 
 import numpy.testing as npt
@@ -265,6 +266,52 @@ class TestUtil(TestCase):
         exp.index.name = 'sample_name'
         assert_frame_equal(obs, exp, check_like=True)
 
+    def test_iter_sample_rows(self):
+        obs = list(qdb.metadata_template.util.iter_sample_rows(
+            self.metadata_map, chunk_size=2))
+        exp = [(sid, row.to_json())
+               for sid, row in self.metadata_map.iterrows()]
+        self.assertEqual(obs, exp)
+
+    def test_get_invalid_values(self):
+        md_template = pd.DataFrame(
+            {'collection_timestamp': ['2016', '16-12', 'Not applicable',
+                                      '2016-02-30', '2016-02-29 10:30',
+                                      '2016\n'],
+             'latitude': ['1.5', 'wrong', None, 'nan', '-3', '2']},
+            index=['s.3', 's.1', 's.2', 's.5', 's.4', 's.6'], dtype=str)
+        obs = qdb.metadata_template.util.get_invalid_values(
+            md_template, {'latitude': float, 'collection_timestamp': datetime})
+        exp = [('s.1', 'latitude', 'wrong'),
+               ('s.2', 'latitude', 'None'),
+               ('s.1', 'collection_timestamp', '16-12'),
+               ('s.5', 'collection_timestamp', '2016-02-30'),
+               ('s.6', 'collection_timestamp', '2016\n')]
+        self.assertEqual(obs, exp)
+
+    def test_benchmark_restriction_validation(self):
+        obs = qdb.metadata_template.util.benchmark_restriction_validation(10)
+        self.assertGreaterEqual(obs, 0)
+
+    def test_template_stream(self):
+        stream = qdb.metadata_template.util._TemplateStream(
+            iter([' a \t b \r\n', '\tc\n']), 'h\tx\n', block_lines=1)
+        self.assertEqual(list(stream), ['h\tx\n', 'a\tb\n', '\tc\n'])
+        self.assertFalse(stream.special_chars)
+
+        stream = qdb.metadata_template.util._TemplateStream(
+            iter(['a \t"b c"', '\n d']))
+        self.assertEqual(stream.read(), 'a\t"b c"\nd\n')
+        self.assertTrue(stream.special_chars)
+
+    def test_benchmark_template_parsing(self):
+        obs = qdb.metadata_template.util.benchmark_template_parsing(10, 2)
+        self.assertCountEqual(obs, ['size', 'seconds'])
+
+    def test_benchmark_sample_loading(self):
+        obs = qdb.metadata_template.util.benchmark_sample_loading(10, 2)
+        self.assertCountEqual(obs, ['insert', 'copy'])
+
     def test_get_invalid_sample_names(self):
         all_valid = ['2.sample.1', 'foo.bar.baz', 'roses', 'are', 'red',
                      'v10l3t5', '4r3', '81u3']
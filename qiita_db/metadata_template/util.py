@@ -7,11 +7,17 @@
 # -----------------------------------------------------------------------------
 
 from __future__ import division
-from six import StringIO
 
 import pandas as pd
 import numpy as np
+import re
 import warnings
+from datetime import datetime
+from itertools import islice
+from os import close, remove
+from os.path import getsize
+from tempfile import mkstemp
+from time import time
 from skbio.util import find_duplicates
 
 import qiita_db as qdb
@@ -51,6 +57,129 @@ def prefix_sample_names_with_id(md_template, study_id):
     md_template.index.name = None
 
 
+class _TemplateStream(object):
+    """Read-only file-like object with the cleaned lines of a template
+
+    The cells of the lines are stripped from spaces and carriage returns as
+    pandas reads the stream, a block of lines at a time, so the template is
+    never held in memory as text.
+
+    Parameters
+    ----------
+    lines : iterator of str
+        The lines of the template, ending in a new line character
+    header : str, optional
+        The already cleaned header line of the template, if any
+
+    Attributes
+    ----------
+    special_chars : bool
+        Whether any of the lines read so far has quotes, carriage returns,
+        vertical tabs or form feeds
+    """
+    _paddings = [(p, p.strip(' \r')) for p in (
+        ' \t', '\t ', '\r\t', '\t\r', ' \n', '\n ', '\r\n', '\n\r')]
+    _tab_padding = re.compile('[ \r]+\t[ \r]*|\t[ \r]+')
+    _newline_padding = re.compile('[ \r]+\n[ \r]*|\n[ \r]+')
+    _special_chars = re.compile('["\r\x0b\x0c]')
+
+    def __init__(self, lines, header=None, block_lines=10000):
+        self._lines = lines
+        self._block_lines = block_lines
+        self._buffer = header or ''
+        self.special_chars = bool(header and self._special_chars.search(
+            header))
+
+    def _next_block(self):
+        block = ''.join(islice(self._lines, self._block_lines))
+        if not block:
+            return None
+        # the last line of the file may not have a new line
+        if not block.endswith('\n'):
+            block += '\n'
+        # cells are usually padded with a single space, which str.replace
+        # removes a lot faster than a regular expression
+        for _ in range(3):
+            padded = [p for p in self._paddings if p[0] in block]
+            if not padded:
+                break
+            for padding, sep in padded:
+                block = block.replace(padding, sep)
+        else:
+            block = self._tab_padding.sub('\t', block)
+            block = self._newline_padding.sub('\n', block)
+        block = block.lstrip(' \r')
+        if not self.special_chars:
+            self.special_chars = bool(self._special_chars.search(block))
+        return block
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            block = self._next_block()
+            if block is None:
+                break
+            self._buffer += block
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self):
+        while '\n' not in self._buffer:
+            block = self._next_block()
+            if block is None:
+                break
+            self._buffer += block
+        pos = self._buffer.find('\n') + 1 or len(self._buffer)
+        data, self._buffer = self._buffer[:pos], self._buffer[pos:]
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+def _read_template(stream, index):
+    """Parses the cleaned lines of a template
+
+    Parameters
+    ----------
+    stream : _TemplateStream
+        The cleaned lines of the template
+    index : str
+        The column with the sample identifiers
+
+    Returns
+    -------
+    DataFrame
+        The contents of the template, all as strings
+    """
+    # index_col:
+    #   is set as False, otherwise it is cast as a float and we want a string
+    # keep_default:
+    #   is set as False, to avoid inferring empty/NA values with the defaults
+    #   that Pandas has.
+    # comment:
+    #   using the tab character as "comment" we remove rows that are
+    #   constituted only by delimiters i. e. empty rows.
+    template = pd.read_csv(
+        stream,
+        sep='\t',
+        dtype=str,
+        encoding='utf-8',
+        infer_datetime_format=False,
+        keep_default_na=False,
+        index_col=False,
+        comment='\t',
+        converters={index: lambda x: str(x).strip()})
+    # remove newlines and tabs from fields; they can only be there if the
+    # fields were quoted, or if they are vertical tabs or form feeds
+    if stream.special_chars:
+        template.replace(to_replace='[\t\n\r\x0b\x0c]+', value='',
+                         regex=True, inplace=True)
+    return template
+
+
 def load_template_to_dataframe(fn, index='sample_name'):
     """Load a sample/prep template or a QIIME mapping file into a data frame
 
@@ -91,36 +220,35 @@ def load_template_to_dataframe(fn, index='sample_name'):
 
     Everything in the DataFrame will be read and managed as string
     """
-    # Load in file lines
-    holdfile = None
     with qdb.util.open_file(fn, newline=None,
                             encoding="utf8", errors='ignore') as f:
-        holdfile = f.readlines()
-
-    if not holdfile:
-        raise ValueError('Empty file passed!')
-
-    if index == "#SampleID":
-        # We're going to parse a QIIME mapping file. We are going to first
-        # parse it with the QIIME function so we can remove the comments
-        # easily and make sure that QIIME will accept this as a mapping file
-        data, headers, comments = _parse_mapping_file(holdfile)
-        holdfile = ["%s\n" % '\t'.join(d) for d in data]
-        holdfile.insert(0, "%s\n" % '\t'.join(headers))
-        # The QIIME parser fixes the index and removes the #
-        index = 'SampleID'
-
-    # Strip all values in the cells in the input file
-    for pos, line in enumerate(holdfile):
-        cols = line.split('\t')
-        if pos == 0 and index != 'SampleID':
+        lines = iter(f)
+        if index == "#SampleID":
+            # We're going to parse a QIIME mapping file. We are going to first
+            # parse it with the QIIME function so we can remove the comments
+            # easily and make sure that QIIME will accept this as a mapping
+            # file
+            holdfile = list(lines)
+            if not holdfile:
+                raise ValueError('Empty file passed!')
+            data, headers, comments = _parse_mapping_file(holdfile)
+            holdfile = ["%s\n" % '\t'.join(d) for d in data]
+            holdfile.insert(0, "%s\n" % '\t'.join(headers))
+            # The QIIME parser fixes the index and removes the #
+            index = 'SampleID'
+            template = _read_template(_TemplateStream(iter(holdfile)), index)
+        else:
+            header = next(lines, None)
+            if header is None:
+                raise ValueError('Empty file passed!')
+
             # get and clean the controlled columns
             ccols = {'sample_name'}
             ccols.update(qdb.metadata_template.constants.CONTROLLED_COLS)
             newcols = [
                 c.lower().strip() if c.lower().strip() in ccols
                 else c.strip()
-                for c in cols]
+                for c in header.split('\t')]
 
             # while we are here, let's check for duplicate columns headers
             ncols = set(newcols)
@@ -130,35 +258,10 @@ def load_template_to_dataframe(fn, index='sample_name'):
                         'Your file has empty columns headers.')
                 raise qdb.exceptions.QiitaDBDuplicateHeaderError(
                     find_duplicates(newcols))
-        else:
-            # .strip will remove odd chars, newlines, tabs and multiple
-            # spaces but we need to read a new line at the end of the
-            # line(+'\n')
-            newcols = [d.strip(" \r\n") for d in cols]
 
-        holdfile[pos] = '\t'.join(newcols) + '\n'
+            template = _read_template(
+                _TemplateStream(lines, '\t'.join(newcols) + '\n'), index)
 
-    # index_col:
-    #   is set as False, otherwise it is cast as a float and we want a string
-    # keep_default:
-    #   is set as False, to avoid inferring empty/NA values with the defaults
-    #   that Pandas has.
-    # comment:
-    #   using the tab character as "comment" we remove rows that are
-    #   constituted only by delimiters i. e. empty rows.
-    template = pd.read_csv(
-        StringIO(''.join(holdfile)),
-        sep='\t',
-        dtype=str,
-        encoding='utf-8',
-        infer_datetime_format=False,
-        keep_default_na=False,
-        index_col=False,
-        comment='\t',
-        converters={index: lambda x: str(x).strip()})
-    # remove newlines and tabs from fields
-    template.replace(to_replace='[\t\n\r\x0b\x0c]+', value='',
-                     regex=True, inplace=True)
     # removing columns with empty values
     template.dropna(axis='columns', how='all', inplace=True)
     if template.empty:
@@ -180,8 +283,7 @@ def load_template_to_dataframe(fn, index='sample_name'):
 
     # it is not uncommon to find templates that have empty columns so let's
     # find the columns that are all ''
-    columns = np.where(np.all(template.applymap(lambda x: x == ''), axis=0))
-    template.drop(template.columns[columns], axis=1, inplace=True)
+    template = template.loc[:, ~(template == '').all(axis=0).values]
 
     initial_columns.remove(index)
     dropped_cols = initial_columns - set(template.columns)
@@ -212,6 +314,35 @@ def load_template_to_dataframe(fn, index='sample_name'):
     return template
 
 
+def iter_sample_rows(md_template, chunk_size=1000):
+    r"""Yields the samples of `md_template` as they are stored in the database
+
+    Parameters
+    ----------
+    md_template : DataFrame
+        The metadata template contents indexed by sample ids
+    chunk_size : int, optional
+        The number of samples serialized at once. Defaults to 1000
+
+    Yields
+    ------
+    (str, str)
+        The sample id and the JSON document with the values of the sample
+
+    Notes
+    -----
+    The JSON documents are generated in chunks, so the samples can be sent to
+    the database with COPY without serializing the whole template at once
+    """
+    for start in range(0, len(md_template.index), chunk_size):
+        chunk = md_template.iloc[start:start + chunk_size]
+        # the JSON documents can't contain new lines, as they are escaped
+        docs = [doc for doc in chunk.to_json(
+            orient='records', lines=True).split('\n') if doc]
+        for sample_id, doc in zip(chunk.index, docs):
+            yield sample_id, doc
+
+
 def get_invalid_sample_names(sample_names):
     """Get a list of sample names that are not QIIME compliant
 
@@ -386,3 +517,242 @@ def get_qiime2_reserved_words():
                                     'id', 'sample id', 'sample-id', 'sampleid']
 
     return set(qiime2_reserved_column_names)
+
+
+# Matches the values accepted by datetime.strptime with any of the formats
+# '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H', '%Y-%m-%d', '%Y-%m'
+# and '%Y'. The subpatterns are the ones used by strptime for each directive;
+# note that \Z is used as $ also matches before a trailing newline
+DATETIME_REGEX = (
+    r'^(?P<Y>\d\d\d\d)'
+    r'(?:-(?P<m>1[0-2]|0[1-9]|[1-9])'
+    r'(?:-(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])'
+    r'(?:\s+(?:2[0-3]|[0-1]\d|\d)'
+    r'(?::(?:[0-5]\d|\d)'
+    r'(?::(?:[0-5]\d|\d))?)?)?)?)?\Z')
+
+# Matches the values accepted by int() without any further check
+INT_REGEX = r'^\s*[+-]?\d+\s*$'
+
+
+def _invalid_values_mask(values, datatype):
+    """Returns which values can't be casted to datatype
+
+    Parameters
+    ----------
+    values : pd.Series of str
+        The values to check
+    datatype : type
+        The type the values should be castable to. For datetime, the values
+        should be dates in one of the formats of DATETIME_REGEX
+
+    Returns
+    -------
+    np.ndarray of bool
+        True for the values that can't be casted to datatype
+    """
+    if datatype in (str, bool):
+        # any value can be casted to these
+        return np.zeros(len(values), dtype=bool)
+
+    if datatype == datetime:
+        parts = values.str.extract(DATETIME_REGEX, expand=True)
+        invalid = parts['Y'].isnull().values
+        # the regex doesn't know about the length of each month nor about
+        # the year 0
+        year = pd.to_numeric(parts['Y'], errors='coerce').fillna(1)
+        month = pd.to_numeric(parts['m'], errors='coerce').fillna(1)
+        day = pd.to_numeric(parts['d'], errors='coerce').fillna(1)
+        leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        month_days = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+        days = month_days[month.values.astype(int) - 1] + (
+            leap & (month == 2)).values
+        return invalid | (year < 1).values | (day.values > days)
+
+    if datatype == int:
+        invalid = ~values.str.match(INT_REGEX).fillna(False).values
+    elif datatype == float:
+        invalid = np.array(
+            pd.to_numeric(values, errors='coerce').isnull().values)
+    else:
+        invalid = np.ones(len(values), dtype=bool)
+
+    # the values that are not valid in the vectorized checks may still be
+    # castable (e.g. '1_000' or 'nan'), so make sure using python
+    for i in np.flatnonzero(invalid):
+        try:
+            datatype(values.iat[i])
+        except (ValueError, TypeError):
+            continue
+        invalid[i] = False
+    return invalid
+
+
+def get_invalid_values(md_template, columns):
+    """Finds the values of the template that don't match the column types
+
+    Parameters
+    ----------
+    md_template : pd.DataFrame of str
+        The metadata template, indexed by sample id
+    columns : dict of {str: type}
+        The columns to check and the type their values should have
+
+    Returns
+    -------
+    list of (str, str, str)
+        The sample id, column and value of each wrong value, sorted by
+        column, in the order of `columns`, and sample id
+
+    Notes
+    -----
+    The EBI null values are always valid. Each distinct value of a column
+    is only checked once
+    """
+    null_values = qdb.metadata_template.constants.EBI_NULL_VALUES
+    md_template = md_template.sort_index()
+    errors = []
+    for column, datatype in columns.items():
+        # missing values are checked as 'None', as get_category returns them
+        values = md_template[column].fillna('None').astype(str)
+        codes, uniques = pd.factorize(values)
+        uniques = pd.Series(uniques)
+        invalid = _invalid_values_mask(uniques, datatype)
+        invalid &= ~uniques.isin(null_values).values
+        for i in np.flatnonzero(invalid[codes]):
+            errors.append((md_template.index[i], column, values.iat[i]))
+    return errors
+
+
+def benchmark_restriction_validation(n_samples):
+    """Times the validation of the sample information restrictions
+
+    Parameters
+    ----------
+    n_samples : int
+        The number of samples of the template
+
+    Returns
+    -------
+    float
+        The seconds needed to find the wrong values of the template
+
+    Notes
+    -----
+    The template has the columns of all the sample template restrictions and
+    every value is different, which is the worst case for the validation
+    """
+    restrictions = qdb.metadata_template.constants.SAMPLE_TEMPLATE_COLUMNS
+    columns = {}
+    for restriction in restrictions.values():
+        columns.update(restriction.columns)
+    examples = {datetime: '2016-%02d-%02d %02d:%02d', int: '%d%d%d%d',
+                float: '%d.%d%d%d', bool: '%d%d%d%d', str: 'value %d%d%d%d'}
+    md_template = pd.DataFrame(
+        {c: [examples[t] % (i % 12 + 1, i % 28 + 1, i % 24, i % 60)
+             for i in range(n_samples)]
+         for c, t in columns.items()},
+        index=['sample.%d' % i for i in range(n_samples)], dtype=str)
+    # 1% of wrong values
+    md_template.iloc[::100] = 'wrong value'
+
+    start = time()
+    get_invalid_values(md_template, columns)
+    return time() - start
+
+
+def benchmark_template_parsing(n_samples, n_columns):
+    """Times the parsing of an information file
+
+    Parameters
+    ----------
+    n_samples : int
+        The number of samples of the file
+    n_columns : int
+        The number of metadata columns of each sample
+
+    Returns
+    -------
+    dict of {str: float}
+        The size of the file, in Mb, keyed by 'size', and the seconds needed
+        to parse it with load_template_to_dataframe, keyed by 'seconds'
+
+    Notes
+    -----
+    The values are padded with spaces, as it is common in the files
+    exported from spreadsheets. A file of 200,000 samples and 50 columns is
+    about 100 Mb
+    """
+    fd, fp = mkstemp(suffix='.txt')
+    close(fd)
+    try:
+        with open(fp, 'w') as f:
+            f.write('sample_name\t%s\n' % '\t'.join(
+                'column_%d' % i for i in range(n_columns)))
+            for i in range(n_samples):
+                f.write('sample.%d\t%s\n' % (i, '\t'.join(
+                    ['value %d ' % (i % 100)] * n_columns)))
+        size = getsize(fp) / (1024 * 1024)
+
+        start = time()
+        load_template_to_dataframe(fp)
+        seconds = time() - start
+    finally:
+        remove(fp)
+
+    return {'size': size, 'seconds': seconds}
+
+
+def benchmark_sample_loading(n_samples, n_columns):
+    """Compares the time needed to store samples with INSERTs and with COPY
+
+    Parameters
+    ----------
+    n_samples : int
+        The number of samples to store
+    n_columns : int
+        The number of metadata columns of each sample
+
+    Returns
+    -------
+    dict of {str: float}
+        The seconds needed to store the samples with each method, keyed by
+        'insert' and 'copy'
+
+    Notes
+    -----
+    The samples are stored in a temporary table, as in the dynamic tables of
+    the sample and prep information files, and the transaction is rolled
+    back at the end so nothing is left in the database
+    """
+    md_template = pd.DataFrame(
+        [['value %d' % (i % 10)] * n_columns for i in range(n_samples)],
+        index=['sample.%d' % i for i in range(n_samples)],
+        columns=['column_%d' % i for i in range(n_columns)], dtype=str)
+
+    timings = {}
+    with qdb.sql_connection.TRN:
+        sql = """CREATE TEMPORARY TABLE benchmark_{0} (
+                    sample_id VARCHAR NOT NULL PRIMARY KEY,
+                    sample_values JSONB NOT NULL)"""
+        for method in ('insert', 'copy'):
+            qdb.sql_connection.TRN.add(sql.format(method))
+        qdb.sql_connection.TRN.execute()
+
+        start = time()
+        values = [(k, row.to_json()) for k, row in md_template.iterrows()]
+        qdb.sql_connection.TRN.add(
+            """INSERT INTO benchmark_insert (sample_id, sample_values)
+               VALUES (%s, %s)""", values, many=True)
+        qdb.sql_connection.TRN.execute()
+        timings['insert'] = time() - start
+
+        start = time()
+        qdb.sql_connection.TRN.copy_from(
+            'benchmark_copy', ['sample_id', 'sample_values'],
+            iter_sample_rows(md_template))
+        timings['copy'] = time() - start
+
+        qdb.sql_connection.TRN.rollback()
+
+    return timings
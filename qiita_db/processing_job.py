@@ -14,10 +14,10 @@ from future.utils import viewitems, viewvalues
 from itertools import chain
 from json import dumps, loads
 from multiprocessing import Process, Queue, Event
-from qiita_core.qiita_settings import qiita_config
+from qiita_core.qiita_settings import qiita_config, r_client
 from qiita_db.util import create_nested_path
-from re import search, findall
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, DEVNULL
+from xml.etree.ElementTree import iterparse, ParseError
 from time import sleep, time
 from uuid import UUID
 from os.path import join
@@ -25,6 +25,177 @@ from threading import Thread
 from qiita_core.exceptions import IncompetentQiitaDeveloperError
 
 
+# the redis list where the Torque epilogue pushes the status of the jobs
+JOB_STATUS_KEY = 'qiita-watcher-job-status'
+# the postgres channel where the changes in the status of the jobs are
+# notified; see patch 79.sql
+JOB_STATUS_CHANNEL = 'qiita_processing_job_status'
+# seconds between the checks of the status of the validators in case a
+# notification is lost
+VALIDATOR_CHECK_INTERVAL = 60
+
+
+class QstatStatusSource(object):
+    """Retrieves the status of the jobs by polling qstat
+
+    Parameters
+    ----------
+    owner : str
+        The owner of the jobs to report
+    command : str, optional
+        The command that lists the jobs as XML. Defaults to 'qstat -x'
+    """
+    def __init__(self, owner, command='qstat -x'):
+        self.owner = owner
+        self.command = command
+
+    def is_available(self):
+        """Whether the command can be executed
+
+        Returns
+        -------
+        bool
+            True if the command runs successfully, False otherwise
+        """
+        proc = Popen(self.command, shell=True, stdout=DEVNULL, stderr=DEVNULL)
+        return proc.wait() == 0
+
+    def poll(self):
+        """Retrieves the status of the jobs of the owner
+
+        Returns
+        -------
+        list of dict or None
+            The Job_Id, Job_Name, job_state, and if present, depend and
+            exit_status of each job. None if the command failed
+        """
+        proc = Popen(self.command, shell=True, stdout=PIPE, stderr=DEVNULL)
+        try:
+            jobs = list(self._parse(proc.stdout))
+        finally:
+            # make sure that qstat doesn't block on a full pipe
+            proc.stdout.read()
+            proc.stdout.close()
+        if proc.wait() != 0:
+            return None
+        return jobs
+
+    def _parse(self, stream):
+        """Parses the qstat XML output as it is read
+
+        Parameters
+        ----------
+        stream : file-like object
+            The qstat output
+
+        Yields
+        ------
+        dict
+            The metadata of each job that belongs to the owner
+        """
+        try:
+            for _, elem in iterparse(stream):
+                if elem.tag != 'Job':
+                    continue
+                if elem.findtext('Job_Owner') == self.owner:
+                    yield self._element_extract(
+                        elem, ['Job_Id', 'Job_Name', 'job_state'],
+                        ['depend', 'exit_status'])
+                # the jobs already processed are not needed anymore
+                elem.clear()
+        except ParseError:
+            # qstat doesn't output anything when there are no jobs; any job
+            # parsed before a truncated output is still valid
+            pass
+
+    @staticmethod
+    def _element_extract(elem, list_of_elements, list_of_optional_elements):
+        results = {}
+        missing_elements = []
+
+        for element in list_of_elements:
+            value = elem.findtext(element)
+            if value is not None:
+                results[element] = value
+            else:
+                missing_elements.append(element)
+
+        if missing_elements:
+            raise AssertionError("The following elements were not found: %s"
+                                 % ', '.join(missing_elements))
+
+        for element in list_of_optional_elements:
+            value = elem.findtext(element)
+            if value is not None:
+                results[element] = value
+
+        return results
+
+
+class CallbackStatusSource(object):
+    """Receives the status of the jobs pushed by the Torque epilogue
+
+    Parameters
+    ----------
+    key : str, optional
+        The redis list where the status of the jobs is pushed. Defaults to
+        JOB_STATUS_KEY
+
+    Notes
+    -----
+    The epilogue pushes the status of the job with `push`, usually through
+    `qiita ware job-epilogue`
+    """
+    def __init__(self, key=JOB_STATUS_KEY):
+        self.key = key
+
+    @staticmethod
+    def push(job_id, job_name, exit_status, key=JOB_STATUS_KEY):
+        """Pushes the status of a job that has completed
+
+        Parameters
+        ----------
+        job_id : str
+            The Torque job id
+        job_name : str
+            The Torque job name
+        exit_status : str or int
+            The exit status of the job
+        key : str, optional
+            The redis list where the status of the job is pushed. Defaults to
+            JOB_STATUS_KEY
+        """
+        r_client.rpush(key, dumps({
+            'Job_Id': job_id, 'Job_Name': job_name, 'job_state': 'C',
+            'exit_status': str(exit_status)}))
+
+    def wait(self, timeout):
+        """Waits for the status of the jobs to be pushed
+
+        Parameters
+        ----------
+        timeout : float
+            The maximum number of seconds to wait
+
+        Returns
+        -------
+        list of dict
+            The status of the jobs pushed, in the same format as
+            QstatStatusSource.poll; empty if nothing was pushed before the
+            timeout
+        """
+        # redis only takes whole seconds and 0 means waiting forever
+        item = r_client.blpop(self.key, max(int(timeout), 1))
+        if item is None:
+            return []
+        # get everything else that is already waiting in a single round trip
+        pipe = r_client.pipeline()
+        pipe.lrange(self.key, 0, -1)
+        pipe.delete(self.key)
+        pending, _ = pipe.execute()
+        return [loads(i) for i in [item[1]] + pending]
+
+
 class Watcher(Process):
     # TODO: Qiita will need a proper mapping of these states to Qiita states
     # Currently, these strings are being inserted directly into Qiita's status
@@ -36,6 +207,12 @@ class Watcher(Process):
     # a separate thread, so it can periodically update the database w/metadata
     # from Watcher's queue. Qiita's script also calls qdb.complete() so there
     # are no circular references. TODO: replace w/a REST call.
+    #
+    # The status of the jobs comes from two sources: the Torque epilogue
+    # pushes the status of each job as soon as it completes (callback_source)
+    # and qstat is still polled every polling_value seconds (poll_source) to
+    # catch any other state change and any status that was not pushed. All
+    # the changes found at once are put in the queue as a single list.
 
     # valid Qiita states:
     #             The current status of the job, one of {'queued', 'running',
@@ -60,7 +237,7 @@ class Watcher(Process):
                                  'suspended': 'running',
                                  'DROPPED': 'error'}
 
-    def __init__(self):
+    def __init__(self, poll_source=None, callback_source=None):
         super(Watcher, self).__init__()
 
         # set self.owner to qiita, or whomever owns processes we need to watch.
@@ -72,6 +249,14 @@ class Watcher(Process):
         # before it disappears.
         self.polling_value = qiita_config.trq_poll_val
 
+        # where the status of the jobs comes from; see the comment at the top
+        # of the class
+        self.poll_source = (QstatStatusSource(self.owner)
+                            if poll_source is None else poll_source)
+        self.callback_source = (CallbackStatusSource()
+                                if callback_source is None
+                                else callback_source)
+
         # the cross-process method by which to communicate across
         # process boundaries. Note that when Watcher object runs,
         # another process will get created, and receive a copy of
@@ -85,38 +270,16 @@ class Watcher(Process):
         # the cross-process sentinel value to shutdown Watcher
         self.event = Event()
 
-    def _element_extract(self, snippet, list_of_elements,
-                         list_of_optional_elements):
-        results = {}
-        missing_elements = []
-
-        for element in list_of_elements:
-            value = search('<%s>(.*?)</%s>' % (element, element), snippet)
-            if value:
-                results[element] = value.group(1)
-            else:
-                missing_elements.append(element)
-
-        if missing_elements:
-            raise AssertionError("The following elements were not found: %s"
-                                 % ', '.join(missing_elements))
-
-        for element in list_of_optional_elements:
-            value = search('<%s>(.*?)</%s>' % (element, element), snippet)
-            if value:
-                results[element] = value.group(1)
-
-        return results
-
     def _process_dependent_jobs(self, results):
         # when a job has its status changed, check to see if the job completed
         # with an error. If so, check to see if it had any jobs that were being
         # 'held' on this job's successful completion. If we are maintaining
         # state on any of these jobs, mark them as 'DROPPED', because they will
         # no longer appear in qstat output.
+        dropped = []
         if results['job_state'] == 'completed':
             if results['exit_status'] == '0':
-                return
+                return dropped
 
             if 'depend' in results:
                 tmp = results['depend'].split(':')
@@ -128,61 +291,81 @@ class Watcher(Process):
                         # the work. For now, simply remove the
                         # '@host.domain.org' (server) component.
                         child_job_id = child_job_id.split('@')[0]
-                        self.processes[child_job_id]['job_state'] = 'DROPPED'
-                        self.queue.put(self.processes[child_job_id])
+                        child = self.processes.get(child_job_id)
+                        if child is not None and not self._is_final(child):
+                            child['job_state'] = 'DROPPED'
+                            dropped.append(child)
+        return dropped
+
+    @staticmethod
+    def _is_final(results):
+        # once a job completed (or was dropped) torque can still report it
+        # (e.g. qstat shows 'E' for a job the epilogue already reported as
+        # 'C'), but its status can't change anymore
+        return results['job_state'] in ('completed', 'DROPPED')
+
+    def _update(self, jobs):
+        """Records the status of `jobs` and queues the ones that changed
+
+        Parameters
+        ----------
+        jobs : list of dict
+            The status of the jobs, as returned by the status sources
+        """
+        changes = []
+        for results in jobs:
+            results = dict(results)
+            results['job_state'] = Watcher.job_state_map[results['job_state']]
+            if results['job_state'] != 'completed':
+                results.pop('exit_status', None)
+
+            # determine if anything has changed since last time; the other
+            # elements (e.g. depend) are kept from previous reports as the
+            # epilogue doesn't have them
+            previous = self.processes.get(results['Job_Id'])
+            if previous is not None:
+                if self._is_final(previous):
+                    continue
+                if (previous['job_state'] == results['job_state'] and
+                        previous.get('exit_status') ==
+                        results.get('exit_status')):
+                    continue
+                previous = dict(previous)
+                previous.update(results)
+                results = previous
+
+            self.processes[results['Job_Id']] = results
+            changes.append(results)
+            changes.extend(self._process_dependent_jobs(results))
+
+        if changes:
+            self.queue.put(changes)
 
     def run(self):
         # check to see if qstat is available. If not, exit immediately.
-        proc = Popen("qstat -x", shell=True, stdout=PIPE, stderr=PIPE)
-        proc.wait()
-        if proc.returncode != 0:
+        if not self.poll_source.is_available():
             # inform any process expecting data from Watcher
             self.queue.put('QUIT')
             self.event.set()
 
+        next_poll = 0
         while not self.event.is_set():
-            proc = Popen("qstat -x", shell=True, stdout=PIPE, stderr=PIPE)
-            stdout, stderr = proc.communicate()
-            if proc.returncode == 0:
-                # qstat returned successfully with metadata on processes
-                # break up metadata into individual <Job></Job> elements
-                # for processing.
-                m = findall('<Job>(.*?)</Job>', stdout.decode('ascii'))
-                for item in m:
-                    # filter out jobs that don't belong to owner
-                    if search('<Job_Owner>%s</Job_Owner>' % self.owner, item):
-                        # extract the metadata we want.
-                        # if a job has completed, an exit_status element will
-                        # be present. We also want that.
-                        results = self._element_extract(item, ['Job_Id',
-                                                               'Job_Name',
-                                                               'job_state'],
-                                                              ['depend'])
-                        tmp = Watcher.job_state_map[results['job_state']]
-                        results['job_state'] = tmp
-                        if results['job_state'] == 'completed':
-                            results2 = self._element_extract(item,
-                                                             ['exit_status'],
-                                                             [])
-                            results['exit_status'] = results2['exit_status']
-
-                        # determine if anything has changed since last poll
-                        if results['Job_Id'] in self.processes:
-                            if self.processes[results['Job_Id']] != results:
-                                # metadata for existing job has changed
-                                self.processes[results['Job_Id']] = results
-                                self.queue.put(results)
-                                self._process_dependent_jobs(results)
-                        else:
-                            # metadata for new job inserted
-                            self.processes[results['Job_Id']] = results
-                            self.queue.put(results)
+            if time() >= next_poll:
+                jobs = self.poll_source.poll()
+                if jobs is None:
+                    self.queue.put('QUIT')
+                    self.event.set()
+                    # don't join(), since we are exiting from the main loop
+                    break
+                self._update(jobs)
+                next_poll = time() + self.polling_value
+
+            # in between polls, react to the jobs as soon as they complete
+            remaining = max(next_poll - time(), 0)
+            if self.callback_source is not None:
+                self._update(self.callback_source.wait(remaining))
             else:
-                self.queue.put('QUIT')
-                self.event.set()
-                # don't join(), since we are exiting from the main loop
-
-            sleep(self.polling_value)
+                sleep(remaining)
 
     def stop(self):
         # 'poison pill' to thread/process
@@ -199,6 +382,67 @@ class Watcher(Process):
         self.join()
 
 
+def update_jobs_from_watcher(changes):
+    """Updates the jobs in the database with the changes found by Watcher
+
+    Parameters
+    ----------
+    changes : list of dict
+        The jobs whose status changed, as put in the Watcher queue
+
+    Notes
+    -----
+    All the jobs that started running are updated in a single statement,
+    while the jobs that finished are completed one by one, as completing a
+    job also creates its outputs. Only the jobs that are still queued or
+    running in Qiita are updated, and a failure updating a job is logged so
+    it doesn't prevent the rest of the jobs from being updated
+    """
+    external_ids = [c['Job_Id'] for c in changes]
+    if not external_ids:
+        return
+
+    # ignore any job owned by Qiita, but can't be mapped to a ProcessJob,
+    # and any job that already finished in Qiita
+    job_ids = ProcessingJob.by_ext_ids(
+        external_ids, status=('queued', 'running'))
+    changes = [c for c in changes if c['Job_Id'] in job_ids]
+
+    running = [job_ids[c['Job_Id']] for c in changes
+               if Watcher.torque_to_qiita_state_map.get(
+                   c['job_state']) == 'running']
+    try:
+        ProcessingJob._set_running(running)
+    except Exception as e:
+        qdb.logger.LogEntry.create(
+            'Runtime', 'Error setting the jobs as running: %s' % str(e),
+            info={'job_ids': running})
+
+    for change in changes:
+        job_state = change['job_state']
+        # currently, we only complete jobs when they have finished, either
+        # successfully or unsuccessfully.
+        if job_state not in ('completed', 'DROPPED'):
+            continue
+
+        job_id = job_ids[change['Job_Id']]
+        try:
+            if job_state == 'completed':
+                # all completed jobs should have an exit_status
+                success = int(change['exit_status']) == 0
+            else:
+                # Assume job is validator job that was DROPPED.
+                # Assume DROPPED job does not have an exit_status.
+                success = False
+            ProcessingJob(job_id).complete(
+                success, error=change.get('error_msg'))
+        except Exception as e:
+            qdb.logger.LogEntry.create(
+                'Runtime', 'Error completing job %s from %s: %s' % (
+                    job_id, change['Job_Id'], str(e)),
+                info={'job_id': job_id, 'job_state': job_state})
+
+
 def launch_local(env_script, start_script, url, job_id, job_dir):
 
     # launch_local() differs from launch_torque(), as no Watcher() is used.
@@ -432,6 +676,68 @@ class ProcessingJob(qdb.base.QiitaObject):
             qdb.sql_connection.TRN.add(sql, [external_id])
             return qdb.sql_connection.TRN.execute_fetchlast()
 
+    @classmethod
+    def by_ext_ids(cls, external_ids, status=None):
+        """Return the Qiita Job UUIDs associated with the external_ids
+
+        Parameters
+        ----------
+        external_ids : list of str
+            The external ids (e.g. Torque Job IDs)
+        status : iterable of str, optional
+            If provided, only return the jobs in one of these status
+
+        Returns
+        -------
+        dict of {str: str}
+            The Qiita Job UUID keyed by external id, for the external ids
+            found
+        """
+        if not external_ids:
+            return {}
+        with qdb.sql_connection.TRN:
+            sql = """SELECT external_job_id, processing_job_id
+                     FROM qiita.processing_job
+                        JOIN qiita.processing_job_status
+                            USING (processing_job_status_id)
+                     WHERE external_job_id IN %s"""
+            args = [tuple(set(external_ids))]
+            if status is not None:
+                sql += " AND processing_job_status IN %s"
+                args.append(tuple(status))
+            qdb.sql_connection.TRN.add(sql, args)
+            return dict(qdb.sql_connection.TRN.execute_fetchindex())
+
+    @classmethod
+    def _set_running(cls, job_ids):
+        """Sets the status of the given queued jobs to 'running'
+
+        Parameters
+        ----------
+        job_ids : list of str
+            The ids of the jobs
+
+        Notes
+        -----
+        Only the jobs that are 'queued' are updated; the status of any other
+        job is left as is, as a job can't go back to 'running'
+        """
+        if not job_ids:
+            return
+        with qdb.sql_connection.TRN:
+            sql = """UPDATE qiita.processing_job
+                     SET processing_job_status_id = (
+                        SELECT processing_job_status_id
+                        FROM qiita.processing_job_status
+                        WHERE processing_job_status = 'running')
+                     WHERE processing_job_id IN %s
+                        AND processing_job_status_id = (
+                            SELECT processing_job_status_id
+                            FROM qiita.processing_job_status
+                            WHERE processing_job_status = 'queued')"""
+            qdb.sql_connection.TRN.add(sql, [tuple(set(job_ids))])
+            qdb.sql_connection.TRN.execute()
+
     def get_resource_allocation_info(self):
         """Return resource allocation defined for this job. For
         external computational resources only.
@@ -926,7 +1232,8 @@ class ProcessingJob(qdb.base.QiitaObject):
             a = qdb.artifact.Artifact.create(
                 filepaths, atype, parents=parents,
                 processing_parameters=params,
-                analysis=analysis, data_type=data_type, name=name)
+                analysis=analysis, data_type=data_type, name=name,
+                checksums=a_info.get('checksums'))
 
             self._set_status('success')
 
@@ -937,7 +1244,16 @@ class ProcessingJob(qdb.base.QiitaObject):
             return mapping
 
     def release_validators(self):
-        """Allows all the validator job spawned by this job to complete"""
+        """Allows all the validator job spawned by this job to complete
+
+        Notes
+        -----
+        The validators can run for hours, so no transaction should be open
+        when calling this method: the wait is done outside of a transaction,
+        so each update of the step of the job is committed as it happens, and
+        the validators are released (or failed) in a new transaction once
+        they are completed
+        """
         with qdb.sql_connection.TRN:
             if self.command.software.type not in ('artifact transformation',
                                                   'private'):
@@ -945,42 +1261,28 @@ class ProcessingJob(qdb.base.QiitaObject):
                     "Only artifact transformation and private jobs can "
                     "release validators")
 
-            # Check if all the validators are completed. Validator jobs can be
-            # in two states when completed: 'waiting' in case of success
-            # or 'error' otherwise
-
-            validator_ids = [j.id for j in self.validator_jobs
-                             if j.status not in ['waiting', 'error']]
-
-            # Active polling - wait until all validator jobs are completed
-            # TODO: As soon as we see one errored validator, we should kill
-            # the other jobs and exit early. Don't wait for all of the jobs
-            # to complete.
-            while validator_ids:
-                jids = ', '.join([j[0] for j in validator_ids])
-                self.step = ("Validating outputs (%d remaining) via "
-                             "job(s) %s" % (len(validator_ids), jids))
-                sleep(10)
-                validator_ids = [j.id for j in self.validator_jobs
-                                 if j.status not in ['waiting', 'error']]
+        statuses = self.wait_for_validators()
 
+        with qdb.sql_connection.TRN:
             # Check if any of the validators errored
-            errored = [j for j in self.validator_jobs
-                       if j.status == 'error']
+            errored = [ProcessingJob(j) for j, status in viewitems(statuses)
+                       if status == 'error']
             if errored:
-                # At least one of the validators failed, Set the rest of the
-                # validators and the current job as failed
-                waiting = [j.id for j in self.validator_jobs
-                           if j.status == 'waiting']
-
+                # At least one of the validators failed, Set the validators
+                # that are not running and the current job as failed. The
+                # validators that are still running keep their scheduler
+                # slot until they end, so they are left to complete (or to
+                # be failed by Watcher); as this job has failed, nothing
+                # will release them
                 common_error = "\n".join(
                     ["Validator %s error message: %s" % (j.id, j.log.msg)
                      for j in errored])
 
                 val_error = "%d sister validator jobs failed: %s" % (
                     len(errored), common_error)
-                for j in waiting:
-                    ProcessingJob(j)._set_error(val_error)
+                for j, status in viewitems(statuses):
+                    if status in ('queued', 'waiting'):
+                        ProcessingJob(j)._set_error(val_error)
 
                 self._set_error('%d validator jobs failed: %s'
                                 % (len(errored), common_error))
@@ -1006,6 +1308,92 @@ class ProcessingJob(qdb.base.QiitaObject):
                     self._update_and_launch_children(mapping)
                 self._set_status('success')
 
+    def _get_validator_statuses(self):
+        """Returns the status of the validators of this job
+
+        Returns
+        -------
+        dict of {str: str}
+            The status of each validator, keyed by validator id
+        """
+        with qdb.sql_connection.TRN:
+            sql = """SELECT validator_id, processing_job_status
+                     FROM qiita.processing_job_validator pjv
+                     JOIN qiita.processing_job pj
+                         ON pjv.validator_id = pj.processing_job_id
+                     JOIN qiita.processing_job_status USING (
+                        processing_job_status_id)
+                     WHERE pjv.processing_job_id = %s"""
+            qdb.sql_connection.TRN.add(sql, [self.id])
+            return dict(qdb.sql_connection.TRN.execute_fetchindex())
+
+    def wait_for_validators(self, timeout=None):
+        """Waits until all the validators of this job are completed
+
+        Validator jobs can be in two states when completed: 'waiting' in case
+        of success or 'error' otherwise. The wait ends as soon as one of the
+        validators fails, as the job can't succeed anymore.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum number of seconds to wait. Defaults to None, which
+            waits until the validators are completed
+
+        Returns
+        -------
+        dict of {str: str}
+            The status of each validator, keyed by validator id. If the
+            timeout expired, some of them may not be completed
+
+        Notes
+        -----
+        The changes in the status of the validators are received through the
+        notifications sent to JOB_STATUS_CHANNEL. The status of all the
+        validators is also read again every VALIDATOR_CHECK_INTERVAL seconds,
+        in case any notification is lost (e.g. the connection was reset)
+        """
+        def finished(statuses):
+            return ('error' in statuses.values() or
+                    all(s == 'waiting' for s in statuses.values()))
+
+        statuses = self._get_validator_statuses()
+        if finished(statuses):
+            return statuses
+
+        deadline = None if timeout is None else time() + timeout
+        with qdb.sql_connection.Listener([JOB_STATUS_CHANNEL]) as listener:
+            # Any validator that finished before the listener started
+            statuses = self._get_validator_statuses()
+            next_check = time() + VALIDATOR_CHECK_INTERVAL
+            reported = None
+            while not finished(statuses):
+                pending = sorted(j for j, s in viewitems(statuses)
+                                 if s != 'waiting')
+                if pending != reported:
+                    self.step = ("Validating outputs (%d remaining) via "
+                                 "job(s) %s" % (len(pending),
+                                                ', '.join(pending)))
+                    reported = pending
+
+                now = time()
+                if deadline is not None and now >= deadline:
+                    break
+                wait = next_check - now
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+
+                for _, payload in listener.wait(max(wait, 0)):
+                    change = loads(payload)
+                    if change['job_id'] in statuses:
+                        statuses[change['job_id']] = change['status']
+
+                if time() >= next_check:
+                    statuses = self._get_validator_statuses()
+                    next_check = time() + VALIDATOR_CHECK_INTERVAL
+
+        return statuses
+
     def _complete_artifact_definition(self, artifact_data):
         """"Performs the needed steps to complete an artifact definition job
 
@@ -1019,7 +1407,8 @@ class ProcessingJob(qdb.base.QiitaObject):
         artifact_data : {'filepaths': list of (str, str), 'artifact_type': str}
             Dict with the artifact information. `filepaths` contains the list
             of filepaths and filepath types for the artifact and
-            `artifact_type` the type of the artifact
+            `artifact_type` the type of the artifact. It can also contain
+            `checksums`, the checksum of each filepath computed by the plugin
         """
         with qdb.sql_connection.TRN:
             atype = artifact_data['artifact_type']
@@ -1063,7 +1452,8 @@ class ProcessingJob(qdb.base.QiitaObject):
 
                 qdb.artifact.Artifact.create(
                     filepaths, atype, prep_template=pt, analysis=an,
-                    data_type=data_type, name=job_params['name'])
+                    data_type=data_type, name=job_params['name'],
+                    checksums=artifact_data.get('checksums'))
                 self._set_status('success')
 
     def _complete_artifact_transformation(self, artifacts_data):
@@ -193,6 +193,32 @@ class Command(qdb.base.QiitaObject):
             qdb.sql_connection.TRN.add(sql, [id_])
             return qdb.sql_connection.TRN.execute_fetchlast()
 
+    @classmethod
+    def _check_many(cls, ids):
+        """Checks the existence of several ids in a single query
+
+        Parameters
+        ----------
+        ids : list of int
+            The IDs to test
+
+        Returns
+        -------
+        dict of {int: bool}
+            The IDs present in the database, mapped to True
+
+        Notes
+        -----
+        This function overwrites the base function, as the sql layout doesn't
+        follow the same conventions done in the other classes.
+        """
+        with qdb.sql_connection.TRN:
+            sql = """SELECT command_id, TRUE
+                     FROM qiita.software_command
+                     WHERE command_id IN %s"""
+            qdb.sql_connection.TRN.add(sql, [tuple(ids)])
+            return dict(qdb.sql_connection.TRN.execute_fetchindex())
+
     @classmethod
     def exists(cls, software, name):
         """Checks if the command already exists in the system
@@ -8,8 +8,12 @@ This modules provides wrappers for the psycopg2 module to allow easy use of
 transaction blocks and SQL execution/data retrieval.
 
 This module provides the variable TRN, which is the transaction available
-to use in the system. The singleton pattern is applied and this works as long
-as the system remains single-threaded.
+to use in the system. TRN is a proxy that hands each thread its own
+Transaction object, so concurrent threads (e.g. the webserver and a thread
+pool executor) never share queries, results or connections. All the
+Transaction objects of a process draw their connections from a bounded
+ConnectionPool, which checks the health of idle connections before handing
+them out and transparently reconnects when postgres drops them.
 
 Classes
 -------
@@ -17,7 +21,10 @@ Classes
 .. autosummary::
    :toctree: generated/
 
+   ConnectionPool
+   Listener
    Transaction
+   TransactionProxy
 """
 # -----------------------------------------------------------------------------
 # Copyright (c) 2014--, The Qiita Development Team.
@@ -28,17 +35,113 @@ Classes
 # -----------------------------------------------------------------------------
 from __future__ import division
 from contextlib import contextmanager
-from itertools import chain
+from itertools import chain, groupby
 from functools import wraps
+from operator import itemgetter
+from os import getpid
+import re
+from select import select
+from threading import Condition, local
+from weakref import finalize
+from time import time
+from uuid import uuid4
 
 from psycopg2 import (connect, ProgrammingError, Error as PostgresError,
-                      OperationalError, errorcodes)
-from psycopg2.extras import DictCursor
+                      OperationalError, InterfaceError, errorcodes)
+from psycopg2.extras import DictCursor, execute_values
 from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
 from qiita_core.qiita_settings import qiita_config
 
 
+# Statements that never return rows, so they can be sent to the server
+# together with the ones next to them
+_NO_RESULTS_RE = re.compile(r'^\s*(INSERT|UPDATE|DELETE)\s', re.I)
+# Single row INSERT statements, which can be merged in a multi-row INSERT
+_INSERT_VALUES_RE = re.compile(
+    r'^(\s*INSERT\s+INTO\s.+?\sVALUES\s*)(\(.*\))'
+    r'(\s+RETURNING\s[^()]+?)?\s*;?\s*$', re.I | re.S)
+
+
+def _split_insert_values(sql):
+    """Splits a single row INSERT statement to be used with `execute_values`
+
+    Parameters
+    ----------
+    sql : str
+        The sql query
+
+    Returns
+    -------
+    (str, str, bool) or None
+        The query with the row replaced by a single placeholder, the row
+        template and whether the query has a RETURNING clause. None if the
+        query is not a single row INSERT
+    """
+    match = _INSERT_VALUES_RE.match(sql)
+    if match is None:
+        return None
+    prefix, row, returning = match.groups()
+    # the row should be a single parenthesized group, i.e. not "(%s), (%s)"
+    depth = 0
+    for i, c in enumerate(row):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0 and i != len(row) - 1:
+                return None
+    return prefix + '%s' + (returning or ''), row, returning is not None
+
+
+# Characters that must be escaped in the text format of COPY
+_COPY_ESCAPES = {ord('\\'): '\\\\', ord('\t'): '\\t', ord('\n'): '\\n',
+                 ord('\r'): '\\r'}
+
+
+class _CopyReader(object):
+    """File-like object that encodes rows in the text format of COPY
+
+    Parameters
+    ----------
+    rows : iterable of iterables
+        The rows to encode. None values are encoded as NULL and any other
+        value is encoded as its str representation
+
+    Notes
+    -----
+    The rows are encoded as they are read, so the iterable is consumed
+    lazily and the data is never held in memory all at once
+    """
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+        self.rows_read = 0
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return '\\N'
+        return str(value).translate(_COPY_ESCAPES)
+
+    def read(self, size=-1):
+        lines = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = '\t'.join(self._encode(v) for v in row) + '\n'
+            lines.append(line)
+            length += len(line)
+            self.rows_read += 1
+        data = ''.join(lines)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
 def _checker(func):
     """Decorator to check that methods are executed inside the context"""
     @wraps(func)
@@ -51,50 +154,74 @@ def _checker(func):
     return wrapper
 
 
-class Transaction(object):
-    """A context manager that encapsulates a DB transaction
-
-    A transaction is defined by a series of consecutive queries that need to
-    be applied to the database as a single block.
-
-    Raises
-    ------
-    RuntimeError
-        If the transaction methods are invoked outside a context.
+class ConnectionPool(object):
+    """A bounded, thread-safe pool of postgres connections
+
+    Parameters
+    ----------
+    maxconn : int
+        The maximum number of connections that can be open at the same time
+    admin : bool, optional
+        Whether the connections are opened with the administrator user.
+        Defaults to False
+    timeout : float, optional
+        The number of seconds to wait for a connection to be released when the
+        pool is exhausted. Defaults to 30
+    check_after : float, optional
+        Idle connections that have not been used in the last `check_after`
+        seconds are checked with a trivial query before being handed out.
+        Defaults to 60
 
     Notes
     -----
-    When the execution leaves the context manager, any remaining queries in
-    the transaction will be executed and committed.
+    The pool is bound to the process that created it. If the process forks,
+    the child process starts with an empty pool, as the connections inherited
+    from the parent can't be shared.
     """
-    def __init__(self, admin=False):
-        self._queries = []
-        self._results = []
-        self._contexts_entered = 0
-        self._connection = None
-        self._post_commit_funcs = []
-        self._post_rollback_funcs = []
+    def __init__(self, maxconn, admin=False, timeout=30, check_after=60):
+        if maxconn < 1:
+            raise ValueError("maxconn should be a positive number. Found %s"
+                             % maxconn)
+        self.maxconn = maxconn
         self.admin = admin
+        self.timeout = timeout
+        self.check_after = check_after
+        self._reset()
 
-    def _open_connection(self):
-        # If the connection already exists and is not closed, don't do anything
-        if self._connection is not None and self._connection.closed == 0:
-            return
+    def _reset(self):
+        # The connections inherited from another process are simply forgotten;
+        # closing them here would close the connections of the parent process
+        self._pid = getpid()
+        self._cond = Condition()
+        self._idle = []
+        self._in_use = 0
+
+    def _connect(self):
+        """Opens a new postgres connection
 
+        Returns
+        -------
+        psycopg2.connection
+            The new connection
+
+        Raises
+        ------
+        RuntimeError
+            If the connection can't be established
+        """
         try:
             if self.admin:
-                self._connection = connect(
-                    user=qiita_config.admin_user,
-                    password=qiita_config.admin_password,
-                    host=qiita_config.host,
-                    port=qiita_config.port)
-                self._connection.autocommit = True
+                conn = connect(user=qiita_config.admin_user,
+                               password=qiita_config.admin_password,
+                               host=qiita_config.host,
+                               port=qiita_config.port)
+                conn.autocommit = True
             else:
-                self._connection = connect(user=qiita_config.user,
-                                           password=qiita_config.password,
-                                           database=qiita_config.database,
-                                           host=qiita_config.host,
-                                           port=qiita_config.port)
+                conn = connect(user=qiita_config.user,
+                               password=qiita_config.password,
+                               database=qiita_config.database,
+                               host=qiita_config.host,
+                               port=qiita_config.port)
         except OperationalError as e:
             # catch three known common exceptions and raise runtime errors
             try:
@@ -122,10 +249,338 @@ class Transaction(object):
                      '\n\n\t%s\n%s For more information, review `INSTALL.md`'
                      ' in the Qiita installation base directory.')
             raise RuntimeError(ebase % (str(e), etext))
+        return conn
+
+    def is_healthy(self, conn, last_used):
+        """Checks if an idle connection can still be used
+
+        Parameters
+        ----------
+        conn : psycopg2.connection
+            The connection to check
+        last_used : float
+            The time (in seconds since the epoch) the connection was last used
+
+        Returns
+        -------
+        bool
+            Whether the connection can be used
+        """
+        if conn.closed != 0:
+            return False
+        if time() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            if not conn.autocommit:
+                conn.rollback()
+        except (OperationalError, InterfaceError):
+            return False
+        return True
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except PostgresError:
+            pass
+
+    def getconn(self):
+        """Retrieves a healthy connection from the pool
+
+        Returns
+        -------
+        psycopg2.connection
+            The connection
+
+        Raises
+        ------
+        RuntimeError
+            If the pool is exhausted and no connection is released before
+            the timeout expires, or if a new connection can't be established
+        """
+        if self._pid != getpid():
+            self._reset()
+
+        deadline = time() + self.timeout
+        with self._cond:
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise RuntimeError(
+                        "Connection pool exhausted: %d connections in use"
+                        % self._in_use)
+                self._cond.wait(remaining)
+            conn, last_used = self._idle.pop() if self._idle else (None, None)
+            self._in_use += 1
+
+        try:
+            if conn is not None and not self.is_healthy(conn, last_used):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Returns a connection to the pool
+
+        Parameters
+        ----------
+        conn : psycopg2.connection
+            The connection to return, as retrieved by `getconn`
+        close : bool, optional
+            Whether the connection should be closed instead of kept for reuse.
+            Defaults to False
+        """
+        if self._pid != getpid():
+            # The connection was handed out in a different process
+            return
+
+        if not close and conn.closed == 0:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except PostgresError:
+                close = True
+        else:
+            close = True
+
+        if close:
+            self._discard(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if not close:
+                self._idle.append((conn, time()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Closes all the idle connections of the pool"""
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    @property
+    def size(self):
+        """The number of connections currently open by the pool"""
+        return self._in_use + len(self._idle)
+
+
+_POOLS = {}
+
+
+def get_pool(admin=False):
+    """Returns the connection pool of the current process
+
+    Parameters
+    ----------
+    admin : bool, optional
+        Whether to return the pool of administrator connections.
+        Defaults to False
+
+    Returns
+    -------
+    ConnectionPool
+        The connection pool
+    """
+    if admin not in _POOLS:
+        _POOLS[admin] = ConnectionPool(qiita_config.max_connections,
+                                       admin=admin)
+    return _POOLS[admin]
+
+
+class Listener(object):
+    """A context manager that receives the notifications sent to channels
+
+    Parameters
+    ----------
+    channels : list of str
+        The channels to listen to
+    pool : ConnectionPool, optional
+        The pool where the connection is retrieved from. Defaults to the pool
+        of the current process
+
+    Notes
+    -----
+    The connection is taken from the pool for the whole life of the listener
+    and it is used in autocommit mode, as postgres only delivers the
+    notifications to sessions that are outside a transaction. The listener
+    starts receiving notifications as soon as it is entered, so any change
+    that is checked after entering it can't be missed.
+    """
+    def __init__(self, channels, pool=None):
+        self.channels = channels
+        self._pool = pool if pool is not None else get_pool()
+        self._conn = None
+
+    def __enter__(self):
+        self._conn = self._pool.getconn()
+        try:
+            self._conn.autocommit = True
+            with self._conn.cursor() as cur:
+                for channel in self.channels:
+                    cur.execute('LISTEN "%s"' % channel)
+        except PostgresError:
+            self._pool.putconn(self._conn, close=True)
+            self._conn = None
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        conn = self._conn
+        self._conn = None
+        close = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute('UNLISTEN *')
+            conn.autocommit = False
+        except PostgresError:
+            close = True
+        self._pool.putconn(conn, close=close)
+
+    def wait(self, timeout=None):
+        """Waits for notifications
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum number of seconds to wait. Defaults to None, which
+            waits until a notification is received
+
+        Returns
+        -------
+        list of (str, str)
+            The channel and the payload of each notification received, in the
+            order they were sent; empty if the timeout expired
+        """
+        conn = self._conn
+        conn.poll()
+        if not conn.notifies:
+            ready, _, _ = select([conn], [], [], timeout)
+            if ready:
+                conn.poll()
+        notifies = [(n.channel, n.payload) for n in conn.notifies]
+        del conn.notifies[:]
+        return notifies
+
+
+class Transaction(object):
+    """A context manager that encapsulates a DB transaction
+
+    A transaction is defined by a series of consecutive queries that need to
+    be applied to the database as a single block.
+
+    Raises
+    ------
+    RuntimeError
+        If the transaction methods are invoked outside a context.
+
+    Parameters
+    ----------
+    admin : bool, optional
+        Whether the transaction uses an administrator connection.
+        Defaults to False
+    pool : ConnectionPool, optional
+        The pool from which the connection is retrieved. Defaults to the pool
+        of the current process
+    page_size : int, optional
+        The maximum number of statements sent to the server in a single round
+        trip. Defaults to the BATCH_PAGE_SIZE configuration value
+
+    Notes
+    -----
+    When the execution leaves the context manager, any remaining queries in
+    the transaction will be executed and committed, and the connection is
+    returned to the pool. Thus, a connection is only held while the
+    transaction is in use.
+
+    Consecutive INSERT, UPDATE and DELETE queries that do not return any
+    value are sent to the server together, and consecutive executions of the
+    same single row INSERT (e.g. the ones added with `many=True`) are merged
+    in multi-row INSERTs, so they need one round trip per `page_size`
+    statements instead of one round trip per statement.
+    """
+    def __init__(self, admin=False, pool=None, page_size=None):
+        self._queries = []
+        self._results = []
+        self._contexts_entered = 0
+        # The connection is kept in a list, so it can be returned to the pool
+        # by a finalizer without holding a reference to the transaction
+        self._connection_slot = [None]
+        self._post_commit_funcs = []
+        self._post_rollback_funcs = []
+        self.admin = admin
+        self._pool = pool if pool is not None else get_pool(admin)
+        self.page_size = (page_size if page_size is not None
+                          else qiita_config.batch_page_size)
+        # Counters of the statements executed and the round trips to the
+        # server needed to execute them
+        self.statements_executed = 0
+        self.round_trips = 0
+        # Maps (table, id) of the QiitaObjects already checked in this
+        # transaction to the set of portals in which they are accessible
+        self.identity_map = {}
+
+    @property
+    def _connection(self):
+        return self._connection_slot[0]
+
+    @_connection.setter
+    def _connection(self, value):
+        self._connection_slot[0] = value
+
+    @staticmethod
+    def _return_connection(pool, connection_slot):
+        """Closes the connection in `connection_slot`, giving back its slot
+        in `pool`. Used to finalize the transactions that are garbage
+        collected while holding a connection (e.g. the transaction of a
+        thread that died in the middle of a transaction)"""
+        if connection_slot[0] is not None:
+            pool.putconn(connection_slot[0], close=True)
+            connection_slot[0] = None
+
+    def _open_connection(self):
+        # If the connection already exists and is not closed, don't do anything
+        if self._connection is not None and self._connection.closed == 0:
+            return
+
+        if self._connection is not None:
+            # The connection was closed under our feet (e.g. postgres was
+            # restarted): give back its slot in the pool
+            self._pool.putconn(self._connection, close=True)
+            self._connection = None
+
+        self._connection = self._pool.getconn()
 
     def close(self):
+        """Closes the connection used by the transaction"""
         if self._connection is not None:
-            self._connection.close()
+            self._pool.putconn(self._connection, close=True)
+            self._connection = None
+
+    def release(self):
+        """Returns the connection used by the transaction to the pool
+
+        Raises
+        ------
+        RuntimeError
+            If invoked inside a context
+        """
+        if self._contexts_entered != 0:
+            raise RuntimeError("Can't release the connection of a transaction "
+                               "that is still in use")
+        if self._connection is not None:
+            self._pool.putconn(self._connection)
+            self._connection = None
 
     @contextmanager
     def _get_cursor(self):
@@ -150,6 +605,7 @@ class Transaction(object):
             raise RuntimeError("Cannot get postgres cursor: %s" % e)
 
     def __enter__(self):
+        # the pool only hands out healthy connections
         self._open_connection()
         self._contexts_entered += 1
         return self
@@ -181,6 +637,10 @@ class Transaction(object):
                 self._clean_up(exc_type)
             finally:
                 self._contexts_entered -= 1
+                self.identity_map = {}
+                # give the connection back, so the threads that are not
+                # using the database don't hold any connection
+                self.release()
         else:
             self._contexts_entered -= 1
 
@@ -241,6 +701,67 @@ class Transaction(object):
                                     " Found %s" % type(args))
             self._queries.append((sql, args))
 
+    @staticmethod
+    def _is_batchable(sql, sql_args):
+        """Checks if the query can be sent to the server with other queries"""
+        split = _split_insert_values(sql)
+        if split is not None:
+            return sql_args is not None or not split[2]
+        return (_NO_RESULTS_RE.match(sql) is not None and
+                'RETURNING' not in sql.upper())
+
+    def _execute_batch(self, cur, queries):
+        """Executes consecutive batchable queries in as few round trips as
+        possible
+
+        Parameters
+        ----------
+        cur : psycopg2.cursor
+            The cursor used to execute the queries
+        queries : list of (str, list, tuple or dict)
+            The queries to execute and their arguments
+        """
+        statements = []
+
+        def flush():
+            for i in range(0, len(statements), self.page_size):
+                page = statements[i:i + self.page_size]
+                try:
+                    cur.execute(b';\n'.join(page))
+                except Exception as e:
+                    self._raise_execution_error(page, None, e)
+                self.round_trips += 1
+            del statements[:]
+
+        for sql, group in groupby(queries, key=itemgetter(0)):
+            args_list = [args for _, args in group]
+            self.statements_executed += len(args_list)
+            split = _split_insert_values(sql)
+            if split is not None and None not in args_list and \
+                    (len(args_list) > 1 or split[2]):
+                flush()
+                values_sql, template, returning = split
+                try:
+                    res = execute_values(
+                        cur, values_sql, args_list, template=template,
+                        page_size=self.page_size, fetch=returning)
+                except Exception as e:
+                    self._raise_execution_error(values_sql, args_list, e)
+                self.round_trips += -(-len(args_list) // self.page_size)
+                if returning:
+                    # each single row INSERT returns its own row
+                    self._results.extend([row] for row in res)
+                else:
+                    self._results.extend([None] * len(args_list))
+            else:
+                for args in args_list:
+                    try:
+                        statements.append(cur.mogrify(sql, args))
+                    except Exception as e:
+                        self._raise_execution_error(sql, args, e)
+                self._results.extend([None] * len(args_list))
+        flush()
+
     def _execute(self):
         """Internal function that actually executes the transaction
         The `execute` function exposed in the API wraps this one to make sure
@@ -248,8 +769,19 @@ class Transaction(object):
         transaction
         """
         with self._get_cursor() as cur:
+            batch = []
             for sql, sql_args in self._queries:
+                if self._is_batchable(sql, sql_args):
+                    batch.append((sql, sql_args))
+                    continue
+                # Execute the queries accumulated so far, before the current
+                # one, as the current one may depend on them
+                self._execute_batch(cur, batch)
+                batch = []
+
                 # Execute the current SQL command
+                self.statements_executed += 1
+                self.round_trips += 1
                 try:
                     cur.execute(sql, sql_args)
                 except Exception as e:
@@ -275,6 +807,8 @@ class Transaction(object):
                 # Store the results of the current query
                 self._results.append(res)
 
+            self._execute_batch(cur, batch)
+
         # wipe out the already executed queries
         self._queries = []
 
@@ -306,6 +840,7 @@ class Transaction(object):
         execute_fetchlast
         execute_fetchindex
         execute_fetchflatten
+        execute_stream
         """
         try:
             return self._execute()
@@ -386,6 +921,124 @@ class Transaction(object):
         """
         return list(chain.from_iterable(self.execute()[idx]))
 
+    @_checker
+    def execute_stream(self, chunk_size=1000):
+        """Executes the transaction and streams the results of the last query
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            The number of rows retrieved from the server at once. Defaults to
+            1000
+
+        Returns
+        -------
+        generator of list of DictRow
+            The rows of the last query, in batches of at most `chunk_size`
+
+        Raises
+        ------
+        ValueError
+            If there are no queries to execute
+        RuntimeError
+            If invoked outside a context
+
+        Notes
+        -----
+        All the queries except the last one are executed right away, as in
+        `execute`. The last query is executed through a server-side cursor,
+        so its results are never held in memory all at once. Its result is not
+        stored in the transaction, and the generator should be consumed before
+        leaving the context manager.
+
+        See Also
+        --------
+        execute
+        execute_fetchindex
+        """
+        if not self._queries:
+            raise ValueError("There are no queries to stream")
+        sql, sql_args = self._queries.pop()
+        self.execute()
+        # the streamed query still counts for the index of the transaction
+        self._results.append(None)
+        return self._stream(sql, sql_args, chunk_size)
+
+    def _stream(self, sql, sql_args, chunk_size):
+        """Generator backing `execute_stream`"""
+        try:
+            cur = self._connection.cursor(
+                name='qiita_%s' % uuid4().hex, cursor_factory=DictCursor)
+            cur.execute(sql, sql_args)
+        except Exception as e:
+            self._raise_execution_error(sql, sql_args, e)
+        self.statements_executed += 1
+
+        try:
+            while True:
+                try:
+                    rows = cur.fetchmany(chunk_size)
+                except Exception as e:
+                    self._raise_execution_error(sql, sql_args, e)
+                self.round_trips += 1
+                if not rows:
+                    break
+                yield rows
+        finally:
+            try:
+                cur.close()
+            except PostgresError:
+                # the transaction has been already rolled back
+                pass
+
+    @_checker
+    def copy_from(self, table, columns, rows):
+        """Executes the transaction and bulk loads `rows` into `table`
+
+        Parameters
+        ----------
+        table : str
+            The table to load the rows into, including its schema
+        columns : list of str
+            The columns of the table that the values of the rows go to
+        rows : iterable of iterables
+            The rows to load, one value per column. None values are loaded as
+            NULL and any other value as its str representation
+
+        Returns
+        -------
+        int
+            The number of rows loaded
+
+        Raises
+        ------
+        RuntimeError
+            If invoked outside a context
+
+        Notes
+        -----
+        All the queued queries are executed right away, as in `execute`, and
+        then the rows are sent to the server with COPY FROM STDIN. The rows
+        are encoded as they are sent, so `rows` can be a generator and it
+        is never held in memory all at once. As with any other query, if the
+        COPY fails the whole transaction is rolled back.
+
+        See Also
+        --------
+        execute
+        """
+        self.execute()
+        sql = "COPY {0} ({1}) FROM STDIN".format(table, ', '.join(columns))
+        reader = _CopyReader(rows)
+        try:
+            with self._connection.cursor() as cur:
+                cur.copy_expert(sql, reader)
+        except Exception as e:
+            self._raise_execution_error(sql, None, e)
+        self.statements_executed += 1
+        self.round_trips += 1
+        return reader.rows_read
+
     def _funcs_executor(self, funcs, func_str):
         error_msg = []
         for f, args, kwargs in funcs:
@@ -411,9 +1064,10 @@ class Transaction(object):
         RuntimeError
             If invoked outside a context
         """
-        # Reset the queries, the results and the index
+        # Reset the queries, the results, the index and the identity map
         self._queries = []
         self._results = []
+        self.identity_map = {}
         try:
             self._connection.commit()
         except Exception:
@@ -431,9 +1085,10 @@ class Transaction(object):
         RuntimeError
             If invoked outside a context
         """
-        # Reset the queries, the results and the index
+        # Reset the queries, the results, the index and the identity map
         self._queries = []
         self._results = []
+        self.identity_map = {}
 
         if self._connection is not None and self._connection.closed == 0:
             try:
@@ -448,6 +1103,11 @@ class Transaction(object):
     def index(self):
         return len(self._queries) + len(self._results)
 
+    @property
+    def round_trips_saved(self):
+        """The number of round trips to the server saved by batching"""
+        return self.statements_executed - self.round_trips
+
     @_checker
     def add_post_commit_func(self, func, *args, **kwargs):
         """Adds a post commit function
@@ -489,15 +1149,75 @@ class Transaction(object):
         self._post_rollback_funcs.append((func, args, kwargs))
 
 
-# Singleton pattern, create the transaction for the entire system
-TRN = Transaction()
-TRNADMIN = Transaction(admin=True)
+class TransactionProxy(object):
+    """Gives each thread its own Transaction behind a single global name
+
+    Parameters
+    ----------
+    admin : bool, optional
+        Whether the transactions use administrator connections.
+        Defaults to False
+
+    Notes
+    -----
+    Every attribute access is forwarded to the Transaction of the calling
+    thread, which is created the first time that thread uses the proxy. Hence,
+    `with TRN:` blocks running in different threads are fully independent.
+    """
+    def __init__(self, admin=False):
+        object.__setattr__(self, '_admin', admin)
+        object.__setattr__(self, '_local', local())
+
+    @property
+    def transaction(self):
+        """The Transaction object of the calling thread"""
+        try:
+            return self._local.transaction
+        except AttributeError:
+            return self._new_transaction()
+
+    def _new_transaction(self):
+        """Creates the Transaction object of the calling thread"""
+        trn = Transaction(admin=self._admin)
+        # the Transaction is dropped when the thread ends, so make sure that
+        # its connection, if any, goes back to the pool
+        finalize(trn, Transaction._return_connection, trn._pool,
+                 trn._connection_slot)
+        self._local.transaction = trn
+        return trn
+
+    def reset(self):
+        """Replaces the Transaction object of the calling thread"""
+        old = getattr(self._local, 'transaction', None)
+        if old is not None:
+            # the old transaction is not going to be used anymore. Note that
+            # the pool ignores the connections of a parent process, which is
+            # the case when this is called right after forking
+            old.close()
+        self._new_transaction()
+
+    def __getattr__(self, name):
+        return getattr(self.transaction, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.transaction, name, value)
+
+    def __enter__(self):
+        return self.transaction.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.transaction.__exit__(exc_type, exc_value, traceback)
+
+
+# The transactions for the entire system, one per thread
+TRN = TransactionProxy()
+TRNADMIN = TransactionProxy(admin=True)
 
 
 def create_new_transaction():
-    """Creates a new global transaction
+    """Creates a new transaction for the calling thread
 
-    This is needed when using multiprocessing
+    This is needed when using multiprocessing. The connection pool detects
+    that it is running in a new process and opens its own connections.
     """
-    global TRN
-    TRN = Transaction()
+    TRN.reset()
@@ -104,9 +104,10 @@ class Study(qdb.base.QiitaObject):
             qdb.sql_connection.TRN.add(sql)
 
             ids = qdb.sql_connection.TRN.execute_fetchflatten()
+            studies = Study.instantiate_many(ids)
 
-        for id_ in ids:
-            yield Study(id_)
+        for study in studies:
+            yield study
 
     @property
     def status(self):
@@ -323,6 +324,7 @@ class Study(qdb.base.QiitaObject):
         title = ' '.join(title.split()).strip()
 
         with qdb.sql_connection.TRN:
+            qdb.util.refresh_study_listing_after_commit()
             if cls.exists(title):
                 raise qdb.exceptions.QiitaDBDuplicateError(
                     "Study", "title: %s" % title)
@@ -402,6 +404,7 @@ class Study(qdb.base.QiitaObject):
         with qdb.sql_connection.TRN:
             # checking that the id_ exists
             cls(id_)
+            qdb.util.refresh_study_listing_after_commit()
 
             if qdb.util.exists_table('sample_%d' % id_):
                 raise qdb.exceptions.QiitaDBError(
@@ -433,6 +436,7 @@ class Study(qdb.base.QiitaObject):
             qdb.sql_connection.TRN.add(sql, args)
 
             qdb.sql_connection.TRN.execute()
+            cls._forget(id_)
 
     @classmethod
     def get_tags(cls):
@@ -1452,6 +1456,7 @@ class StudyPerson(qdb.base.QiitaObject):
             sql = "DELETE FROM qiita.study_person WHERE study_person_id = %s"
             qdb.sql_connection.TRN.add(sql, [id_])
             qdb.sql_connection.TRN.execute()
+            cls._forget(id_)
 
     # Properties
     @property
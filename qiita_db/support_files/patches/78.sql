@@ -0,0 +1,26 @@
+-- Oct 18, 2026
+-- Adds a modification counter to the metadata templates so the copies of the
+-- templates cached in memory can be invalidated. The counter is stored with
+-- the column names of each template and takes its values from a sequence, so
+-- it never repeats, even if a template is deleted and created again.
+CREATE SEQUENCE qiita.metadata_template_modification_seq;
+
+DO $do$
+DECLARE
+    tbl     TEXT;
+BEGIN
+    FOR tbl IN
+        SELECT table_name
+        FROM information_schema.tables
+        WHERE table_schema = 'qiita'
+            AND (table_name SIMILAR TO 'sample\_[0-9]+'
+                 OR table_name SIMILAR TO 'prep\_[0-9]+')
+    LOOP
+        EXECUTE format(
+            'UPDATE qiita.%I
+             SET sample_values = sample_values || jsonb_build_object(
+                ''modification'',
+                nextval(''qiita.metadata_template_modification_seq''))
+             WHERE sample_id = ''qiita_sample_column_names''', tbl);
+    END LOOP;
+END $do$;
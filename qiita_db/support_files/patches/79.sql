@@ -0,0 +1,26 @@
+-- Oct 18, 2026
+-- Notifies every change in the status of a processing job on the
+-- qiita_processing_job_status channel, so the jobs waiting on other jobs (e.g.
+-- release_validators) can react as soon as they finish instead of polling the
+-- database. The payload is a JSON object with the job id and the new status;
+-- postgres only delivers the notification once the change is committed.
+CREATE FUNCTION qiita.notify_processing_job_status() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        'qiita_processing_job_status',
+        json_build_object(
+            'job_id', NEW.processing_job_id,
+            'status', (SELECT processing_job_status
+                       FROM qiita.processing_job_status
+                       WHERE processing_job_status_id =
+                            NEW.processing_job_status_id))::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER processing_job_status_notify
+    AFTER UPDATE OF processing_job_status_id ON qiita.processing_job
+    FOR EACH ROW
+    WHEN (OLD.processing_job_status_id IS DISTINCT FROM
+          NEW.processing_job_status_id)
+    EXECUTE PROCEDURE qiita.notify_processing_job_status();
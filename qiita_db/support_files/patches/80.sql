@@ -0,0 +1,297 @@
+-- Oct 18, 2026
+-- Adds qiita.study_listing, a summary of the information shown in the study
+-- list pages, so they can be served with a single indexed read instead of a
+-- set of correlated subqueries plus the status and EBI submission status of
+-- each study. The summary is maintained incrementally: the triggers below
+-- mark the studies affected by any change in
+-- qiita.study_listing_modified and qiita.refresh_study_listing() recomputes
+-- only those studies. The tables that are bulk loaded, qiita.study_sample
+-- and qiita.ebi_run_accession, have no triggers, as they would fire once per
+-- row; the code that modifies them marks the study once instead.
+--
+-- Marking studies notifies the qiita_study_listing channel, which postgres
+-- delivers once the change is committed, so the listing is refreshed in the
+-- background (see scripts/qiita) and the study list pages only read it. The
+-- listing of all the studies is computed at the end of this patch.
+
+CREATE TABLE qiita.study_listing (
+    study_id                        bigint NOT NULL,
+    metadata_complete               bool,
+    study_abstract                  text,
+    study_alias                     varchar,
+    study_title                     varchar,
+    ebi_study_accession             varchar,
+    pi_name                         varchar,
+    pi_email                        varchar,
+    number_samples_collected        bigint,
+    preparation_data_types          varchar[],
+    public_preparation_data_types   varchar[],
+    aids_with_deprecation           json[],
+    public_aids_with_deprecation    json[],
+    publications                    json[],
+    shared_with_name                varchar[],
+    shared_with_email               varchar[],
+    study_tags                      varchar[],
+    owner                           varchar,
+    owner_email                     varchar,
+    status                          varchar,
+    ebi_submission_status           varchar,
+    CONSTRAINT pk_study_listing PRIMARY KEY ( study_id ),
+    CONSTRAINT fk_study_listing_study FOREIGN KEY ( study_id )
+        REFERENCES qiita.study ( study_id ) ON DELETE CASCADE
+);
+
+CREATE TABLE qiita.study_listing_modified (
+    study_id    bigint NOT NULL,
+    CONSTRAINT pk_study_listing_modified PRIMARY KEY ( study_id )
+);
+
+-- Marks the given studies so they are recomputed in the next refresh. Note
+-- that postgres delivers a single notification per transaction, as the
+-- payload is always the same
+CREATE FUNCTION qiita.mark_study_listing_modified(study_ids bigint[])
+    RETURNS void AS $$
+    INSERT INTO qiita.study_listing_modified (study_id)
+        SELECT DISTINCT sid FROM unnest(study_ids) AS sid
+        WHERE sid IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    SELECT pg_notify('qiita_study_listing', '');
+$$ LANGUAGE sql;
+
+-- Trigger function that marks the studies affected by the change of a row.
+-- Note that plpgsql compiles a trigger function for each table, so each
+-- branch only references the columns of the table that fired it
+CREATE FUNCTION qiita.study_listing_row_changed() RETURNS trigger AS $$
+DECLARE
+    rec     RECORD;
+    ids     bigint[];
+BEGIN
+    FOR i IN 1..2 LOOP
+        IF i = 1 THEN
+            CONTINUE WHEN TG_OP = 'INSERT';
+            rec := OLD;
+        ELSE
+            CONTINUE WHEN TG_OP = 'DELETE';
+            rec := NEW;
+        END IF;
+
+        IF TG_TABLE_NAME IN ('study', 'study_prep_template',
+                             'study_artifact', 'study_publication',
+                             'study_users', 'per_study_tags') THEN
+            ids := ARRAY[rec.study_id];
+        ELSIF TG_TABLE_NAME = 'study_person' THEN
+            ids := ARRAY(SELECT study_id FROM qiita.study
+                         WHERE principal_investigator_id =
+                            rec.study_person_id);
+        ELSIF TG_TABLE_NAME = 'qiita_user' THEN
+            ids := ARRAY(SELECT study_id FROM qiita.study
+                         WHERE email = rec.email
+                         UNION
+                         SELECT study_id FROM qiita.study_users
+                         WHERE email = rec.email);
+        ELSIF TG_TABLE_NAME = 'prep_template' THEN
+            ids := ARRAY(SELECT study_id FROM qiita.study_prep_template
+                         WHERE prep_template_id = rec.prep_template_id);
+        ELSIF TG_TABLE_NAME = 'artifact' THEN
+            ids := ARRAY(SELECT study_id FROM qiita.study_artifact
+                         WHERE artifact_id = rec.artifact_id);
+        ELSIF TG_TABLE_NAME = 'software' THEN
+            ids := ARRAY(SELECT DISTINCT study_id
+                         FROM qiita.study_artifact
+                            JOIN qiita.artifact USING (artifact_id)
+                            JOIN qiita.software_command USING (command_id)
+                         WHERE software_id = rec.software_id);
+        ELSIF TG_TABLE_NAME = 'processing_job' THEN
+            -- only the EBI submission jobs change the listing
+            CONTINUE WHEN rec.command_id IS DISTINCT FROM (
+                SELECT command_id
+                FROM qiita.software_command
+                    JOIN qiita.software USING (software_id)
+                WHERE qiita.software.name = 'Qiita'
+                    AND qiita.software.version = 'alpha'
+                    AND qiita.software_command.name = 'submit_to_EBI');
+            ids := ARRAY(SELECT study_id FROM qiita.study_artifact
+                         WHERE artifact_id::text =
+                            rec.command_parameters->>'artifact');
+        END IF;
+
+        PERFORM qiita.mark_study_listing_modified(ids);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER study_listing_study
+    AFTER INSERT OR UPDATE OR DELETE ON qiita.study
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_study_prep_template
+    AFTER INSERT OR DELETE ON qiita.study_prep_template
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_study_artifact
+    AFTER INSERT OR DELETE ON qiita.study_artifact
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_study_publication
+    AFTER INSERT OR UPDATE OR DELETE ON qiita.study_publication
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_study_users
+    AFTER INSERT OR DELETE ON qiita.study_users
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_per_study_tags
+    AFTER INSERT OR DELETE ON qiita.per_study_tags
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_study_person
+    AFTER UPDATE OF name, email ON qiita.study_person
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_qiita_user
+    AFTER UPDATE OF name ON qiita.qiita_user
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_prep_template
+    AFTER UPDATE OF artifact_id, data_type_id ON qiita.prep_template
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_artifact
+    AFTER UPDATE OF visibility_id, command_id, artifact_type_id
+    ON qiita.artifact
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_software
+    AFTER UPDATE OF deprecated ON qiita.software
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+CREATE TRIGGER study_listing_processing_job
+    AFTER INSERT OR UPDATE OF processing_job_status_id
+    ON qiita.processing_job
+    FOR EACH ROW EXECUTE PROCEDURE qiita.study_listing_row_changed();
+
+-- Recomputes the listing of the modified studies. The modified studies are
+-- claimed by deleting them from qiita.study_listing_modified, so concurrent
+-- refreshes never compute the same study; a change committed after the
+-- claim marks the study again for the next refresh.
+--
+-- The status of a study is inferred from the visibility of its artifacts as
+-- qiita_db.util.infer_status does, and the EBI submission status follows
+-- Study.ebi_submission_status: the submit_to_EBI jobs of the artifacts that
+-- can be submitted and have not been submitted yet are 'submitting' if any
+-- of them is queued or running, or list the artifacts whose jobs all failed.
+CREATE FUNCTION qiita.refresh_study_listing() RETURNS void AS $$
+DECLARE
+    ids     bigint[];
+BEGIN
+    WITH modified AS (
+        DELETE FROM qiita.study_listing_modified RETURNING study_id)
+    SELECT array_agg(study_id) INTO ids FROM modified;
+
+    IF ids IS NULL THEN
+        RETURN;
+    END IF;
+
+    DELETE FROM qiita.study_listing WHERE study_id = ANY(ids);
+
+    INSERT INTO qiita.study_listing (
+        study_id, metadata_complete, study_abstract, study_alias,
+        study_title, ebi_study_accession, pi_name, pi_email,
+        number_samples_collected, preparation_data_types,
+        public_preparation_data_types, aids_with_deprecation,
+        public_aids_with_deprecation, publications, shared_with_name,
+        shared_with_email, study_tags, owner, owner_email, status,
+        ebi_submission_status)
+    WITH ebi_jobs AS (
+        SELECT sa.study_id, pj.command_parameters->>'artifact' AS aid,
+               processing_job_status AS job_status
+        FROM qiita.processing_job pj
+            JOIN qiita.processing_job_status USING (processing_job_status_id)
+            JOIN qiita.study_artifact sa ON (
+                sa.artifact_id::text = pj.command_parameters->>'artifact')
+            JOIN qiita.artifact a ON (a.artifact_id = sa.artifact_id)
+            JOIN qiita.artifact_type USING (artifact_type_id)
+        WHERE sa.study_id = ANY(ids)
+            AND can_be_submitted_to_ebi
+            AND pj.command_id = (
+                SELECT command_id
+                FROM qiita.software_command
+                    JOIN qiita.software USING (software_id)
+                WHERE qiita.software.name = 'Qiita'
+                    AND qiita.software.version = 'alpha'
+                    AND qiita.software_command.name = 'submit_to_EBI')
+            AND NOT EXISTS (SELECT 1 FROM qiita.ebi_run_accession era
+                            WHERE era.artifact_id = a.artifact_id)),
+    ebi_submitting AS (
+        SELECT DISTINCT study_id FROM ebi_jobs
+        WHERE job_status IN ('queued', 'running')),
+    ebi_failed AS (
+        SELECT study_id, string_agg(aid, ', ' ORDER BY aid::bigint) AS aids
+        FROM (SELECT study_id, aid FROM ebi_jobs
+              GROUP BY study_id, aid
+              HAVING bool_and(job_status = 'error')) failed
+        GROUP BY study_id)
+    SELECT s.study_id, s.metadata_complete, s.study_abstract, s.study_alias,
+        s.study_title, s.ebi_study_accession,
+        sp.name AS pi_name, sp.email AS pi_email,
+        (SELECT COUNT(sample_id) FROM qiita.study_sample
+            WHERE study_id = s.study_id),
+        (SELECT array_agg(DISTINCT data_type)
+            FROM qiita.study_prep_template
+            LEFT JOIN qiita.prep_template USING (prep_template_id)
+            LEFT JOIN qiita.data_type USING (data_type_id)
+            WHERE study_id = s.study_id),
+        (SELECT array_agg(DISTINCT data_type)
+            FROM qiita.study_prep_template
+            LEFT JOIN qiita.prep_template USING (prep_template_id)
+            LEFT JOIN qiita.data_type USING (data_type_id)
+            LEFT JOIN qiita.artifact USING (artifact_id)
+            LEFT JOIN qiita.visibility USING (visibility_id)
+            WHERE visibility = 'public' AND study_id = s.study_id),
+        (SELECT array_agg(row_to_json(
+            (m_aid.artifact_id, qs.deprecated), true) ORDER BY artifact_id)
+            FROM qiita.study_artifact
+            LEFT JOIN qiita.artifact AS m_aid USING (artifact_id)
+            LEFT JOIN qiita.artifact_type USING (artifact_type_id)
+            LEFT JOIN qiita.software_command USING (command_id)
+            LEFT JOIN qiita.software qs USING (software_id)
+            WHERE artifact_type = 'BIOM' AND study_id = s.study_id),
+        (SELECT array_agg(row_to_json(
+            (m_aid.artifact_id, qs.deprecated), true) ORDER BY artifact_id)
+            FROM qiita.study_artifact
+            LEFT JOIN qiita.artifact AS m_aid USING (artifact_id)
+            LEFT JOIN qiita.visibility USING (visibility_id)
+            LEFT JOIN qiita.artifact_type USING (artifact_type_id)
+            LEFT JOIN qiita.software_command USING (command_id)
+            LEFT JOIN qiita.software qs USING (software_id)
+            WHERE artifact_type = 'BIOM' AND visibility = 'public'
+                AND study_id = s.study_id),
+        (SELECT array_agg(row_to_json((publication, is_doi), true))
+            FROM qiita.study_publication
+            WHERE study_id = s.study_id),
+        (SELECT array_agg(name ORDER BY email) FROM qiita.study_users
+            LEFT JOIN qiita.qiita_user USING (email)
+            WHERE study_id = s.study_id),
+        (SELECT array_agg(email ORDER BY email) FROM qiita.study_users
+            LEFT JOIN qiita.qiita_user USING (email)
+            WHERE study_id = s.study_id),
+        (SELECT array_agg(study_tag) FROM qiita.per_study_tags
+            WHERE study_id = s.study_id),
+        (SELECT name FROM qiita.qiita_user WHERE email = s.email),
+        s.email,
+        (SELECT CASE WHEN bool_or(visibility = 'public') THEN 'public'
+                     WHEN bool_or(visibility = 'private') THEN 'private'
+                     WHEN bool_or(visibility = 'awaiting_approval')
+                        THEN 'awaiting_approval'
+                     ELSE 'sandbox' END
+            FROM qiita.study_artifact
+            JOIN qiita.artifact USING (artifact_id)
+            JOIN qiita.visibility USING (visibility_id)
+            WHERE study_id = s.study_id),
+        CASE WHEN ebi_submitting.study_id IS NOT NULL THEN 'submitting'
+             WHEN ebi_failed.aids IS NOT NULL
+                THEN 'Some artifact submissions failed: ' || ebi_failed.aids
+             WHEN COALESCE(s.ebi_study_accession, '') != '' THEN 'submitted'
+             ELSE 'not submitted' END
+    FROM qiita.study s
+        LEFT JOIN qiita.study_person sp ON (
+            sp.study_person_id = s.principal_investigator_id)
+        LEFT JOIN ebi_submitting USING (study_id)
+        LEFT JOIN ebi_failed USING (study_id)
+    WHERE s.study_id = ANY(ids);
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO qiita.study_listing_modified (study_id)
+    SELECT study_id FROM qiita.study;
+SELECT qiita.refresh_study_listing();
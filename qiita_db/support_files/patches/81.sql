@@ -0,0 +1,13 @@
+-- Oct 18, 2026
+-- Archive.retrieve_feature_values looks up features without their merging
+-- scheme, which can't use the primary key (archive_merging_scheme_id,
+-- archive_feature), so they get their own index.
+CREATE INDEX idx_archive_feature_value_feature
+    ON qiita.archive_feature_value ( archive_feature );
+
+-- The values of the features are cached by each Qiita process. Every insert
+-- of features in a merging scheme increases its version, so the processes
+-- can check that the values they cached are still current with a single
+-- lookup.
+ALTER TABLE qiita.archive_merging_scheme
+    ADD archive_version bigint DEFAULT 0 NOT NULL;
@@ -0,0 +1,87 @@
+-- Oct 18, 2026
+-- Stores the list of files that nginx needs to build the zip of the files of
+-- an artifact, so the download handlers don't have to walk the artifact
+-- directories and stat the mapping files on every request. The manifest of
+-- an artifact is computed the first time that it is requested and the
+-- triggers below remove it whenever the files of the artifact, or the
+-- mapping files of its preparations, change. As the manifest is computed
+-- outside of the database, it is only stored if the key of its files (see
+-- artifact_download_manifest_key) didn't change while it was computed.
+
+CREATE TABLE qiita.artifact_download_manifest (
+    artifact_id     bigint NOT NULL,
+    manifest        json NOT NULL,
+    CONSTRAINT pk_artifact_download_manifest PRIMARY KEY ( artifact_id ),
+    CONSTRAINT fk_artifact_download_manifest_artifact
+        FOREIGN KEY ( artifact_id )
+        REFERENCES qiita.artifact ( artifact_id ) ON DELETE CASCADE
+);
+
+-- Identifies the files listed in the manifest of an artifact: the files of
+-- the artifact and the mapping files of the preparations of its study, the
+-- same ones that the triggers below watch
+CREATE FUNCTION qiita.artifact_download_manifest_key(a_id bigint)
+    RETURNS text AS $$
+    SELECT md5(concat(
+        (SELECT string_agg(concat_ws(',', filepath_id, filepath, checksum,
+                                     fp_size), ';' ORDER BY filepath_id)
+            FROM qiita.artifact_filepath
+                JOIN qiita.filepath USING (filepath_id)
+            WHERE artifact_id = a_id),
+        '|',
+        (SELECT string_agg(filepath_id::text, ';' ORDER BY filepath_id)
+            FROM qiita.study_artifact
+                JOIN qiita.study_prep_template USING (study_id)
+                JOIN qiita.prep_template_filepath USING (prep_template_id)
+            WHERE artifact_id = a_id)));
+$$ LANGUAGE sql STABLE;
+
+CREATE FUNCTION qiita.artifact_download_manifest_changed() RETURNS trigger AS $$
+DECLARE
+    rec     RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'artifact_filepath' THEN
+        DELETE FROM qiita.artifact_download_manifest
+            WHERE artifact_id = rec.artifact_id;
+    ELSIF TG_TABLE_NAME = 'filepath' THEN
+        DELETE FROM qiita.artifact_download_manifest
+            WHERE artifact_id IN (
+                SELECT artifact_id FROM qiita.artifact_filepath
+                WHERE filepath_id = rec.filepath_id
+                UNION
+                SELECT artifact_id FROM qiita.study_artifact
+                    JOIN qiita.study_prep_template USING (study_id)
+                    JOIN qiita.prep_template_filepath USING (prep_template_id)
+                WHERE filepath_id = rec.filepath_id);
+    ELSE
+        -- prep_template and prep_template_filepath: the mapping files of
+        -- the preparation are listed in the manifests of all the artifacts
+        -- that descend from it, which are in the same study
+        DELETE FROM qiita.artifact_download_manifest
+            WHERE artifact_id IN (
+                SELECT artifact_id FROM qiita.study_artifact
+                    JOIN qiita.study_prep_template USING (study_id)
+                WHERE prep_template_id = rec.prep_template_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER artifact_download_manifest_artifact_filepath
+    AFTER INSERT OR DELETE ON qiita.artifact_filepath
+    FOR EACH ROW EXECUTE PROCEDURE qiita.artifact_download_manifest_changed();
+CREATE TRIGGER artifact_download_manifest_filepath
+    AFTER UPDATE OF filepath, checksum, fp_size ON qiita.filepath
+    FOR EACH ROW EXECUTE PROCEDURE qiita.artifact_download_manifest_changed();
+CREATE TRIGGER artifact_download_manifest_prep_template_filepath
+    AFTER INSERT OR DELETE ON qiita.prep_template_filepath
+    FOR EACH ROW EXECUTE PROCEDURE qiita.artifact_download_manifest_changed();
+CREATE TRIGGER artifact_download_manifest_prep_template
+    AFTER UPDATE OF artifact_id ON qiita.prep_template
+    FOR EACH ROW EXECUTE PROCEDURE qiita.artifact_download_manifest_changed();
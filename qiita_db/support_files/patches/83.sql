@@ -0,0 +1,66 @@
+-- Oct 18, 2026
+-- Returns all the jobs descendant of an artifact in a single query, together
+-- with everything that Artifact.descendants_with_jobs needs to place them in
+-- the graph, so it doesn't have to walk the jobs one by one.
+
+-- The jobs returned are the ones that use a_id, or any artifact generated
+-- from it, as input, and the children of the jobs that have not finished yet
+-- (i.e. the jobs of the workflows in construction). Note that the command
+-- outputs are returned sorted by command_output_id, so output_names and
+-- output_types are aligned, and that the ids of the children are cast to
+-- varchar as psycopg2 doesn't parse arrays of UUID.
+CREATE OR REPLACE FUNCTION qiita.artifact_descendant_jobs(a_id bigint)
+RETURNS TABLE (processing_job_id UUID, processing_job_status varchar,
+               command_name varchar, hidden boolean, pending json,
+               input_ids bigint[], output_ids bigint[], children_ids varchar[],
+               output_names varchar[], output_types varchar[]) AS $$
+    WITH RECURSIVE descendant_jobs AS (
+        SELECT apj.processing_job_id
+            FROM qiita.artifact_processing_job apj
+            WHERE apj.artifact_id = a_id
+      UNION
+        SELECT next_job.child_id
+            FROM descendant_jobs dj
+            JOIN (SELECT aopj.processing_job_id AS parent_id,
+                         apj.processing_job_id AS child_id
+                    FROM qiita.artifact_output_processing_job aopj
+                    JOIN qiita.artifact_processing_job apj USING (artifact_id)
+                  UNION ALL
+                  SELECT ppj.parent_id, ppj.child_id
+                    FROM qiita.parent_processing_job ppj
+                    JOIN qiita.processing_job pj
+                        ON (pj.processing_job_id = ppj.parent_id)
+                    JOIN qiita.processing_job_status pjs
+                        USING (processing_job_status_id)
+                    WHERE pjs.processing_job_status NOT IN ('success', 'error')
+                 ) next_job ON (next_job.parent_id = dj.processing_job_id)
+    )
+    SELECT pj.processing_job_id, pjs.processing_job_status, sc.name,
+           pj.hidden, pj.pending,
+           ARRAY(SELECT i.artifact_id
+                 FROM qiita.artifact_processing_job i
+                 WHERE i.processing_job_id = pj.processing_job_id
+                 ORDER BY i.artifact_id),
+           ARRAY(SELECT o.artifact_id
+                 FROM qiita.artifact_output_processing_job o
+                 WHERE o.processing_job_id = pj.processing_job_id
+                 ORDER BY o.artifact_id),
+           ARRAY(SELECT c.child_id::varchar
+                 FROM qiita.parent_processing_job c
+                 WHERE c.parent_id = pj.processing_job_id
+                 ORDER BY c.child_id),
+           ARRAY(SELECT co.name
+                 FROM qiita.command_output co
+                 WHERE co.command_id = pj.command_id
+                 ORDER BY co.command_output_id),
+           ARRAY(SELECT atype.artifact_type
+                 FROM qiita.command_output co
+                    JOIN qiita.artifact_type atype USING (artifact_type_id)
+                 WHERE co.command_id = pj.command_id
+                 ORDER BY co.command_output_id)
+        FROM descendant_jobs dj
+        JOIN qiita.processing_job pj USING (processing_job_id)
+        JOIN qiita.processing_job_status pjs USING (processing_job_status_id)
+        JOIN qiita.software_command sc USING (command_id)
+        ORDER BY pj.processing_job_id;
+$$ LANGUAGE sql STABLE;
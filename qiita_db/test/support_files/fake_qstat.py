@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+import sys
+from os import environ
+from os.path import exists
+
+
+# fake_qstat.py replaces 'qstat -x' in the tests of Watcher: it outputs the
+# contents of the XML file in the FAKE_QSTAT_XML environment variable and, as
+# qstat does when the server is unreachable, it fails if there is no file.
+def execute():
+    fp = environ.get('FAKE_QSTAT_XML')
+    if fp is None or not exists(fp):
+        sys.stderr.write('Cannot connect to server\n')
+        sys.exit(1)
+
+    with open(fp) as f:
+        sys.stdout.write(f.read())
+
+
+if __name__ == '__main__':
+    execute()
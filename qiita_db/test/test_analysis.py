@@ -6,6 +6,7 @@ from shutil import move
 from biom import load_table
 from pandas.util.testing import assert_frame_equal
 from functools import partial
+from mock import patch
 import numpy.testing as npt
 
 from qiita_core.util import qiita_test_checker
@@ -493,6 +494,28 @@ class TestAnalysis(TestCase):
             obs = set(table.ids(axis='sample'))
             self.assertEqual(obs, exp)
 
+    def test_build_biom_tables_process_pool(self):
+        analysis = self._create_analyses_with_samples()
+        samples = ['1.SKB8.640193', '1.SKD8.640184', '1.SKB7.640196']
+        grouped_samples = {
+            '18S || algorithm': [(4, samples)],
+            '16S || algorithm': [(5, samples)],
+            '18S || other algorithm': [(4, samples), (5, samples)]}
+        with patch.object(qiita_config, 'analysis_build_workers', 2), \
+                patch('qiita_db.analysis.get_context',
+                      wraps=qdb.analysis.get_context) as get_context:
+            obs_bioms = analysis._build_biom_tables(grouped_samples)
+        get_context.assert_called_once_with('spawn')
+
+        obs = [(a, basename(b)) for a, b, _ in obs_bioms]
+        exp = [('18S', '%s_analysis_18S_algorithm.biom' % analysis.id),
+               ('16S', '%s_analysis_16S_algorithm.biom' % analysis.id),
+               ('18S', '%s_analysis_18S_otheralgorithm.biom' % analysis.id)]
+        self.assertCountEqual(obs, exp)
+        for _, fp, _ in obs_bioms:
+            self.assertEqual(
+                set(load_table(fp).ids(axis='sample')), set(samples))
+
     def test_build_biom_tables_duplicated_samples_not_merge(self):
         analysis = self._create_analyses_with_samples()
         grouped_samples = {
@@ -511,6 +534,47 @@ class TestAnalysis(TestCase):
                '5.1.SKB8.640193', '5.1.SKB7.640196', '5.1.SKD8.640184'}
         self.assertCountEqual(obs, exp)
 
+    def test_merge_biom_tables(self):
+        fp = [x['fp'] for x in qdb.artifact.Artifact(4).filepaths
+              if x['fp_type'] == 'biom'][0]
+        samples = ['1.SKB8.640193', '1.SKD8.640184', 'not.a.sample']
+        exp = load_table(fp).filter(
+            samples[:2], inplace=False).to_dataframe(dense=True)
+        exp = exp[exp.sum(axis=1) > 0]
+
+        obs = qdb.analysis._merge_biom_tables(
+            [(4, fp, samples)]).to_dataframe(dense=True)
+        assert_frame_equal(obs.loc[exp.index, exp.columns], exp)
+
+        # the values of the samples in multiple tables are added
+        obs = qdb.analysis._merge_biom_tables(
+            [(4, fp, samples), (5, fp, samples[:1])]).to_dataframe(dense=True)
+        exp['1.SKB8.640193'] *= 2
+        assert_frame_equal(obs.loc[exp.index, exp.columns], exp)
+
+        obs = qdb.analysis._merge_biom_tables(
+            [(4, fp, samples), (5, fp, samples[:1])], True)
+        self.assertCountEqual(obs.ids(), [
+            '4.1.SKB8.640193', '4.1.SKD8.640184', '5.1.SKB8.640193'])
+
+        self.assertIsNone(
+            qdb.analysis._merge_biom_tables([(4, fp, ['not.a.sample'])]))
+
+    def test_write_biom_table(self):
+        fp = [x['fp'] for x in qdb.artifact.Artifact(4).filepaths
+              if x['fp_type'] == 'biom'][0]
+        # testfile.txt is removed in tearDown
+        biom_fp = self.get_fp('testfile.txt')
+
+        obs = qdb.analysis._write_biom_table(
+            [(4, fp, ['1.SKB8.640193'])], False, biom_fp, 'test')
+        table = load_table(biom_fp)
+        self.assertEqual(list(table.ids()), ['1.SKB8.640193'])
+        self.assertCountEqual(obs, table.ids(axis='observation'))
+
+        self.assertIsNone(qdb.analysis._write_biom_table(
+            [(4, fp, ['not.a.sample'])], False, biom_fp, 'test'))
+
     def test_build_biom_tables_raise_error_due_to_sample_selection(self):
         grouped_samples = {
             '18S || algorithm': [
@@ -79,6 +79,70 @@ class ArchiveTest(TestCase):
             1: 'Pick closed-reference OTUs | Split libraries FASTQ',
             2: '', 3: 'Single Rarefaction | N/A'})
 
+    def test_insert_features_and_retrieve_feature_values_cached(self):
+        ARCHIVE = qdb.archive.Archive
+        cache = qdb.archive.FEATURE_VALUE_CACHE
+        features = {'featureA': dumps({'placement': 'A'}),
+                    'featureB': dumps({'placement': 'B'}),
+                    'featureC': dumps({'placement': 'C'})}
+
+        def _version():
+            with qdb.sql_connection.TRN:
+                qdb.sql_connection.TRN.add(
+                    """SELECT archive_version
+                       FROM qiita.archive_merging_scheme
+                       WHERE archive_merging_scheme = 'Scheme'""")
+                return qdb.sql_connection.TRN.execute_fetchlast()
+
+        obs = ARCHIVE.insert_features('Scheme', features)
+        self.assertEqual(obs, features)
+        version = _version()
+        self.assertEqual(cache.get('Scheme', version, 'featureA'),
+                         features['featureA'])
+
+        # the features are looked up in batches and the ones not in the
+        # archive are ignored
+        batch_size = qdb.archive.FEATURE_BATCH_SIZE
+        qdb.archive.FEATURE_BATCH_SIZE = 2
+        try:
+            cache.clear()
+            obs = ARCHIVE.retrieve_feature_values(
+                'Scheme', [b'featureA', 'featureC', 'featureD'])
+            self.assertEqual(obs, {'featureA': features['featureA'],
+                                   'featureC': features['featureC']})
+            self.assertEqual(len(cache), 2)
+            obs = ARCHIVE.retrieve_feature_values(
+                features=['featureA', 'featureB'])
+            self.assertEqual(obs, {'featureA': features['featureA'],
+                                   'featureB': features['featureB']})
+        finally:
+            qdb.archive.FEATURE_BATCH_SIZE = batch_size
+
+        # updating the values, from this or any other process, increases the
+        # version of the merging scheme so the cached values are not used
+        new = {'featureA': dumps({'placement': 'new A'})}
+        self.assertEqual(ARCHIVE.insert_features('Scheme', new), new)
+        self.assertEqual(_version(), version + 1)
+        self.assertIsNone(cache.get('Scheme', version, 'featureA'))
+        self.assertEqual(
+            ARCHIVE.retrieve_feature_values('Scheme', ['featureA']), new)
+
+        # as if the value was updated by another process
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(
+                """UPDATE qiita.archive_feature_value
+                   SET archive_feature_value = %s
+                   WHERE archive_feature = 'featureA'""",
+                [features['featureA']])
+            qdb.sql_connection.TRN.add(
+                """UPDATE qiita.archive_merging_scheme
+                   SET archive_version = archive_version + 1
+                   WHERE archive_merging_scheme = 'Scheme'""")
+            qdb.sql_connection.TRN.execute()
+        self.assertEqual(
+            ARCHIVE.retrieve_feature_values('Scheme', ['featureA']),
+            {'featureA': features['featureA']})
+
     def test_get_merging_scheme_from_job(self):
         exp = 'Split libraries FASTQ | N/A'
         obs = qdb.archive.Archive.get_merging_scheme_from_job(
@@ -7,6 +7,7 @@
 # -----------------------------------------------------------------------------
 
 from unittest import TestCase, main
+from mock import patch
 from tempfile import mkstemp, mkdtemp
 from datetime import datetime
 from os import close, remove
@@ -267,6 +268,52 @@ class ArtifactTestsReadOnly(TestCase):
                (qdb.artifact.Artifact(3), qdb.artifact.Artifact(4))]
         self.assertCountEqual(obs.edges(), exp)
 
+    def test_artifact_lineage(self):
+        obs = qdb.artifact.ArtifactLineage.from_edge_list(1, [])
+        self.assertEqual(obs.ids, [1])
+        self.assertEqual(obs.edges, [])
+        self.assertEqual(obs.children(1), [])
+        self.assertEqual(obs.artifacts(), [qdb.artifact.Artifact(1)])
+
+        obs = qdb.artifact.ArtifactLineage.from_edge_list(
+            1, [(3, 4), (1, 2), (2, 4), (1, 3)])
+        self.assertEqual(len(obs), 4)
+        self.assertEqual(obs.ids, [1, 2, 3, 4])
+        self.assertEqual(obs.edges, [(1, 2), (1, 3), (2, 4), (3, 4)])
+        self.assertEqual(obs.children(1), [2, 3])
+        self.assertEqual(obs.children(4), [])
+        self.assertEqual(obs.parents(4), [2, 3])
+        self.assertEqual(obs.parents(1), [])
+        self.assertIn(4, obs)
+        self.assertNotIn(5, obs)
+        with self.assertRaises(KeyError):
+            obs.children(5)
+
+        # the parents always go before their children
+        obs = qdb.artifact.ArtifactLineage.from_edge_list(
+            6, [(5, 6), (1, 2), (2, 5)])
+        self.assertEqual(obs.ids, [1, 2, 5, 6])
+
+    def test_ancestors_lineage(self):
+        obs = qdb.artifact.Artifact(1).ancestors_lineage
+        self.assertEqual(obs.ids, [1])
+        self.assertEqual(obs.edges, [])
+
+        obs = qdb.artifact.Artifact(4).ancestors_lineage
+        self.assertEqual(obs.ids, [1, 2, 4])
+        self.assertEqual(obs.edges, [(1, 2), (2, 4)])
+
+    def test_descendants_lineage(self):
+        obs = qdb.artifact.Artifact(1).descendants_lineage
+        self.assertEqual(obs.ids, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(obs.edges, [(1, 2), (1, 3), (2, 4), (2, 5), (2, 6)])
+        self.assertEqual(obs.artifacts(),
+                         [qdb.artifact.Artifact(i) for i in range(1, 7)])
+
+        obs = qdb.artifact.Artifact(3).descendants_lineage
+        self.assertEqual(obs.ids, [3])
+        self.assertEqual(obs.edges, [])
+
     def test_ancestors(self):
         obs = qdb.artifact.Artifact(1).ancestors
         self.assertTrue(isinstance(obs, nx.DiGraph))
@@ -422,6 +469,38 @@ class ArtifactTestsReadOnly(TestCase):
         self.assertEqual(1, len([y for x, y in obs_edges if x[0] == 'type']))
         self.assertEqual(2, len([y for x, y in obs_edges if y[0] == 'type']))
 
+    def test_descendants_with_jobs_cache(self):
+        A = qdb.artifact.Artifact
+        obs = A(1).descendants_with_jobs
+        # the graph is reused while its jobs don't change
+        self.assertIs(A(1).descendants_with_jobs, obs)
+        self.assertTrue(nx.is_frozen(obs))
+
+        json_str = (
+            '{"input_data": 1, "max_barcode_errors": 1.5, '
+            '"barcode_type": "8", "max_bad_run_length": 3, '
+            '"rev_comp": false, "phred_quality_threshold": 3, '
+            '"rev_comp_barcode": false, "rev_comp_mapping_barcodes": false, '
+            '"min_per_read_length_fraction": 0.75, "sequence_max_n": 0, '
+            '"phred_offset": "auto"}')
+        job = qdb.processing_job.ProcessingJob.create(
+            qdb.user.User('test@foo.bar'),
+            qdb.software.Parameters.load(qdb.software.Command(1),
+                                         json_str=json_str))
+        obs = A(1).descendants_with_jobs
+        self.assertIn(('job', job), obs.nodes())
+        self.assertEqual(
+            ['demultiplexed'],
+            [y[1].name for x, y in obs.edges() if x == ('job', job)])
+
+        # changing the status of the job invalidates the graph
+        job._set_status('error')
+        obs_error = A(1).descendants_with_jobs
+        self.assertIsNot(obs_error, obs)
+        self.assertIn(('job', job), obs_error.nodes())
+        self.assertEqual(
+            [], [y for x, y in obs_error.edges() if x == ('job', job)])
+
     def test_children(self):
         exp = [qdb.artifact.Artifact(2), qdb.artifact.Artifact(3)]
         self.assertEqual(qdb.artifact.Artifact(1).children, exp)
@@ -1232,15 +1311,73 @@ class ArtifactTests(TestCase):
             '1.SKM7.640188': 'ERR1000025',
             '1.SKM8.640201': 'ERR1000026',
             '1.SKM9.640192': 'ERR1000027'}
-        a.ebi_run_accessions = new_vals
+        with patch('qiita_db.util.refresh_study_listing') as refresh:
+            a.ebi_run_accessions = new_vals
         self.assertEqual(a.ebi_run_accessions, new_vals)
 
+        # the study listing is refreshed once the change is committed
+        refresh.assert_called_once_with()
+
     def test_is_submitted_to_vamps_setter(self):
         a = qdb.artifact.Artifact(2)
         self.assertFalse(a.is_submitted_to_vamps)
         a.is_submitted_to_vamps = True
         self.assertTrue(a.is_submitted_to_vamps)
 
+    def test_download_manifests(self):
+        sql = """SELECT artifact_id
+                 FROM qiita.artifact_download_manifest
+                 ORDER BY artifact_id"""
+        obs = qdb.artifact.Artifact.download_manifests([4, 7])
+        self.assertCountEqual(obs, [4, 7])
+        self.assertEqual(
+            obs[4][0], ('processed_data/1_study_1001_closed_reference_otu_'
+                        'table.biom', 'processed_data/1_study_1001_closed_'
+                        'reference_otu_table.biom', '1579715020', '1256812'))
+        self.assertEqual(obs[4][1][1], 'mapping_files/4_mapping_file.txt')
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(sql)
+            self.assertEqual(
+                qdb.sql_connection.TRN.execute_fetchflatten(), [4, 7])
+
+        # the stored manifests are returned
+        self.assertEqual(qdb.artifact.Artifact.download_manifests([4, 7]), obs)
+        self.assertEqual(qdb.artifact.Artifact.download_manifests([]), {})
+
+        # changing the files of the artifact drops its manifest
+        fd, fp = mkstemp(suffix=".html")
+        close(fd)
+        self._clean_up_files.append(fp)
+        qdb.artifact.Artifact(4).set_html_summary(fp)
+        self._clean_up_files.append(
+            qdb.artifact.Artifact(4).html_summary_fp[1])
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(sql)
+            self.assertEqual(
+                qdb.sql_connection.TRN.execute_fetchflatten(), [7])
+
+        # a manifest whose files changed while it was computed is returned
+        # but not stored
+        download_manifest = qdb.artifact.Artifact._download_manifest
+
+        def _changing_files(artifact, basedir):
+            manifest = download_manifest(artifact, basedir)
+            fd, fp = mkstemp(suffix=".html")
+            close(fd)
+            self._clean_up_files.append(fp)
+            artifact.set_html_summary(fp)
+            self._clean_up_files.append(artifact.html_summary_fp[1])
+            return manifest
+
+        with patch.object(qdb.artifact.Artifact, '_download_manifest',
+                          _changing_files):
+            obs = qdb.artifact.Artifact.download_manifests([4])
+        self.assertCountEqual(obs, [4])
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(sql)
+            self.assertEqual(
+                qdb.sql_connection.TRN.execute_fetchflatten(), [7])
+
     def test_html_summary_setter(self):
         a = qdb.artifact.Artifact(1)
 
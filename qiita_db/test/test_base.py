@@ -61,6 +61,68 @@ class QiitaBaseTest(TestCase):
 
         self.assertTrue(self.tester._check_portal(1))
 
+    def test_identity_map(self):
+        """Objects are only checked once per transaction"""
+        with qdb.sql_connection.TRN:
+            qdb.artifact.Artifact(1)
+            self.assertEqual(
+                qdb.sql_connection.TRN.identity_map[('artifact', 1)],
+                {qiita_config.portal})
+            # the checks are not executed again
+            idx = qdb.sql_connection.TRN.index
+            qdb.artifact.Artifact(1)
+            self.assertEqual(qdb.sql_connection.TRN.index, idx)
+        self.assertEqual(qdb.sql_connection.TRN.identity_map, {})
+
+    def test_identity_map_rollback(self):
+        with qdb.sql_connection.TRN:
+            qdb.artifact.Artifact(1)
+            qdb.sql_connection.TRN.rollback()
+            self.assertEqual(qdb.sql_connection.TRN.identity_map, {})
+
+    def test_identity_map_portal(self):
+        qiita_config.portal = 'QIITA'
+        with qdb.sql_connection.TRN:
+            qdb.analysis.Analysis(1)
+            qiita_config.portal = 'EMP'
+            with self.assertRaises(qdb.exceptions.QiitaDBError):
+                qdb.analysis.Analysis(1)
+
+    def test_forget(self):
+        with qdb.sql_connection.TRN:
+            qdb.artifact.Artifact(1)
+            qdb.artifact.Artifact._forget(1)
+            self.assertNotIn(('artifact', 1),
+                             qdb.sql_connection.TRN.identity_map)
+
+    def test_instantiate_many(self):
+        obs = qdb.artifact.Artifact.instantiate_many([1, '2', 3])
+        exp = [qdb.artifact.Artifact(i) for i in [1, 2, 3]]
+        self.assertEqual(obs, exp)
+        self.assertEqual(qdb.artifact.Artifact.instantiate_many([]), [])
+
+        obs = qdb.user.User.instantiate_many(['test@foo.bar'])
+        self.assertEqual(obs, [qdb.user.User('test@foo.bar')])
+
+        obs = qdb.software.Command.instantiate_many([1, 2])
+        self.assertEqual(obs, [qdb.software.Command(1),
+                               qdb.software.Command(2)])
+
+        PT = qdb.metadata_template.prep_template.PrepTemplate
+        self.assertEqual(PT.instantiate_many([1]), [PT(1)])
+
+    def test_instantiate_many_error(self):
+        with self.assertRaises(qdb.exceptions.QiitaDBUnknownIDError):
+            qdb.artifact.Artifact.instantiate_many([1, 100])
+
+        qiita_config.portal = 'EMP'
+        with self.assertRaises(qdb.exceptions.QiitaDBError):
+            qdb.analysis.Analysis.instantiate_many([1])
+
+    def test_instantiate_many_base_error(self):
+        with self.assertRaises(IncompetentQiitaDeveloperError):
+            qdb.base.QiitaObject.instantiate_many([1])
+
     def test_equal_self(self):
         """Equality works with the same object"""
         self.assertEqual(self.tester, self.tester)
@@ -10,7 +10,12 @@ from unittest import TestCase, main
 import numpy.testing as npt
 from tarfile import open as topen
 from os import remove
-from os.path import exists, join
+from os.path import exists, join, getmtime
+from shutil import rmtree
+from hashlib import md5
+from time import sleep
+from types import GeneratorType
+from json import dumps, load
 
 import pandas as pd
 
@@ -161,7 +166,7 @@ class MetaUtilTests(TestCase):
 
     def test_get_lat_longs(self):
         # no public studies should return an empty array
-        obs = qdb.meta_util.get_lat_longs()
+        obs = list(qdb.meta_util.get_lat_longs())
         self.assertCountEqual(obs, [])
 
         old_visibility = {}
@@ -195,7 +200,9 @@ class MetaUtilTests(TestCase):
             [1, 78.3634273709, 74.423907894],
             [1, 38.2627021402, 3.48274264219]]
         obs = qdb.meta_util.get_lat_longs()
-        self.assertCountEqual(obs, exp)
+        # the samples are streamed
+        self.assertIsInstance(obs, GeneratorType)
+        self.assertCountEqual(list(obs), exp)
 
         for k, v in old_visibility.items():
             k.artifact.visibility = v
@@ -238,7 +245,7 @@ class MetaUtilTests(TestCase):
 
         qiita_config.portal = 'EMP'
 
-        obs = qdb.meta_util.get_lat_longs()
+        obs = list(qdb.meta_util.get_lat_longs())
         exp = []
 
         self.assertCountEqual(obs, exp)
@@ -296,6 +303,11 @@ class MetaUtilTests(TestCase):
             self.assertEqual(
                 f(redis_key), str.encode(str(db_stats['stats'][k])))
 
+        # each phase reports the time spent on it
+        timings = r_client.hgetall('%s:stats:timings' % portal)
+        self.assertCountEqual(
+            timings, [b'counts', b'filesystem', b'plot', b'save'])
+
         # regenerating stats to make sure that we have 2 rows in the DB
         qdb.meta_util.update_redis_stats()
 
@@ -303,6 +315,45 @@ class MetaUtilTests(TestCase):
         # there should be only one set of values
         self.assertEqual(2, len(db_stats))
 
+    def test_get_filepath_stats(self):
+        cache_key = '%s:stats:study_files' % qiita_config.portal
+        r_client.delete(cache_key)
+        exp_summary, exp_missing = qdb.meta_util._get_filepath_stats()
+        self.assertGreater(len(exp_summary), 0)
+        cached = r_client.hgetall(cache_key)
+        if exp_missing:
+            # the studies with missing files are checked in every run
+            self.assertEqual(cached, {})
+        else:
+            self.assertEqual(list(cached), [b'1'])
+
+        # the cached sizes are used as long as the files don't change and the
+        # studies that no longer exist are removed from the cache
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(
+                """SELECT md5(string_agg(
+                        artifact_id || ':' || filepath_id, ','
+                        ORDER BY artifact_id, filepath_id))
+                   FROM qiita.study_artifact
+                        JOIN qiita.artifact_filepath USING (artifact_id)
+                   WHERE study_id = 1""")
+            signature = qdb.sql_connection.TRN.execute_fetchlast()
+        r_client.hmset(cache_key, {
+            '1': dumps({'signature': signature,
+                        'sizes': {'fake': {'2000-01': 10}}}),
+            '1000000': dumps({'signature': 'gone', 'sizes': {}})})
+        obs_summary, obs_missing = qdb.meta_util._get_filepath_stats()
+        self.assertEqual(obs_summary, {'fake': {'2000-01': 10}})
+        self.assertEqual(obs_missing, [])
+        self.assertEqual(list(r_client.hgetall(cache_key)), [b'1'])
+
+        # a full run checks all the files again
+        obs_summary, obs_missing = qdb.meta_util._get_filepath_stats(
+            full=True)
+        self.assertEqual(obs_summary, exp_summary)
+        self.assertCountEqual(obs_missing, exp_missing)
+        r_client.delete(cache_key)
+
     def test_generate_biom_and_metadata_release(self):
         level = 'private'
         qdb.meta_util.generate_biom_and_metadata_release(level)
@@ -498,6 +549,58 @@ class MetaUtilTests(TestCase):
             'parent software']
         self.assertEqual(txt_obs, txt_exp)
 
+    def test_generate_biom_and_metadata_release_incremental(self):
+        level = 'private'
+        self._set_artifact_private()
+        portal = qiita_config.portal
+        working_dir = qiita_config.working_dir
+        members_dir = join(working_dir, 'releases',
+                           '%s-%s-members' % (portal, level))
+
+        def _release():
+            qdb.meta_util.generate_biom_and_metadata_release(level)
+            tgz = join(working_dir, r_client.get(
+                '%s:release:%s:filepath' % (portal, level)).decode('ascii'))
+            self.files_to_remove.append(tgz)
+            # the md5 computed while writing matches the one of the file
+            with open(tgz, 'rb') as f:
+                self.assertEqual(
+                    md5(f.read()).hexdigest(),
+                    r_client.get('%s:release:%s:md5sum' % (
+                        portal, level)).decode('ascii'))
+            with open(join(members_dir, 'manifest.json')) as f:
+                return load(f)
+
+        manifest = _release()
+        self.assertIn(
+            'processed_data/1_study_1001_closed_reference_otu_table.biom',
+            manifest)
+        mtimes = {k: getmtime(join(members_dir, v['member']))
+                  for k, v in manifest.items()}
+
+        # the files didn't change, so their compressed members are reused
+        self.assertEqual(_release(), manifest)
+        self.assertEqual(
+            {k: getmtime(join(members_dir, v['member']))
+             for k, v in manifest.items()}, mtimes)
+
+        # unless the incremental mode is disabled
+        sleep(0.01)
+        qdb.meta_util.generate_biom_and_metadata_release(
+            level, incremental=False)
+        for k, v in manifest.items():
+            self.assertNotEqual(getmtime(join(members_dir, v['member'])),
+                                mtimes[k])
+        rmtree(members_dir)
+
+    def test_get_prep_categories(self):
+        self.assertEqual(qdb.meta_util._get_prep_categories([], []), {})
+        obs = qdb.meta_util._get_prep_categories(
+            [1], ['platform', 'target_gene', 'not_a_category'])
+        exp = {'platform': 'Illumina', 'target_gene': '16S rRNA',
+               'not_a_category': ''}
+        self.assertEqual(obs, {1: exp})
+
     def test_generate_plugin_releases(self):
         qdb.meta_util.generate_plugin_releases()
 
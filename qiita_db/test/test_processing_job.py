@@ -8,10 +8,12 @@
 
 from unittest import TestCase, main
 from datetime import datetime
-from os import close
+from os import close, remove, environ
+from os.path import join, dirname, abspath
 from tempfile import mkstemp
 from json import dumps, loads
-from time import sleep
+from threading import Thread
+from time import sleep, time
 
 import networkx as nx
 import pandas as pd
@@ -240,6 +242,81 @@ class ProcessingJobTest(TestCase):
         self.assertEqual(obs.step, None)
         self.assertTrue(obs in qdb.artifact.Artifact(1).jobs())
 
+    def test_by_ext_ids(self):
+        PJ = qdb.processing_job.ProcessingJob
+        self.assertEqual(PJ.by_ext_ids([]), {})
+        job1 = _create_job()
+        job1._set_ext_id('1001.torque.server')
+        job2 = _create_job()
+        job2._set_ext_id('1002.torque.server')
+        obs = PJ.by_ext_ids(
+            ['1001.torque.server', '1002.torque.server', '1001.torque.server',
+             'unknown.torque.server'])
+        self.assertEqual(obs, {'1001.torque.server': job1.id,
+                               '1002.torque.server': job2.id})
+        job2._set_status('queued')
+        obs = PJ.by_ext_ids(['1001.torque.server', '1002.torque.server'],
+                            status=['queued', 'running'])
+        self.assertEqual(obs, {'1002.torque.server': job2.id})
+
+    def test_set_running(self):
+        job1 = _create_job()
+        job1._set_status('queued')
+        job2 = _create_job()
+        job2._set_status('error')
+        job3 = _create_job()
+        job3._set_status('queued')
+        qdb.processing_job.ProcessingJob._set_running([job1.id, job2.id])
+        self.assertEqual(job1.status, 'running')
+        # only the queued jobs are updated
+        self.assertEqual(job2.status, 'error')
+        self.assertEqual(job3.status, 'queued')
+
+    def test_update_jobs_from_watcher(self):
+        job1 = _create_job()
+        job1._set_status('queued')
+        job1._set_ext_id('1003.torque.server')
+        job2 = _create_job()
+        job2._set_status('queued')
+        job2._set_ext_id('1004.torque.server')
+        qdb.processing_job.update_jobs_from_watcher([
+            {'Job_Id': '1003.torque.server', 'job_state': 'running'},
+            {'Job_Id': '1004.torque.server', 'job_state': 'queued'},
+            # jobs unknown to Qiita are ignored
+            {'Job_Id': 'unknown.torque.server', 'job_state': 'completed',
+             'exit_status': '0'}])
+        self.assertEqual(job1.status, 'running')
+        self.assertEqual(job2.status, 'queued')
+
+        qdb.processing_job.update_jobs_from_watcher([
+            {'Job_Id': '1003.torque.server', 'job_state': 'completed',
+             'exit_status': '1', 'error_msg': 'Job failed'},
+            {'Job_Id': '1004.torque.server', 'job_state': 'DROPPED'}])
+        self.assertEqual(job1.status, 'error')
+        self.assertEqual(job1.log.msg, 'Job failed')
+        self.assertEqual(job2.status, 'error')
+
+        # the jobs that already finished in Qiita are not updated again
+        qdb.processing_job.update_jobs_from_watcher([
+            {'Job_Id': '1003.torque.server', 'job_state': 'completed',
+             'exit_status': '0'}])
+        self.assertEqual(job1.status, 'error')
+        self.assertEqual(job1.log.msg, 'Job failed')
+
+        # an error updating a job doesn't prevent updating the others
+        job3 = _create_job()
+        job3._set_status('running')
+        job3._set_ext_id('1005.torque.server')
+        job4 = _create_job()
+        job4._set_status('running')
+        job4._set_ext_id('1006.torque.server')
+        qdb.processing_job.update_jobs_from_watcher([
+            # a completed job must have an exit_status
+            {'Job_Id': '1005.torque.server', 'job_state': 'completed'},
+            {'Job_Id': '1006.torque.server', 'job_state': 'DROPPED'}])
+        self.assertEqual(job3.status, 'running')
+        self.assertEqual(job4.status, 'error')
+
     def test_set_status(self):
         job = _create_job()
         self.assertEqual(job.status, 'in_construction')
@@ -555,6 +632,70 @@ class ProcessingJobTest(TestCase):
             job.log.msg, '1 validator jobs failed: Validator %s '
                          'error message: Validation failure' % obs.id)
 
+    def _create_validator(self, job):
+        params = qdb.software.Parameters.load(
+            qdb.software.Command(4),
+            values_dict={'template': 1, 'files': 'ignored',
+                         'artifact_type': 'BIOM',
+                         'provenance': dumps({'job': job.id,
+                                              'cmd_out_id': 3})})
+        return qdb.processing_job.ProcessingJob.create(
+            qdb.user.User('test@foo.bar'), params, True)
+
+    def test_wait_for_validators(self):
+        job = _create_job()
+        job._set_status('running')
+        obs1 = self._create_validator(job)
+        obs2 = self._create_validator(job)
+        job._set_validator_jobs([obs1, obs2])
+        obs1._set_status('waiting')
+        obs2._set_status('running')
+
+        # the timeout expires as obs2 is still running
+        obs = job.wait_for_validators(timeout=0.1)
+        self.assertEqual(obs, {obs1.id: 'waiting', obs2.id: 'running'})
+        self.assertEqual(job.step, 'Validating outputs (1 remaining) via '
+                                   'job(s) %s' % obs2.id)
+
+        # the validator completes in a different thread (i.e. a different
+        # transaction) and its notification ends the wait
+        def complete():
+            sleep(0.5)
+            obs2._set_status('waiting')
+
+        thread = Thread(target=complete)
+        thread.start()
+        start = time()
+        obs = job.wait_for_validators(timeout=30)
+        thread.join()
+        self.assertEqual(obs, {obs1.id: 'waiting', obs2.id: 'waiting'})
+        self.assertLess(time() - start, 30)
+
+    def test_wait_for_validators_fail_fast(self):
+        job = _create_job()
+        job._set_status('running')
+        obs1 = self._create_validator(job)
+        obs2 = self._create_validator(job)
+        obs3 = self._create_validator(job)
+        job._set_validator_jobs([obs1, obs2, obs3])
+        obs1.complete(False, error="Validation failure")
+        obs2._set_status('running')
+        obs3._set_status('queued')
+
+        # there is no need to wait for obs2 as the job has already failed
+        self.assertEqual(
+            job.wait_for_validators(),
+            {obs1.id: 'error', obs2.id: 'running', obs3.id: 'queued'})
+        job.release_validators()
+        self.assertEqual(job.status, 'error')
+        # the validators that are not running are failed, the running ones
+        # are left to complete
+        self.assertEqual(obs2.status, 'running')
+        self.assertEqual(obs3.status, 'error')
+        self.assertEqual(
+            obs3.log.msg, '1 sister validator jobs failed: Validator %s '
+                          'error message: Validation failure' % obs1.id)
+
     def test_complete_error(self):
         with self.assertRaises(
                 qdb.exceptions.QiitaDBOperationNotPermittedError):
@@ -1002,6 +1143,137 @@ class ProcessingWorkflowTests(TestCase):
             tester.remove(element[0])
 
 
+QSTAT_XML = """<Data>
+<Job><Job_Id>1.torque</Job_Id><Job_Name>job1</Job_Name>
+<Job_Owner>qiita@host</Job_Owner><job_state>R</job_state></Job>
+<Job><Job_Id>2.torque</Job_Id><Job_Name>job2</Job_Name>
+<Job_Owner>qiita@host</Job_Owner><job_state>C</job_state>
+<depend>beforeok:3.torque@host</depend><exit_status>1</exit_status></Job>
+<Job><Job_Id>3.torque</Job_Id><Job_Name>job3</Job_Name>
+<Job_Owner>qiita@host</Job_Owner><job_state>H</job_state></Job>
+<Job><Job_Id>4.torque</Job_Id><Job_Name>job4</Job_Name>
+<Job_Owner>other@host</Job_Owner><job_state>R</job_state></Job>
+</Data>"""
+
+
+class StatusSource(object):
+    """Status source that returns the given status of the jobs"""
+    def __init__(self, batches):
+        self.batches = batches
+
+    def is_available(self):
+        return True
+
+    def poll(self):
+        return self.batches.pop(0) if self.batches else None
+
+    def wait(self, timeout):
+        return self.batches.pop(0) if self.batches else []
+
+
+class WatcherTests(TestCase):
+    def setUp(self):
+        self.qstat = 'python %s' % join(
+            dirname(abspath(__file__)), 'support_files', 'fake_qstat.py')
+        fd, self.xml_fp = mkstemp(suffix='.xml')
+        close(fd)
+        environ['FAKE_QSTAT_XML'] = self.xml_fp
+
+    def tearDown(self):
+        environ.pop('FAKE_QSTAT_XML', None)
+        remove(self.xml_fp)
+
+    def _get_batches(self, watcher, n):
+        return [watcher.queue.get(True, 5) for _ in range(n)]
+
+    def test_qstat_status_source(self):
+        source = qdb.processing_job.QstatStatusSource(
+            'qiita@host', command=self.qstat)
+        with open(self.xml_fp, 'w') as f:
+            f.write(QSTAT_XML)
+        self.assertTrue(source.is_available())
+        exp = [{'Job_Id': '1.torque', 'Job_Name': 'job1', 'job_state': 'R'},
+               {'Job_Id': '2.torque', 'Job_Name': 'job2', 'job_state': 'C',
+                'depend': 'beforeok:3.torque@host', 'exit_status': '1'},
+               {'Job_Id': '3.torque', 'Job_Name': 'job3', 'job_state': 'H'}]
+        self.assertEqual(source.poll(), exp)
+
+        # qstat doesn't output anything if there are no jobs
+        with open(self.xml_fp, 'w') as f:
+            f.write('')
+        self.assertEqual(source.poll(), [])
+
+        # qstat can't connect to the server
+        remove(self.xml_fp)
+        self.assertFalse(source.is_available())
+        self.assertIsNone(source.poll())
+        open(self.xml_fp, 'w').close()
+
+    def test_qstat_status_source_missing_element(self):
+        source = qdb.processing_job.QstatStatusSource(
+            'qiita@host', command=self.qstat)
+        with open(self.xml_fp, 'w') as f:
+            f.write('<Data><Job><Job_Id>1.torque</Job_Id>'
+                    '<Job_Owner>qiita@host</Job_Owner></Job></Data>')
+        with self.assertRaisesRegex(AssertionError, 'Job_Name, job_state'):
+            source.poll()
+
+    def test_update(self):
+        watcher = qdb.processing_job.Watcher(
+            poll_source=StatusSource([]), callback_source=StatusSource([]))
+        watcher._update([
+            {'Job_Id': '1.torque', 'Job_Name': 'job1', 'job_state': 'Q'},
+            {'Job_Id': '3.torque', 'Job_Name': 'job3', 'job_state': 'H'},
+            {'Job_Id': '2.torque', 'Job_Name': 'job2', 'job_state': 'R',
+             'depend': 'beforeok:3.torque@host'}])
+        # nothing changed
+        watcher._update([
+            {'Job_Id': '1.torque', 'Job_Name': 'job1', 'job_state': 'Q'}])
+        # the epilogue reports that job2 failed; the dependent job3 is dropped
+        watcher._update([
+            {'Job_Id': '2.torque', 'Job_Name': 'job2', 'job_state': 'C',
+             'exit_status': '1'}])
+        # qstat reports the same completion, so it is not reported again
+        watcher._update([
+            {'Job_Id': '2.torque', 'Job_Name': 'job2', 'job_state': 'C',
+             'depend': 'beforeok:3.torque@host', 'exit_status': '1'}])
+        # a job that completed is never downgraded nor reported again
+        watcher._update([
+            {'Job_Id': '2.torque', 'Job_Name': 'job2', 'job_state': 'E'},
+            {'Job_Id': '3.torque', 'Job_Name': 'job3', 'job_state': 'H'}])
+        self.assertEqual(watcher.processes['2.torque']['job_state'],
+                         'completed')
+        self.assertEqual(watcher.processes['3.torque']['job_state'],
+                         'DROPPED')
+
+        obs = self._get_batches(watcher, 2)
+        self.assertTrue(watcher.queue.empty())
+        self.assertEqual([j['Job_Id'] for j in obs[0]],
+                         ['1.torque', '3.torque', '2.torque'])
+        self.assertEqual(
+            [(j['Job_Id'], j['job_state']) for j in obs[1]],
+            [('2.torque', 'completed'), ('3.torque', 'DROPPED')])
+        self.assertEqual(obs[1][0]['depend'], 'beforeok:3.torque@host')
+
+    def test_run(self):
+        poll = StatusSource([
+            [{'Job_Id': '1.torque', 'Job_Name': 'job1', 'job_state': 'R'}]])
+        callback = StatusSource([
+            [{'Job_Id': '1.torque', 'Job_Name': 'job1', 'job_state': 'C',
+              'exit_status': '0'}]])
+        watcher = qdb.processing_job.Watcher(
+            poll_source=poll, callback_source=callback)
+        watcher.polling_value = 0
+        # the loop ends once the poll source fails
+        watcher.run()
+        self.assertTrue(watcher.event.is_set())
+        obs = self._get_batches(watcher, 3)
+        self.assertEqual(obs[-1], 'QUIT')
+        self.assertEqual([(j['job_state'], j.get('exit_status'))
+                          for j in obs[0] + obs[1]],
+                         [('running', None), ('completed', '0')])
+
+
 @qiita_test_checker()
 class ProcessingJobDuplicated(TestCase):
     def test_create_duplicated(self):
@@ -255,6 +255,23 @@ class TestSQL(TestCase):
         for e, o in zip(exp, obs):
             self.assertEqual(e[1:], o[1:])
 
+    def test_artifact_descendant_jobs(self):
+        """Test SQL function artifact_descendant_jobs"""
+        sql = """SELECT processing_job_status, input_ids, output_ids
+                 FROM qiita.artifact_descendant_jobs(1)"""
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(sql)
+            obs = qdb.sql_connection.TRN.execute_fetchindex()
+
+        # all the artifacts generated from the artifact 1 are returned as the
+        # output of one of the jobs
+        self.assertEqual(
+            sorted(a_id for _, _, outputs in obs for a_id in outputs),
+            [2, 3, 4, 5, 6])
+        self.assertIn([1], [o[1] for o in obs])
+        self.assertEqual(
+            set(o[0] for o in obs if o[2]), {'success'})
+
 
 if __name__ == '__main__':
     main()
@@ -6,10 +6,12 @@
 # The full license is in the file LICENSE, distributed with this software.
 # -----------------------------------------------------------------------------
 
+import gc
 from unittest import TestCase, main
 from os import remove, close
 from os.path import exists
 from tempfile import mkstemp
+from threading import Thread
 
 from psycopg2._psycopg import connection
 from psycopg2 import connect
@@ -82,8 +84,8 @@ class TestTransaction(TestBase):
         self.assertEqual(obs._connection, None)
         self.assertEqual(obs._contexts_entered, 0)
         with obs:
-            pass
-        self.assertTrue(isinstance(obs._connection, connection))
+            self.assertTrue(isinstance(obs._connection, connection))
+        self.assertIsNone(obs._connection)
 
     def test_add(self):
         with qdb.sql_connection.TRN:
@@ -195,6 +197,54 @@ class TestTransaction(TestBase):
                     ['insert2', False, 2]]]  # Third result select
             self.assertEqual(obs, exp)
 
+    def test_execute_batch(self):
+        trn = qdb.sql_connection.Transaction(page_size=2)
+        with trn:
+            sql = """INSERT INTO qiita.test_table (str_column, int_column)
+                     VALUES (%s, %s)"""
+            args = [['insert1', 1], ['insert2', 2], ['insert3', 3]]
+            trn.add(sql, args, many=True)
+            sql = """UPDATE qiita.test_table SET bool_column = %s
+                     WHERE str_column = %s"""
+            trn.add(sql, [[False, 'insert1'], [False, 'insert3']], many=True)
+            trn.add("SELECT int_column FROM qiita.test_table "
+                    "WHERE bool_column = %s ORDER BY int_column", [False])
+            obs = trn.execute()
+            self.assertEqual(obs, [None, None, None, None, None, [[1], [3]]])
+            # 3 INSERTs in 2 pages, 2 UPDATEs in 1 page and the SELECT
+            self.assertEqual(trn.statements_executed, 6)
+            self.assertEqual(trn.round_trips, 4)
+            self.assertEqual(trn.round_trips_saved, 2)
+        self._assert_sql_equal([('insert2', True, 2), ('insert1', False, 1),
+                                ('insert3', False, 3)])
+        trn.close()
+
+    def test_execute_batch_error(self):
+        with qdb.sql_connection.TRN:
+            sql = "INSERT INTO qiita.test_table (int_column) VALUES (%s)"
+            qdb.sql_connection.TRN.add(sql, [[1], ['not an int']], many=True)
+            with self.assertRaises(ValueError):
+                qdb.sql_connection.TRN.execute()
+        self._assert_sql_equal([])
+
+    def test_split_insert_values(self):
+        obs = qdb.sql_connection._split_insert_values(
+            "INSERT INTO qiita.t (a, b) VALUES (%s, lower(%s))")
+        self.assertEqual(
+            obs, ("INSERT INTO qiita.t (a, b) VALUES %s",
+                  "(%s, lower(%s))", False))
+        obs = qdb.sql_connection._split_insert_values(
+            "INSERT INTO qiita.t (a) VALUES (%s) RETURNING a_id")
+        self.assertEqual(
+            obs, ("INSERT INTO qiita.t (a) VALUES %s RETURNING a_id",
+                  "(%s)", True))
+        self.assertIsNone(qdb.sql_connection._split_insert_values(
+            "INSERT INTO qiita.t (a) VALUES (%s), (%s)"))
+        self.assertIsNone(qdb.sql_connection._split_insert_values(
+            "INSERT INTO qiita.t (a) VALUES (%s) ON CONFLICT DO NOTHING"))
+        self.assertIsNone(qdb.sql_connection._split_insert_values(
+            "UPDATE qiita.t SET a = %s"))
+
     def test_execute_huge_transaction(self):
         with qdb.sql_connection.TRN:
             # Add a lot of inserts to the transaction
@@ -325,6 +375,71 @@ class TestTransaction(TestBase):
             obs = qdb.sql_connection.TRN.execute_fetchflatten(idx=3)
             self.assertEqual(obs, ['insert1', 1, 'insert2', 2, 'insert3', 3])
 
+    def test_execute_stream(self):
+        self._populate_test_table()
+        with qdb.sql_connection.TRN:
+            sql = """INSERT INTO qiita.test_table (str_column, int_column)
+                     VALUES (%s, %s)"""
+            qdb.sql_connection.TRN.add(sql, ['test5', 5])
+            qdb.sql_connection.TRN.add(
+                "SELECT int_column FROM qiita.test_table ORDER BY int_column")
+            obs = list(qdb.sql_connection.TRN.execute_stream(chunk_size=2))
+            self.assertEqual(obs, [[[1], [2]], [[3], [4]], [[5]]])
+            self.assertEqual(qdb.sql_connection.TRN.index, 2)
+
+    def test_execute_stream_error(self):
+        with qdb.sql_connection.TRN:
+            with self.assertRaises(ValueError):
+                qdb.sql_connection.TRN.execute_stream()
+
+            qdb.sql_connection.TRN.add("SELECT * FROM qiita.does_not_exist")
+            with self.assertRaises(ValueError):
+                list(qdb.sql_connection.TRN.execute_stream())
+
+        with self.assertRaises(RuntimeError):
+            qdb.sql_connection.TRN.execute_stream()
+
+    def test_copy_from(self):
+        self._populate_test_table()
+        with qdb.sql_connection.TRN:
+            sql = """INSERT INTO qiita.test_table (str_column, int_column)
+                     VALUES (%s, %s)"""
+            qdb.sql_connection.TRN.add(sql, ['test5', 5])
+            rows = (('copy\t%d\\\n' % i, i) for i in range(6, 8))
+            obs = qdb.sql_connection.TRN.copy_from(
+                'qiita.test_table', ['str_column', 'int_column'], rows)
+            self.assertEqual(obs, 2)
+            # the queued queries were executed before the copy
+            self.assertEqual(qdb.sql_connection.TRN._queries, [])
+
+        self._assert_sql_equal([
+            ('test1', True, 1), ('test2', True, 2), ('test3', False, 3),
+            ('test4', False, 4), ('test5', True, 5),
+            ('copy\t6\\\n', True, 6), ('copy\t7\\\n', True, 7)])
+
+    def test_copy_from_error(self):
+        with qdb.sql_connection.TRN:
+            with self.assertRaises(ValueError):
+                qdb.sql_connection.TRN.copy_from(
+                    'qiita.test_table', ['str_column', 'int_column'],
+                    [('test1', 'not an int')])
+
+        with self.assertRaises(RuntimeError):
+            qdb.sql_connection.TRN.copy_from(
+                'qiita.test_table', ['int_column'], [(1, )])
+
+    def test_copy_reader(self):
+        reader = qdb.sql_connection._CopyReader(
+            [('a\tb', None, 1), ('c\\d', 'e\r\nf', 2)])
+        exp = 'a\\tb\t\\N\t1\nc\\\\d\te\\r\\nf\t2\n'
+        # reading in small pieces returns the same as reading it all
+        obs = ''.join(iter(lambda: reader.read(3), ''))
+        self.assertEqual(obs, exp)
+        self.assertEqual(reader.rows_read, 2)
+        reader = qdb.sql_connection._CopyReader([('a', 'b')])
+        self.assertEqual(reader.read(), 'a\tb\n')
+        self.assertEqual(reader.read(), '')
+
     def test_context_manager_rollback(self):
         try:
             with qdb.sql_connection.TRN:
@@ -338,9 +453,8 @@ class TestTransaction(TestBase):
         except ValueError:
             pass
         self._assert_sql_equal([])
-        self.assertEqual(
-            qdb.sql_connection.TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        # the connection went back to the pool
+        self.assertIsNone(qdb.sql_connection.TRN._connection)
 
     def test_context_manager_execute(self):
         with qdb.sql_connection.TRN:
@@ -352,9 +466,8 @@ class TestTransaction(TestBase):
 
         self._assert_sql_equal([('insert1', True, 1), ('insert2', True, 2),
                                 ('insert3', True, 3)])
-        self.assertEqual(
-            qdb.sql_connection.TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        # the connection went back to the pool
+        self.assertIsNone(qdb.sql_connection.TRN._connection)
 
     def test_context_manager_no_commit(self):
         with qdb.sql_connection.TRN:
@@ -368,9 +481,8 @@ class TestTransaction(TestBase):
 
         self._assert_sql_equal([('insert1', True, 1), ('insert2', True, 2),
                                 ('insert3', True, 3)])
-        self.assertEqual(
-            qdb.sql_connection.TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        # the connection went back to the pool
+        self.assertIsNone(qdb.sql_connection.TRN._connection)
 
     def test_context_manager_multiple(self):
         self.assertEqual(qdb.sql_connection.TRN._contexts_entered, 0)
@@ -398,9 +510,8 @@ class TestTransaction(TestBase):
         self.assertEqual(qdb.sql_connection.TRN._contexts_entered, 0)
         self._assert_sql_equal([('insert1', True, 1), ('insert2', True, 2),
                                 ('insert3', True, 3)])
-        self.assertEqual(
-            qdb.sql_connection.TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        # the connection went back to the pool
+        self.assertIsNone(qdb.sql_connection.TRN._connection)
 
     def test_context_manager_multiple_2(self):
         self.assertEqual(qdb.sql_connection.TRN._contexts_entered, 0)
@@ -428,9 +539,8 @@ class TestTransaction(TestBase):
         self.assertEqual(qdb.sql_connection.TRN._contexts_entered, 0)
         self._assert_sql_equal([('insert1', True, 1), ('insert2', True, 2),
                                 ('insert3', True, 3)])
-        self.assertEqual(
-            qdb.sql_connection.TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        # the connection went back to the pool
+        self.assertIsNone(qdb.sql_connection.TRN._connection)
 
     def test_post_commit_funcs(self):
         fd, fp = mkstemp()
@@ -522,5 +632,194 @@ class TestTransaction(TestBase):
         self.assertEqual(qdb.sql_connection.TRN.index, 0)
 
 
+class TestConnectionPool(TestBase):
+    def test_init_error(self):
+        with self.assertRaises(ValueError):
+            qdb.sql_connection.ConnectionPool(0)
+
+    def test_getconn_putconn(self):
+        pool = qdb.sql_connection.ConnectionPool(2)
+        conn = pool.getconn()
+        self.assertTrue(isinstance(conn, connection))
+        self.assertEqual(pool.size, 1)
+        pool.putconn(conn)
+        self.assertEqual(pool.size, 1)
+        # the idle connection is reused
+        self.assertIs(pool.getconn(), conn)
+        pool.putconn(conn)
+        pool.closeall()
+        self.assertEqual(pool.size, 0)
+
+    def test_putconn_close(self):
+        pool = qdb.sql_connection.ConnectionPool(2)
+        conn = pool.getconn()
+        pool.putconn(conn, close=True)
+        self.assertNotEqual(conn.closed, 0)
+        self.assertEqual(pool.size, 0)
+
+    def test_putconn_rollback(self):
+        pool = qdb.sql_connection.ConnectionPool(1)
+        conn = pool.getconn()
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO qiita.test_table (int_column) VALUES (1)")
+        pool.putconn(conn)
+        self.assertEqual(conn.get_transaction_status(),
+                         TRANSACTION_STATUS_IDLE)
+        self._assert_sql_equal([])
+        pool.closeall()
+
+    def test_getconn_exhausted(self):
+        pool = qdb.sql_connection.ConnectionPool(1, timeout=0.1)
+        conn = pool.getconn()
+        with self.assertRaises(RuntimeError):
+            pool.getconn()
+        pool.putconn(conn)
+        pool.closeall()
+
+    def test_getconn_reconnect(self):
+        pool = qdb.sql_connection.ConnectionPool(1, check_after=0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        # simulate postgres dropping the idle connection
+        conn.close()
+        obs = pool.getconn()
+        self.assertIsNot(obs, conn)
+        self.assertEqual(obs.closed, 0)
+        pool.putconn(obs)
+        pool.closeall()
+
+    def test_transaction_reconnect(self):
+        pool = qdb.sql_connection.ConnectionPool(1)
+        trn = qdb.sql_connection.Transaction(pool=pool)
+        with trn:
+            trn.add("SELECT 42")
+            trn.execute()
+            old_conn = trn._connection
+        # the connection is idle in the pool, and it is dropped
+        old_conn.close()
+        with trn:
+            trn.add("SELECT 42")
+            self.assertEqual(trn.execute_fetchlast(), 42)
+            self.assertIsNot(trn._connection, old_conn)
+        pool.closeall()
+
+    def test_transaction_release(self):
+        pool = qdb.sql_connection.ConnectionPool(1)
+        trn = qdb.sql_connection.Transaction(pool=pool)
+        with trn:
+            trn.add("SELECT 42")
+            with self.assertRaises(RuntimeError):
+                trn.release()
+        # the connection was already released when leaving the context
+        self.assertIsNone(trn._connection)
+        trn.release()
+        self.assertEqual(pool.size, 1)
+        pool.closeall()
+
+    def test_transaction_release_on_exit(self):
+        pool = qdb.sql_connection.ConnectionPool(1, timeout=0.1)
+        trns = [qdb.sql_connection.Transaction(pool=pool) for _ in range(3)]
+        # the pool has a single connection, which is shared by all the
+        # transactions as they give it back when leaving the context
+        for i, trn in enumerate(trns):
+            with trn:
+                trn.add("SELECT %s", [i])
+                self.assertEqual(trn.execute_fetchlast(), i)
+            self.assertIsNone(trn._connection)
+        self.assertEqual(pool.size, 1)
+
+        # even if the transaction fails
+        with self.assertRaises(ValueError):
+            with trns[0]:
+                trns[0].add("SELECT 42")
+                raise ValueError('Force exiting the context manager')
+        self.assertIsNone(trns[0]._connection)
+        self.assertEqual(pool.size, 1)
+        pool.closeall()
+
+
+class TestListener(TestBase):
+    def test_wait(self):
+        pool = qdb.sql_connection.ConnectionPool(2)
+        with qdb.sql_connection.Listener(['test_channel'],
+                                         pool=pool) as listener:
+            self.assertEqual(listener.wait(0.1), [])
+            trn = qdb.sql_connection.Transaction(pool=pool)
+            with trn:
+                trn.add("NOTIFY test_channel, 'first'")
+                trn.add("NOTIFY other_channel, 'other'")
+                trn.add("NOTIFY test_channel, 'second'")
+                trn.execute()
+                # the notifications are only delivered on commit
+                self.assertEqual(listener.wait(0.1), [])
+            self.assertEqual(listener.wait(5), [('test_channel', 'first'),
+                                                ('test_channel', 'second')])
+            trn.close()
+        # the connection is back in the pool and no longer listening
+        self.assertEqual(pool.size, 1)
+        conn = pool.getconn()
+        self.assertFalse(conn.autocommit)
+        pool.putconn(conn)
+        pool.closeall()
+
+
+class TestTransactionProxy(TestBase):
+    def test_thread_local(self):
+        obs = {}
+
+        def worker(i):
+            with qdb.sql_connection.TRN:
+                qdb.sql_connection.TRN.add("SELECT %s", [i])
+                obs[i] = (qdb.sql_connection.TRN.transaction,
+                          qdb.sql_connection.TRN.execute_fetchlast())
+            qdb.sql_connection.TRN.release()
+
+        threads = [Thread(target=worker, args=(i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual({i: v[1] for i, v in obs.items()},
+                         {0: 0, 1: 1, 2: 2})
+        trns = [v[0] for v in obs.values()]
+        trns.append(qdb.sql_connection.TRN.transaction)
+        self.assertEqual(len(set(map(id, trns))), 4)
+
+    def test_setattr(self):
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add("SELECT 42")
+            qdb.sql_connection.TRN._queries = []
+            self.assertEqual(
+                qdb.sql_connection.TRN.transaction._queries, [])
+
+    def test_create_new_transaction(self):
+        old = qdb.sql_connection.TRN.transaction
+        old._open_connection()
+        qdb.sql_connection.create_new_transaction()
+        self.assertIsNot(qdb.sql_connection.TRN.transaction, old)
+        # the connection of the old transaction was given back
+        self.assertIsNone(old._connection)
+
+    def test_thread_exit(self):
+        pool = qdb.sql_connection.get_pool()
+        in_use = pool._in_use
+
+        def worker():
+            # leave the thread in the middle of a transaction
+            qdb.sql_connection.TRN.__enter__()
+            qdb.sql_connection.TRN.add("SELECT 42")
+            qdb.sql_connection.TRN.execute()
+
+        thread = Thread(target=worker)
+        thread.start()
+        thread.join()
+        del thread
+        gc.collect()
+        # the transaction of the thread has been garbage collected and its
+        # connection has been given back to the pool
+        self.assertEqual(pool._in_use, in_use)
+
+
 if __name__ == "__main__":
     main()
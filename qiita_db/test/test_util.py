@@ -13,9 +13,14 @@ from os.path import join, exists, basename
 from shutil import rmtree
 from datetime import datetime
 from functools import partial
+from binascii import crc32
+from mmap import ALLOCATIONGRANULARITY
 from string import punctuation
+from threading import Event, Thread
+from time import sleep
 import h5py
 from six import StringIO, BytesIO
+from mock import patch
 import pandas as pd
 
 from qiita_core.util import qiita_test_checker
@@ -244,6 +249,40 @@ class DBUtilTests(DBUtilTestsBase):
 
         qdb.util.purge_filepaths()
 
+    def test_insert_filepaths_checksums(self):
+        fd, fp = mkstemp()
+        close(fd)
+        with open(fp, "w") as f:
+            f.write("\n")
+        self.files_to_remove.append(fp)
+
+        # the provided checksum is stored as is
+        obs = qdb.util.insert_filepaths(
+            [(fp, 1)], 2, "raw_data", checksums=['852952723'])
+        exp_fp = join(qdb.util.get_db_files_base_dir(), "raw_data",
+                      "2_%s" % basename(fp))
+        self.files_to_remove.append(exp_fp)
+        fp_id = obs[0]
+        self.assertEqual(
+            qdb.util.get_filepath_information(fp_id)['checksum'], '852952723')
+
+        # and the files that do not match their checksum are reported, but
+        # the stored checksum is kept
+        self.assertEqual(
+            qdb.util.verify_checksums([(fp_id, exp_fp, 852952723)]), [])
+        with open(exp_fp, "w") as f:
+            f.write("corrupted\n")
+        self.assertEqual(
+            qdb.util.verify_checksums([(fp_id, exp_fp, 852952723)]), [fp_id])
+        self.assertEqual(
+            qdb.util.get_filepath_information(fp_id)['checksum'], '852952723')
+        log = qdb.logger.LogEntry.newest_records(1)[0]
+        self.assertEqual(log.msg, 'Checksum mismatch for %s' % exp_fp)
+        self.assertEqual(log.info[0]['filepath_id'], fp_id)
+        self.assertEqual(log.info[0]['provided'], 852952723)
+
+        qdb.util.purge_filepaths()
+
     def test_insert_filepaths_string(self):
         fd, fp = mkstemp()
         close(fd)
@@ -785,6 +824,31 @@ class UtilTests(TestCase):
         exp = 1719580229
         self.assertEqual(obs, exp)
 
+    def test_compute_checksums(self):
+        dirpath = mkdtemp()
+        with open(join(dirpath, 'a.txt'), 'w') as f:
+            f.write("Some text so we can actually compute a checksum")
+
+        obs, stats = qdb.util.compute_checksums([self.filepath, dirpath])
+        self.assertEqual(obs, [1719580229, 1719580229])
+        self.assertEqual(stats['bytes'], 96)
+
+        # files bigger than the piece size are checksummed in parallel
+        # pieces, and their checksums combined
+        piece_size = qdb.util.CHECKSUM_PIECE_SIZE
+        qdb.util.CHECKSUM_PIECE_SIZE = ALLOCATIONGRANULARITY
+        try:
+            fp = join(dirpath, 'b.txt')
+            with open(fp, 'wb') as f:
+                f.write(b'qiita' * ALLOCATIONGRANULARITY)
+            obs, _ = qdb.util.compute_checksums([fp, dirpath], workers=4)
+        finally:
+            qdb.util.CHECKSUM_PIECE_SIZE = piece_size
+        self.assertEqual(obs, qdb.util.compute_checksums(
+            [fp, dirpath], workers=1)[0])
+        self.assertEqual(obs[0], crc32(b'qiita' * ALLOCATIONGRANULARITY))
+        rmtree(dirpath)
+
     def test_scrub_data_nothing(self):
         """Returns the same string without changes"""
         self.assertEqual(qdb.util.scrub_data("nothing_changes"),
@@ -836,8 +900,11 @@ class UtilTests(TestCase):
         # test without changes
         self.assertDictEqual(
             STUDY_INFO, UTIL.generate_study_list(user, 'user')[0])
-        # change user's name to None and tests again
+        # change user's name to None and tests again; note that this change
+        # reaches the listing through the refresh in the background of the
+        # webserver
         user.info = {'name': None}
+        UTIL.refresh_study_listing()
         exp = STUDY_INFO.copy()
         exp['owner'] = 'test@foo.bar'
         self.assertDictEqual(
@@ -952,6 +1019,102 @@ class UtilTests(TestCase):
         PREP(1).artifact.visibility = 'private'
         PREP(2).artifact.visibility = 'private'
 
+    def test_refresh_study_listing(self):
+        sql = "SELECT study_id FROM qiita.study_listing_modified"
+        qdb.util.refresh_study_listing()
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(sql)
+            self.assertEqual(
+                qdb.sql_connection.TRN.execute_fetchflatten(), [])
+
+        # modifying the study marks it so its listing is recomputed
+        study = qdb.study.Study(1)
+        study.title = 'Modified title'
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(sql)
+            self.assertEqual(
+                qdb.sql_connection.TRN.execute_fetchflatten(), [1])
+
+        # the study list pages only read the listing
+        obs = qdb.util.generate_study_list(
+            qdb.user.User('test@foo.bar'), 'user')
+        self.assertEqual(obs[0]['study_title'], STUDY_INFO['study_title'])
+        qdb.util.refresh_study_listing()
+        obs = qdb.util.generate_study_list(
+            qdb.user.User('test@foo.bar'), 'user')
+        self.assertEqual(obs[0]['study_title'], 'Modified title')
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(sql)
+            self.assertEqual(
+                qdb.sql_connection.TRN.execute_fetchflatten(), [])
+
+        # the changes are notified once they are committed
+        with qdb.sql_connection.Listener(
+                [qdb.util.STUDY_LISTING_CHANNEL]) as listener:
+            study.title = STUDY_INFO['study_title']
+            self.assertEqual(listener.wait(5),
+                             [(qdb.util.STUDY_LISTING_CHANNEL, '')])
+        qdb.util.refresh_study_listing()
+        self.assertDictEqual(
+            STUDY_INFO, qdb.util.generate_study_list(
+                qdb.user.User('test@foo.bar'), 'user')[0])
+
+    def test_refresh_study_listing_after_commit(self):
+        sql = "SELECT study_id FROM qiita.study_listing_modified"
+        qdb.util.refresh_study_listing()
+        artifact = qdb.artifact.Artifact(4)
+        with qdb.sql_connection.TRN:
+            artifact.visibility = 'public'
+            qdb.sql_connection.TRN.add(sql)
+            self.assertEqual(
+                qdb.sql_connection.TRN.execute_fetchflatten(), [1])
+        # the listing is refreshed as soon as the change is committed
+        with qdb.sql_connection.TRN:
+            qdb.sql_connection.TRN.add(sql)
+            self.assertEqual(
+                qdb.sql_connection.TRN.execute_fetchflatten(), [])
+        obs = qdb.util.generate_study_list(
+            qdb.user.User('test@foo.bar'), 'user')
+        self.assertEqual(obs[0]['status'], 'public')
+
+        # nothing is refreshed if the transaction is rolled back
+        with patch('qiita_db.util.refresh_study_listing') as refresh:
+            with self.assertRaises(ValueError):
+                with qdb.sql_connection.TRN:
+                    artifact.visibility = 'private'
+                    raise ValueError()
+        refresh.assert_not_called()
+        artifact.visibility = 'private'
+
+    def test_refresh_study_listing_loop(self):
+        def _listed_title():
+            with qdb.sql_connection.TRN:
+                qdb.sql_connection.TRN.add(
+                    """SELECT study_title
+                       FROM qiita.study_listing
+                       WHERE study_id = 1""")
+                return qdb.sql_connection.TRN.execute_fetchlast()
+
+        stop = Event()
+        thread = Thread(target=qdb.util.refresh_study_listing_loop,
+                        args=(stop, 1))
+        thread.start()
+        try:
+            # the title is only refreshed by the loop
+            study = qdb.study.Study(1)
+            study.title = 'Modified title'
+            for _ in range(20):
+                if _listed_title() == 'Modified title':
+                    break
+                sleep(0.5)
+            self.assertEqual(_listed_title(), 'Modified title')
+        finally:
+            stop.set()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        study.title = STUDY_INFO['study_title']
+        qdb.util.refresh_study_listing()
+
     def test_generate_study_list_errors(self):
         with self.assertRaises(ValueError):
             qdb.util.generate_study_list(qdb.user.User('test@foo.bar'), 'bad')
@@ -1004,6 +1167,38 @@ class UtilTests(TestCase):
         # deleting the old study
         qdb.study.Study.delete(new_study.id)
 
+    def test_get_sample_prep_presence(self):
+        samples, preps, presence = qdb.util.get_sample_prep_presence(1)
+        self.assertEqual(len(samples), 27)
+        self.assertEqual(samples, sorted(samples))
+        PT = qdb.metadata_template.prep_template.PrepTemplate
+        self.assertEqual(preps, [
+            {'id': 1, 'name': 'Prep information 1', 'status': PT(1).status},
+            {'id': 2, 'name': 'Prep information 2', 'status': PT(2).status}])
+        # 27 samples, all of them in both preparations
+        self.assertEqual(presence, {1: b'\xff\xff\xff\xe0',
+                                    2: b'\xff\xff\xff\xe0'})
+
+        metadata_dict = {
+            sid: {'center_name': 'ANL',
+                  'primer': 'GTGCCAGCMGCCGCGGTAA',
+                  'barcode': 'GTCCGCAAGTTA',
+                  'run_prefix': "s_G1_L001_sequences",
+                  'platform': 'Illumina',
+                  'instrument_model': 'Illumina MiSeq',
+                  'library_construction_protocol': 'AAAA',
+                  'experiment_design_description': 'BBBB'}
+            for sid in ('SKB2.640194', 'SKM9.640192')}
+        metadata = pd.DataFrame.from_dict(
+            metadata_dict, orient='index', dtype=str)
+        pt = PT.create(metadata, qdb.study.Study(1), "16S")
+        samples, preps, presence = qdb.util.get_sample_prep_presence(1)
+        self.assertEqual(preps[-1], {'id': pt.id, 'name': pt.name,
+                                     'status': 'sandbox'})
+        # 1.SKB2.640194 is the 2nd sample and 1.SKM9.640192 the last one
+        self.assertEqual(presence[pt.id], b'\x40\x00\x00\x20')
+        PT.delete(pt.id)
+
     def test_get_artifacts_information(self):
         # we are going to test that it ignores 1 and 2 cause they are not biom,
         # 4 has all information and 7 and 8 don't
@@ -1119,6 +1314,17 @@ class UtilTests(TestCase):
                    WHERE parameter_name = 'reference'""")
             qdb.sql_connection.TRN.execute()
 
+    def test_get_prep_summaries(self):
+        qdb.metadata_template.cache.METADATA_CACHE.clear()
+        exp = {1: {'prep_samples': 27, 'platform': 'Illumina',
+                   'target_gene': '16S rRNA', 'target_subfragment': ('V4',)}}
+        self.assertEqual(qdb.util._get_prep_summaries([1]), exp)
+        # the second time the summary comes from the cache
+        self.assertEqual(qdb.util._get_prep_summaries([1]), exp)
+        self.assertEqual(
+            qdb.metadata_template.cache.METADATA_CACHE.stats['hits'], 1)
+        self.assertEqual(qdb.util._get_prep_summaries([]), {})
+
 
 class TestFilePathOpening(TestCase):
     """Tests adapted from scikit-bio's skbio.io.util tests"""
@@ -87,6 +87,32 @@ class User(qdb.base.QiitaObject):
             qdb.sql_connection.TRN.add(sql, [id_])
             return qdb.sql_connection.TRN.execute_fetchlast()
 
+    @classmethod
+    def _check_many(cls, ids):
+        r"""Checks the existence of several ids in a single query
+
+        Parameters
+        ----------
+        ids : list of str
+            The IDs to test
+
+        Returns
+        -------
+        dict of {str: bool}
+            The IDs present in the database, mapped to True
+
+        Notes
+        -----
+        This function overwrites the base function, as sql layout doesn't
+        follow the same conventions done in the other classes.
+        """
+        with qdb.sql_connection.TRN:
+            sql = """SELECT email, TRUE
+                     FROM qiita.qiita_user
+                     WHERE email IN %s"""
+            qdb.sql_connection.TRN.add(sql, [tuple(ids)])
+            return dict(qdb.sql_connection.TRN.execute_fetchindex())
+
     @classmethod
     def iter(cls):
         """Iterates over all users, sorted by their email addresses
@@ -17,6 +17,8 @@ Methods
     exists_table
     get_db_files_base_dir
     compute_checksum
+    compute_checksums
+    verify_checksums
     get_files_from_uploads_folders
     filepath_id_to_rel_path
     filepath_id_to_object_id
@@ -35,6 +37,7 @@ Methods
     get_pubmed_ids_from_dois
     generate_analysis_list
     human_merging_scheme
+    get_sample_prep_presence
 """
 # -----------------------------------------------------------------------------
 # Copyright (c) 2014--, The Qiita Development Team.
@@ -49,6 +52,10 @@ from future.builtins import zip
 from random import SystemRandom
 from string import ascii_letters, digits, punctuation
 from binascii import crc32
+from concurrent.futures import ThreadPoolExecutor
+from mmap import mmap, ACCESS_READ
+from multiprocessing import cpu_count
+from time import time
 from bcrypt import hashpw, gensalt
 from functools import partial
 from os.path import join, basename, isdir, exists, getsize
@@ -63,6 +70,7 @@ from itertools import chain
 from contextlib import contextmanager
 from future.builtins import bytes, str
 import h5py
+import numpy as np
 from humanize import naturalsize
 import hashlib
 from smtplib import SMTP, SMTP_SSL, SMTPException
@@ -80,6 +88,11 @@ with standard_library.hooks():
     from email.mime.text import MIMEText
 
 
+# the postgres channel where the changes in the study listing are notified;
+# see patch 80.sql
+STUDY_LISTING_CHANNEL = 'qiita_study_listing'
+
+
 def scrub_data(s):
     r"""Scrubs data fields of characters not allowed by PostgreSQL
 
@@ -408,6 +421,199 @@ def get_work_base_dir():
         return qdb.sql_connection.TRN.execute_fetchlast()
 
 
+def list_download_files(dirpath, basedir=None):
+    r"""Lists the files in the given directory as nginx needs to zip them
+
+    Parameters
+    ----------
+    dirpath : str
+        Path to the directory
+    basedir : str, optional
+        The base directory of all db files. Defaults to the one stored in the
+        database
+
+    Returns
+    -------
+    list of (str, str, str, str)
+        The path of each file in the directory, relative to `basedir` if it
+        is inside it, the path of the file in the zip (the same path), its
+        checksum ('-' as it is unknown) and its size
+    """
+    if basedir is None:
+        basedir = get_db_files_base_dir()
+    basedir_len = len(basedir) + 1
+    to_download = []
+    for dp, _, fps in walk(dirpath):
+        for fn in fps:
+            fullpath = join(dp, fn)
+            spath = fullpath
+            if fullpath.startswith(basedir):
+                spath = fullpath[basedir_len:]
+            to_download.append((spath, spath, '-', str(getsize(fullpath))))
+    return to_download
+
+
+# Size of the reads used to compute the file checksums
+CHECKSUM_BUFFER_SIZE = 8 * 1024 * 1024
+# Files larger than this are split into pieces of this size, which are
+# checksummed concurrently and combined afterwards. It must be a multiple of
+# mmap.ALLOCATIONGRANULARITY so the pieces can be memory mapped
+CHECKSUM_PIECE_SIZE = 256 * 1024 * 1024
+# Number of threads used to compute checksums. zlib releases the GIL while
+# computing the CRC of large buffers, so threads scale with the disk
+CHECKSUM_WORKERS = min(8, cpu_count() or 1)
+# Verifies the checksums provided by the plugins once their transaction
+# has been committed
+CHECKSUM_VERIFY_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+
+def _gf2_matrix_times(mat, vec):
+    """Multiplies a GF(2) 32x32 matrix by a vector"""
+    total = 0
+    for row in mat:
+        if not vec:
+            break
+        if vec & 1:
+            total ^= row
+        vec >>= 1
+    return total
+
+
+def _gf2_matrix_square(mat):
+    """Squares a GF(2) 32x32 matrix"""
+    return [_gf2_matrix_times(mat, row) for row in mat]
+
+
+# _CRC32_ZEROS[k] is the GF(2) operator that appends 2^k zero bytes to a CRC
+_CRC32_ZEROS = []
+
+
+def _crc32_combine(crc1, crc2, len2):
+    """Combines two CRC-32 checksums, as zlib's crc32_combine
+
+    Parameters
+    ----------
+    crc1 : int
+        The checksum of the first block of data
+    crc2 : int
+        The checksum of the second block of data
+    len2 : int
+        The length, in bytes, of the second block of data
+
+    Returns
+    -------
+    int
+        The checksum of the concatenation of both blocks
+    """
+    if not _CRC32_ZEROS:
+        # operator for one zero bit, squared three times: one zero byte
+        op = [0xEDB88320] + [1 << n for n in range(31)]
+        for _ in range(3):
+            op = _gf2_matrix_square(op)
+        zeros = [op]
+        for _ in range(63):
+            zeros.append(_gf2_matrix_square(zeros[-1]))
+        _CRC32_ZEROS[:] = zeros
+
+    # apply len2 zeros to crc1
+    k = 0
+    while len2 > 0:
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(_CRC32_ZEROS[k], crc1)
+        len2 >>= 1
+        k += 1
+
+    return (crc1 ^ crc2) & 0xFFFFFFFF
+
+
+def _checksum_piece(fp, offset, length):
+    """Computes the CRC-32 of `length` bytes of `fp` starting at `offset`"""
+    if length == 0:
+        return 0
+    crcvalue = 0
+    with open(fp, 'rb') as f:
+        with mmap(f.fileno(), length, access=ACCESS_READ,
+                  offset=offset) as data:
+            view = memoryview(data)
+            try:
+                for start in range(0, length, CHECKSUM_BUFFER_SIZE):
+                    crcvalue = crc32(
+                        view[start:start + CHECKSUM_BUFFER_SIZE], crcvalue)
+            finally:
+                view.release()
+    return crcvalue & 0xFFFFFFFF
+
+
+def compute_checksums(paths, workers=None):
+    r"""Returns the checksums of the files or directories pointed by paths
+
+    Large files are split in pieces and all the pieces of all the files are
+    checksummed concurrently using memory mapped reads. The checksum of a
+    directory is the checksum of the concatenation of all its files, in
+    `os.walk` order.
+
+    Parameters
+    ----------
+    paths : list of str
+        The paths to compute the checksum
+    workers : int, optional
+        The number of threads to use. Defaults to CHECKSUM_WORKERS
+
+    Returns
+    -------
+    list of int, dict
+        The checksum of each path, in the same order, and the statistics of
+        the computation: the number of bytes read, the elapsed seconds and
+        the throughput in Mb/s
+    """
+    start = time()
+    # pieces[i] holds the (filepath, offset, length) to checksum for paths[i]
+    pieces = []
+    for path in paths:
+        filepaths = []
+        if isdir(path):
+            for name, dirs, files in walk(path):
+                join_f = partial(join, name)
+                filepaths.extend(list(map(join_f, files)))
+        else:
+            filepaths.append(path)
+
+        path_pieces = []
+        for fp in filepaths:
+            size = getsize(fp)
+            path_pieces.extend(
+                (fp, offset, min(CHECKSUM_PIECE_SIZE, size - offset))
+                for offset in range(0, size, CHECKSUM_PIECE_SIZE))
+        pieces.append(path_pieces)
+
+    all_pieces = list(chain.from_iterable(pieces))
+    workers = workers or CHECKSUM_WORKERS
+    if len(all_pieces) > 1 and workers > 1:
+        with ThreadPoolExecutor(
+                max_workers=min(workers, len(all_pieces))) as executor:
+            crcs = iter(list(executor.map(
+                lambda p: _checksum_piece(*p), all_pieces)))
+    else:
+        crcs = (_checksum_piece(*p) for p in all_pieces)
+
+    checksums = []
+    total = 0
+    for path_pieces in pieces:
+        crcvalue = 0
+        for (_, _, length), piece_crc in zip(path_pieces, crcs):
+            crcvalue = _crc32_combine(crcvalue, piece_crc, length)
+            total += length
+        # We need the & 0xFFFFFFFF in order to get the same numeric value
+        # across all python versions and platforms
+        checksums.append(crcvalue & 0xFFFFFFFF)
+
+    elapsed = time() - start
+    stats = {'bytes': total, 'seconds': elapsed,
+             'throughput': (total / (1024 * 1024) / elapsed
+                            if elapsed else 0.0)}
+    return checksums, stats
+
+
 def compute_checksum(path):
     r"""Returns the checksum of the file pointed by path
 
@@ -421,25 +627,40 @@ def compute_checksum(path):
     int
         The file checksum
     """
-    filepaths = []
-    if isdir(path):
-        for name, dirs, files in walk(path):
-            join_f = partial(join, name)
-            filepaths.extend(list(map(join_f, files)))
-    else:
-        filepaths.append(path)
+    return compute_checksums([path])[0][0]
 
-    buffersize = 65536
-    crcvalue = 0
-    for fp in filepaths:
-        with open(fp, 'rb') as f:
-            buffr = f.read(buffersize)
-            while len(buffr) > 0:
-                crcvalue = crc32(buffr, crcvalue)
-                buffr = f.read(buffersize)
-    # We need the & 0xFFFFFFFF in order to get the same numeric value across
-    # all python versions and platforms
-    return crcvalue & 0xFFFFFFFF
+
+def verify_checksums(filepaths):
+    r"""Verifies the checksums stored for the given files
+
+    Parameters
+    ----------
+    filepaths : list of (int, str, int)
+        The filepath id, the full path and the stored checksum of each file
+
+    Returns
+    -------
+    list of int
+        The filepath ids whose stored checksum didn't match the file. The
+        mismatch is logged and the stored checksum is kept, as it is the
+        evidence that the file is corrupted
+    """
+    if not filepaths:
+        return []
+
+    observed, stats = compute_checksums([fp for _, fp, _ in filepaths])
+    mismatches = [(fp_id, fp, int(exp), obs)
+                  for (fp_id, fp, exp), obs in zip(filepaths, observed)
+                  if int(exp) != obs]
+    if mismatches:
+        with qdb.sql_connection.TRN:
+            for fp_id, fp, exp, obs in mismatches:
+                qdb.logger.LogEntry.create(
+                    'Runtime', 'Checksum mismatch for %s' % fp,
+                    info={'filepath_id': fp_id, 'provided': exp,
+                          'computed': obs,
+                          'throughput': stats['throughput']})
+    return [fp_id for fp_id, _, _, _ in mismatches]
 
 
 def get_files_from_uploads_folders(study_id):
@@ -569,7 +790,8 @@ def get_mountpoint_path_by_id(mount_id):
         return join(get_db_files_base_dir(), mountpoint)
 
 
-def insert_filepaths(filepaths, obj_id, table, move_files=True, copy=False):
+def insert_filepaths(filepaths, obj_id, table, move_files=True, copy=False,
+                     checksums=None):
     r"""Inserts `filepaths` in the database.
 
     Since the files live outside the database, the directory in which the files
@@ -591,6 +813,12 @@ def insert_filepaths(filepaths, obj_id, table, move_files=True, copy=False):
     copy : bool, optional
         If `move_files` is true, whether to actually move the files or just
         copy them
+    checksums : list of int, optional
+        The checksum of each filepath, as provided by the plugin that
+        generated them, None for the ones that should be computed. The
+        provided checksums are stored as is and verified once the transaction
+        has been committed, so big files are not read while the transaction
+        is open
 
     Returns
     -------
@@ -631,9 +859,18 @@ def insert_filepaths(filepaths, obj_id, table, move_files=True, copy=False):
         def str_to_id(x):
             return (x if isinstance(x, int)
                     else convert_to_id(x, "filepath_type"))
+        if checksums is None:
+            checksums = [None] * len(new_filepaths)
+        provided = [checksum is not None for checksum in checksums]
+        computed = iter(compute_checksums(
+            [path for (path, _), p in zip(new_filepaths, provided)
+             if not p])[0])
+        checksums = [int(checksum) if p else next(computed)
+                     for checksum, p in zip(checksums, provided)]
         # 1 is the checksum algorithm, which we only have one implemented
-        values = [[basename(path), str_to_id(id_), compute_checksum(path),
-                   getsize(path), 1, dd_id] for path, id_ in new_filepaths]
+        values = [[basename(path), str_to_id(id_), checksum, getsize(path),
+                   1, dd_id]
+                  for (path, id_), checksum in zip(new_filepaths, checksums)]
         # Insert all the filepaths at once and get the filepath_id back
         sql = """INSERT INTO qiita.filepath
                     (filepath, filepath_type_id, checksum, fp_size,
@@ -644,9 +881,18 @@ def insert_filepaths(filepaths, obj_id, table, move_files=True, copy=False):
         qdb.sql_connection.TRN.add(sql, values, many=True)
         # Since we added the query with many=True, we've added len(values)
         # queries to the transaction, so the ids are in the last idx queries
-        return list(chain.from_iterable(
+        fp_ids = list(chain.from_iterable(
             chain.from_iterable(qdb.sql_connection.TRN.execute()[idx:])))
 
+        to_verify = [(fp_id, path, checksum)
+                     for fp_id, (path, _), checksum, p
+                     in zip(fp_ids, new_filepaths, checksums, provided) if p]
+        if to_verify:
+            qdb.sql_connection.TRN.add_post_commit_func(
+                CHECKSUM_VERIFY_EXECUTOR.submit, verify_checksums, to_verify)
+
+        return fp_ids
+
 
 def _path_builder(db_dir, filepath, mountpoint, subdirectory, obj_id):
     """Builds the path of a DB stored file
@@ -1374,6 +1620,92 @@ def supported_filepath_types(artifact_type):
         return qdb.sql_connection.TRN.execute_fetchindex()
 
 
+def mark_study_listing_modified(study_ids):
+    """Adds to the current transaction the mark of the given studies, so
+    their listing is recomputed once the transaction is committed
+
+    Parameters
+    ----------
+    study_ids : iterable of int
+        The ids of the studies whose listing changed
+
+    Notes
+    -----
+    Most of the changes are marked by triggers in the database. The tables
+    that are bulk loaded (e.g. qiita.study_sample) don't have triggers, so
+    the code that modifies them marks the studies once instead of per row
+    """
+    qdb.sql_connection.TRN.add(
+        "SELECT qiita.mark_study_listing_modified(%s::bigint[])",
+        [list(study_ids)])
+    refresh_study_listing_after_commit()
+
+
+def refresh_study_listing_after_commit():
+    """Refreshes the study listing once the current transaction is committed
+
+    Notes
+    -----
+    The code that creates or deletes studies, preps and artifacts, or that
+    changes their visibility, calls this function so the study list pages
+    show the change as soon as it is committed, no matter which process
+    made it. The refresh is only added once per transaction.
+    """
+    key = ('refresh', 'study_listing')
+    if key not in qdb.sql_connection.TRN.identity_map:
+        qdb.sql_connection.TRN.identity_map[key] = True
+        qdb.sql_connection.TRN.add_post_commit_func(refresh_study_listing)
+
+
+def refresh_study_listing():
+    """Recomputes the listing of the studies modified since the last refresh
+
+    Notes
+    -----
+    The study list pages read from qiita.study_listing: any change in the
+    information shown in the listing marks the affected studies as modified,
+    and this function recomputes only those studies. The refresh runs in its
+    own transaction, so it can be executed after the commit of the
+    transaction that marked the studies.
+    """
+    with qdb.sql_connection.Transaction() as trn:
+        trn.add("SELECT qiita.refresh_study_listing()")
+        trn.execute()
+
+
+def refresh_study_listing_loop(stop, timeout=600):
+    """Refreshes the study listing every time that it is modified
+
+    Parameters
+    ----------
+    stop : threading.Event
+        The loop ends once this event is set
+    timeout : float, optional
+        The seconds to wait for a modification before refreshing the listing
+        anyway, in case that a notification is lost. Defaults to 600
+
+    Notes
+    -----
+    Marking studies notifies STUDY_LISTING_CHANNEL once the change is
+    committed. The master webserver runs this loop in a background thread,
+    so the changes that are not refreshed by the process that made them
+    (e.g. a study title changed or a study shared) reach the study list pages
+    as soon as the notification arrives, or at most `timeout` seconds later
+    if it is lost.
+    """
+    while not stop.is_set():
+        try:
+            with qdb.sql_connection.Listener(
+                    [STUDY_LISTING_CHANNEL]) as listener:
+                while not stop.is_set():
+                    refresh_study_listing()
+                    listener.wait(timeout)
+        except Exception as e:
+            # nothing should stop the refresh while the webserver is running
+            print("Error refreshing the study listing: %s" % str(e))
+            stop.wait(60)
+
+
 def generate_study_list(user, visibility):
     """Get general study information
 
@@ -1391,59 +1723,24 @@ def generate_study_list(user, visibility):
 
     Notes
     -----
-    The main select might look scary but it's pretty simple:
-    - We select the requiered fields from qiita.study and qiita.study_person
-        SELECT metadata_complete, study_abstract, study_id, study_alias,
-            study_title, ebi_study_accession,
-            qiita.study_person.name AS pi_name,
-            qiita.study_person.email AS pi_email,
-    - the total number of samples collected by counting sample_ids
-            (SELECT COUNT(sample_id) FROM qiita.study_sample
-                WHERE study_id=qiita.study.study_id)
-                AS number_samples_collected]
-    - retrieve all the prep data types for all the artifacts depending on their
-      visibility
-            (SELECT array_agg(DISTINCT data_type)
-             FROM qiita.study_prep_template
-             LEFT JOIN qiita.prep_template USING (prep_template_id)
-             LEFT JOIN qiita.data_type USING (data_type_id)
-             LEFT JOIN qiita.artifact USING (artifact_id)
-             LEFT JOIN qiita.visibility USING (visibility_id)
-             LEFT JOIN qiita.artifact_type USING (artifact_type_id)
-             WHERE {0} study_id = qiita.study.study_id)
-                 AS preparation_data_types,
+    The information is read from qiita.study_listing, which is refreshed in
+    the background after any change done to the studies, see
+    refresh_study_listing. The listing keeps, per study:
+    - the required fields from qiita.study and qiita.study_person
+    - the total number of samples collected, number_samples_collected
+    - all the prep data types of the study, preparation_data_types, and only
+      those with public artifacts, public_preparation_data_types
     - all the BIOM artifact_ids sorted by artifact_id that belong to the study,
-      including their software deprecated value and their prep info file data
-      type values
-            (SELECT array_agg(row_to_json(
-             (m_aid.artifact_id, qs.deprecated), true)
-                 ORDER BY artifact_id)
-             FROM qiita.study_artifact
-             LEFT JOIN qiita.artifact AS m_aid USING (artifact_id)
-             LEFT JOIN qiita.visibility USING (visibility_id)
-             LEFT JOIN qiita.artifact_type USING (artifact_type_id)
-             LEFT JOIN qiita.software_command USING (command_id)
-             LEFT JOIN qiita.software qs USING (software_id)
-             WHERE artifact_type='BIOM' AND {0}
-                 study_id = qiita.study.study_id) AS aids_with_deprecation,
-    - all the publications that belong to the study
-            (SELECT array_agg((publication, is_doi)))
-                FROM qiita.study_publication
-                WHERE study_id=qiita.study.study_id) AS publications,
-    - all names sorted by email of users that have access to the study
-            (SELECT array_agg(name ORDER BY email) FROM qiita.study_users
-                LEFT JOIN qiita.qiita_user USING (email)
-                WHERE study_id=qiita.study.study_id) AS shared_with_name,
-    - all emails sorted by email of users that have access to the study
-            (SELECT array_agg(email ORDER BY email) FROM qiita.study_users
-                LEFT JOIN qiita.qiita_user USING (email)
-                WHERE study_id=qiita.study.study_id) AS shared_with_email
-    - all study tags
-            (SELECT array_agg(study_tag) FROM qiita.per_study_tags
-                WHERE study_id=qiita.study.study_id) AS study_tags
-    - study owner
-            (SELECT name FROM qiita.qiita_user
-                WHERE email=qiita.study.email) AS owner
+      including their software deprecated value, aids_with_deprecation, and
+      only the public ones, public_aids_with_deprecation
+    - all the publications that belong to the study, publications
+    - all names and emails sorted by email of users that have access to the
+      study, shared_with_name and shared_with_email
+    - all study tags, study_tags
+    - the study owner name and email, owner and owner_email
+    - the study status and EBI submission status, status and
+      ebi_submission_status, as returned by Study.status and
+      Study.ebi_submission_status
     """
 
     visibility_sql = ''
@@ -1456,55 +1753,19 @@ def generate_study_list(user, visibility):
                     qdb.study.Study.get_ids_by_status('awaiting_approval'))
     elif visibility == 'public':
         sids = qdb.study.Study.get_ids_by_status('public') - sids
-        visibility_sql = "visibility = 'public' AND"
+        visibility_sql = 'public_'
     else:
         raise ValueError('Not a valid visibility: %s' % visibility)
 
     sql = """
         SELECT metadata_complete, study_abstract, study_id, study_alias,
-            study_title, ebi_study_accession,
-            qiita.study_person.name AS pi_name,
-            qiita.study_person.email AS pi_email,
-            (SELECT COUNT(sample_id) FROM qiita.study_sample
-                WHERE study_id=qiita.study.study_id)
-                AS number_samples_collected,
-            (SELECT array_agg(DISTINCT data_type)
-                FROM qiita.study_prep_template
-                LEFT JOIN qiita.prep_template USING (prep_template_id)
-                LEFT JOIN qiita.data_type USING (data_type_id)
-                LEFT JOIN qiita.artifact USING (artifact_id)
-                LEFT JOIN qiita.visibility USING (visibility_id)
-                LEFT JOIN qiita.artifact_type USING (artifact_type_id)
-                WHERE {0} study_id = qiita.study.study_id)
-                    AS preparation_data_types,
-            (SELECT array_agg(row_to_json(
-                (m_aid.artifact_id, qs.deprecated), true)
-                    ORDER BY artifact_id)
-                FROM qiita.study_artifact
-                LEFT JOIN qiita.artifact AS m_aid USING (artifact_id)
-                LEFT JOIN qiita.visibility USING (visibility_id)
-                LEFT JOIN qiita.artifact_type USING (artifact_type_id)
-                LEFT JOIN qiita.software_command USING (command_id)
-                LEFT JOIN qiita.software qs USING (software_id)
-                WHERE artifact_type='BIOM' AND {0}
-                    study_id = qiita.study.study_id) AS aids_with_deprecation,
-            (SELECT array_agg(row_to_json((publication, is_doi), true))
-                FROM qiita.study_publication
-                WHERE study_id=qiita.study.study_id) AS publications,
-            (SELECT array_agg(name ORDER BY email) FROM qiita.study_users
-                LEFT JOIN qiita.qiita_user USING (email)
-                WHERE study_id=qiita.study.study_id) AS shared_with_name,
-            (SELECT array_agg(email ORDER BY email) FROM qiita.study_users
-                LEFT JOIN qiita.qiita_user USING (email)
-                WHERE study_id=qiita.study.study_id) AS shared_with_email,
-            (SELECT array_agg(study_tag) FROM qiita.per_study_tags
-                WHERE study_id=qiita.study.study_id) AS study_tags,
-            (SELECT name FROM qiita.qiita_user
-                WHERE email=qiita.study.email) AS owner,
-            qiita.study.email AS owner_email
-            FROM qiita.study
-            LEFT JOIN qiita.study_person ON (
-                study_person_id=principal_investigator_id)
+            study_title, ebi_study_accession, pi_name, pi_email,
+            number_samples_collected,
+            {0}preparation_data_types AS preparation_data_types,
+            {0}aids_with_deprecation AS aids_with_deprecation,
+            publications, shared_with_name, shared_with_email, study_tags,
+            owner, owner_email, status, ebi_submission_status
+            FROM qiita.study_listing
             WHERE study_id IN %s
             ORDER BY study_id""".format(visibility_sql)
 
@@ -1562,9 +1823,6 @@ def generate_study_list(user, visibility):
                 del info["shared_with_name"]
                 del info["shared_with_email"]
 
-                study = qdb.study.Study(info['study_id'])
-                info['status'] = study.status
-                info['ebi_submission_status'] = study.ebi_submission_status
                 infolist.append(info)
     return infolist
 
@@ -1586,45 +1844,26 @@ def generate_study_list_without_artifacts(study_ids, portal=None):
 
     Notes
     -----
-    The main select might look scary but it's pretty simple:
-    - We select the requiered fields from qiita.study and qiita.study_person
-        SELECT metadata_complete, study_abstract, study_id, study_alias,
-            study_title, ebi_study_accession,
-            qiita.study_person.name AS pi_name,
-            qiita.study_person.email AS pi_email,
-    - the total number of samples collected by counting sample_ids
-            (SELECT COUNT(sample_id) FROM qiita.study_sample
-                WHERE study_id=qiita.study.study_id)
-                AS number_samples_collected]
-    - all the publications that belong to the study
-            (SELECT array_agg((publication, is_doi)))
-                FROM qiita.study_publication
-                WHERE study_id=qiita.study.study_id) AS publications
+    The information is read from qiita.study_listing, see
+    generate_study_list
     """
     if portal is None:
         portal = qiita_config.portal
     with qdb.sql_connection.TRN:
         sql = """
             SELECT metadata_complete, study_abstract, study_id, study_alias,
-                study_title, ebi_study_accession,
-                qiita.study_person.name AS pi_name,
-                qiita.study_person.email AS pi_email,
-                (SELECT COUNT(sample_id) FROM qiita.study_sample
-                    WHERE study_id=qiita.study.study_id)
-                    AS number_samples_collected,
-                (SELECT array_agg(row_to_json((publication, is_doi), true))
-                    FROM qiita.study_publication
-                    WHERE study_id=qiita.study.study_id) AS publications
-                FROM qiita.study
+                study_title, ebi_study_accession, pi_name, pi_email,
+                number_samples_collected, publications, status,
+                ebi_submission_status
+                FROM qiita.study_listing
                 LEFT JOIN qiita.study_portal USING (study_id)
                 LEFT JOIN qiita.portal_type USING (portal_type_id)
-                LEFT JOIN qiita.study_person ON (
-                    study_person_id=principal_investigator_id)
                 WHERE study_id IN %s AND portal = %s
                 ORDER BY study_id"""
         qdb.sql_connection.TRN.add(sql, [tuple(study_ids), portal])
+        results = qdb.sql_connection.TRN.execute_fetchindex()
         infolist = []
-        for info in qdb.sql_connection.TRN.execute_fetchindex():
+        for info in results:
             info = dict(info)
 
             # publication info
@@ -1646,13 +1885,151 @@ def generate_study_list_without_artifacts(study_ids, portal=None):
             del info["pi_email"]
             del info["pi_name"]
 
-            study = qdb.study.Study(info['study_id'])
-            info['status'] = study.status
-            info['ebi_submission_status'] = study.ebi_submission_status
             infolist.append(info)
     return infolist
 
 
+def _get_prep_summaries(prep_ids):
+    """Summarizes the given prep info files
+
+    Parameters
+    ----------
+    prep_ids : iterable of int
+        The prep template ids
+
+    Returns
+    -------
+    dict of {int: dict}
+        The number of samples (prep_samples), the comma separated distinct
+        values of the platform and target_gene columns ('not provided' if the
+        prep doesn't have the column) and the distinct values of the
+        target_subfragment column, keyed by prep template id
+
+    Notes
+    -----
+    The summaries are kept in the metadata cache together with the
+    modification counter of the prep, so only the preps that changed since
+    they were last summarized are read; both the counters and the summaries
+    are retrieved with a single query.
+    """
+    prep_ids = sorted(prep_ids)
+    if not prep_ids:
+        return {}
+
+    QCN = qdb.metadata_template.base_metadata_template.QIITA_COLUMN_NAME
+    cache = qdb.metadata_template.cache.METADATA_CACHE
+    summaries = {}
+    with qdb.sql_connection.TRN:
+        sql = ' UNION ALL '.join(
+            ["""SELECT {0}, sample_values->>'modification'
+                FROM qiita.prep_{0}
+                WHERE sample_id = '{1}'""".format(pid, QCN)
+             for pid in prep_ids])
+        qdb.sql_connection.TRN.add(sql)
+        modifications = dict(qdb.sql_connection.TRN.execute_fetchindex())
+
+        missing = []
+        for pid in prep_ids:
+            modification = modifications.get(pid)
+            summary = None
+            if modification is not None:
+                summary = cache.get_summary('prep_%d' % pid, modification)
+            if summary is None:
+                missing.append(pid)
+            else:
+                summaries[pid] = summary
+
+        if missing:
+            sql = ' UNION ALL '.join(
+                ["""SELECT {0}, COUNT(sample_id),
+                        string_agg(DISTINCT sample_values->>'platform', ', '),
+                        string_agg(
+                            DISTINCT sample_values->>'target_gene', ', '),
+                        array_agg(
+                            DISTINCT sample_values->>'target_subfragment')
+                    FROM qiita.prep_{0}
+                    WHERE sample_id != '{1}'""".format(pid, QCN)
+                 for pid in missing])
+            qdb.sql_connection.TRN.add(sql)
+            for pid, n, platform, target_gene, target in \
+                    qdb.sql_connection.TRN.execute_fetchindex():
+                summary = {
+                    'prep_samples': n,
+                    'platform': platform or 'not provided',
+                    'target_gene': target_gene or 'not provided',
+                    # the prep could be empty
+                    'target_subfragment': tuple(target) if n else ()}
+                summaries[pid] = summary
+                if modifications.get(pid) is not None:
+                    cache.put_summary(
+                        'prep_%d' % pid, modifications[pid], summary)
+
+    return summaries
+
+
+def get_sample_prep_presence(study_id):
+    """Returns which samples of the study are in each of its preparations
+
+    Parameters
+    ----------
+    study_id : int
+        The study id
+
+    Returns
+    -------
+    list of str, list of dict, dict of {int: bytes}
+        The sample ids of the study, sorted; the id, name and status of each
+        preparation of the study; and the samples in each preparation as a
+        bitset, where the bit at position i (as in numpy.packbits) is set if
+        the i-th sample is in the preparation
+    """
+    with qdb.sql_connection.TRN:
+        sql = """SELECT sample_id
+                 FROM qiita.study_sample
+                 WHERE study_id = %s
+                 ORDER BY sample_id COLLATE "C" ASC"""
+        qdb.sql_connection.TRN.add(sql, [study_id])
+        samples = qdb.sql_connection.TRN.execute_fetchflatten()
+
+        sql = """SELECT prep_template_id, name, visibility
+                 FROM qiita.study_prep_template
+                    JOIN qiita.prep_template USING (prep_template_id)
+                    LEFT JOIN qiita.artifact USING (artifact_id)
+                    LEFT JOIN qiita.visibility USING (visibility_id)
+                 WHERE study_id = %s
+                 ORDER BY prep_template_id"""
+        qdb.sql_connection.TRN.add(sql, [study_id])
+        preps = [{'id': pid, 'name': name,
+                  'status': infer_status([[vis]] if vis else [])}
+                 for pid, name, vis in
+                 qdb.sql_connection.TRN.execute_fetchindex()]
+
+        # the position of each sample is computed in the database, so we only
+        # transfer integers instead of the sample ids of every preparation
+        sql = """WITH samples AS (
+                    SELECT sample_id, row_number() OVER (
+                        ORDER BY sample_id COLLATE "C" ASC) - 1 AS position
+                    FROM qiita.study_sample
+                    WHERE study_id = %s)
+                 SELECT prep_template_id, array_agg(position)
+                 FROM qiita.prep_template_sample
+                    JOIN samples USING (sample_id)
+                    JOIN qiita.study_prep_template USING (prep_template_id)
+                 WHERE study_id = %s
+                 GROUP BY prep_template_id"""
+        qdb.sql_connection.TRN.add(sql, [study_id, study_id])
+        presence = {}
+        for pid, positions in qdb.sql_connection.TRN.execute_fetchindex():
+            bits = np.zeros(len(samples), dtype=bool)
+            bits[positions] = True
+            presence[pid] = np.packbits(bits).tobytes()
+        empty = np.packbits(np.zeros(len(samples), dtype=bool)).tobytes()
+        for prep in preps:
+            presence.setdefault(prep['id'], empty)
+
+    return samples, preps, presence
+
+
 def get_artifacts_information(artifact_ids, only_biom=True):
     """Returns processing information about the artifact ids
 
@@ -1716,42 +2093,58 @@ def get_artifacts_information(artifact_ids, only_biom=True):
         ORDER BY cid, data_type, artifact_id
         """
 
-    sql_params = """SELECT command_id, array_agg(parameter_name)
-                    FROM qiita.command_parameter
-                    WHERE parameter_type = 'artifact'
-                    GROUP BY command_id"""
-
-    QCN = qdb.metadata_template.base_metadata_template.QIITA_COLUMN_NAME
-    sql_ts = """SELECT DISTINCT sample_values->>'target_subfragment'
-                FROM qiita.prep_%s
-                WHERE sample_id != '{0}'""".format(QCN)
+    sql_commands = """
+        SELECT sc.command_id, sc.active, sc.ignore_parent_command,
+               s.deprecated,
+               ARRAY(SELECT parameter_name FROM qiita.command_parameter cp
+                     WHERE cp.command_id = sc.command_id
+                        AND parameter_type = 'artifact'),
+               ARRAY(SELECT parameter_name FROM qiita.command_parameter cp
+                     WHERE cp.command_id = sc.command_id
+                        AND check_biom_merge = TRUE
+                     ORDER BY parameter_name),
+               ARRAY(SELECT name FROM qiita.command_output co
+                     WHERE co.command_id = sc.command_id
+                        AND check_biom_merge = TRUE
+                     ORDER BY name)
+        FROM qiita.software_command sc
+            JOIN qiita.software s USING (software_id)
+        WHERE sc.command_id IN %s"""
 
     with qdb.sql_connection.TRN:
         results = []
 
-        # getting all commands and their artifact parameters so we can
-        # delete from the results below
+        qdb.sql_connection.TRN.add(sql, [tuple(artifact_ids)])
+        rows = qdb.sql_connection.TRN.execute_fetchindex()
+
+        # getting the commands of the artifacts and their parents, and their
+        # artifact parameters so we can delete them from the results below
         commands = {}
-        qdb.sql_connection.TRN.add(sql_params)
-        for cid, params in qdb.sql_connection.TRN.execute_fetchindex():
-            cmd = qdb.software.Command(cid)
-            commands[cid] = {
-                'params': params,
-                'merging_scheme': cmd.merging_scheme,
-                'active': cmd.active,
-                'deprecated': cmd.software.deprecated}
-
-        # Now let's get the actual artifacts. Note that ts is a cache
-        # (prep id : target subfragment) so we don't have to query
-        # multiple times the target subfragment for a prep info file.
-        # However, some artifacts (like analysis) do not have a prep info
-        # file; thus we can have a None prep id (key)
-        ts = {None: []}
-        ps = {}
+        cids = {r[2] for r in rows} | {r[8] for r in rows}
+        cids.discard(None)
+        if cids:
+            qdb.sql_connection.TRN.add(sql_commands, [tuple(cids)])
+            for cid, active, ipc, deprecated, params, mparams, moutputs in \
+                    qdb.sql_connection.TRN.execute_fetchindex():
+                commands[cid] = {
+                    'params': params,
+                    'merging_scheme': {'parameters': mparams,
+                                       'outputs': moutputs,
+                                       'ignore_parent_command': ipc},
+                    'active': active,
+                    'deprecated': deprecated}
+
+        # the information of the prep info files; note that some artifacts
+        # (like analysis) do not have a prep info file so they get the
+        # default values
+        ps = _get_prep_summaries({r[-1] for r in rows} - {None})
+        default_summary = {'target_subfragment': [], 'prep_samples': 0,
+                           'platform': 'not provided',
+                           'target_gene': 'not provided'}
+
+        # Now let's process the actual artifacts
         algorithm_az = {'': ''}
-        PT = qdb.metadata_template.prep_template.PrepTemplate
-        qdb.sql_connection.TRN.add(sql, [tuple(artifact_ids)])
-        for row in qdb.sql_connection.TRN.execute_fetchindex():
+        for row in rows:
             aid, name, cid, cname, gt, aparams, dt, pid, pcid, pname, \
                 pparams, filepaths, _, prep_template_id = row
 
@@ -1796,37 +2189,14 @@ def get_artifacts_information(artifact_ids, only_biom=True):
                     algorithm_az[algorithm] = hashlib.md5(
                         algorithm.encode('utf-8')).hexdigest()
 
-            if prep_template_id not in ts:
-                qdb.sql_connection.TRN.add(sql_ts, [prep_template_id])
-                ts[prep_template_id] = \
-                    qdb.sql_connection.TRN.execute_fetchflatten()
-            target = ts[prep_template_id]
-
-            prep_samples = 0
-            platform = 'not provided'
-            target_gene = 'not provided'
-            if prep_template_id is not None:
-                if prep_template_id not in ps:
-                    pt = PT(prep_template_id)
-                    categories = pt.categories()
-                    if 'platform' in categories:
-                        platform = ', '.join(
-                            set(pt.get_category('platform').values()))
-                    if 'target_gene' in categories:
-                        target_gene = ', '.join(
-                            set(pt.get_category('target_gene').values()))
-
-                    ps[prep_template_id] = [
-                        len(list(pt.keys())), platform, target_gene]
-
-                prep_samples, platform, target_gene = ps[prep_template_id]
+            summary = ps.get(prep_template_id, default_summary)
 
             results.append({
                 'artifact_id': aid,
-                'target_subfragment': target,
-                'prep_samples': prep_samples,
-                'platform': platform,
-                'target_gene': target_gene,
+                'target_subfragment': list(summary['target_subfragment']),
+                'prep_samples': summary['prep_samples'],
+                'platform': summary['platform'],
+                'target_gene': summary['target_gene'],
                 'name': name,
                 'data_type': dt,
                 'timestamp': str(gt),
@@ -9,9 +9,9 @@
 from tornado.web import authenticated, HTTPError
 from tornado.gen import coroutine
 
+from concurrent.futures import ThreadPoolExecutor
 from future.utils import viewitems
-from os.path import basename, getsize, join, isdir
-from os import walk
+from os.path import basename, join
 
 from .base_handlers import BaseHandler
 from qiita_pet.handlers.api_proxy.util import check_access
@@ -24,7 +24,7 @@ from qiita_db.download_link import DownloadLink
 from qiita_db.util import (filepath_id_to_rel_path, get_db_files_base_dir,
                            get_filepath_information, get_mountpoint,
                            filepath_id_to_object_id, get_data_types,
-                           retrieve_filepaths)
+                           retrieve_filepaths, list_download_files)
 from qiita_db.meta_util import validate_filepath_access_by_user
 from qiita_db.metadata_template.sample_template import SampleTemplate
 from qiita_db.metadata_template.prep_template import PrepTemplate
@@ -38,6 +38,11 @@ from base64 import b64encode
 from datetime import datetime, timedelta, timezone
 
 
+# the file lists are built in these threads so a large download doesn't block
+# the IOLoop while the files are listed
+FILE_LIST_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+
 class BaseHandlerDownload(BaseHandler):
     def _check_permissions(self, sid):
         # Check general access to study
@@ -69,21 +74,16 @@ class BaseHandlerDownload(BaseHandler):
 
         Returns
         -------
-        list of (str, str, str)
+        tornado.concurrent.Future of list of (str, str, str, str)
             The path information needed by nginx for each file in the
             directory
+
+        Notes
+        -----
+        The directory is walked in FILE_LIST_EXECUTOR
         """
-        basedir = get_db_files_base_dir()
-        basedir_len = len(basedir) + 1
-        to_download = []
-        for dp, _, fps in walk(dirpath):
-            for fn in fps:
-                fullpath = join(dp, fn)
-                spath = fullpath
-                if fullpath.startswith(basedir):
-                    spath = fullpath[basedir_len:]
-                to_download.append((spath, spath, '-', str(getsize(fullpath))))
-        return to_download
+        return FILE_LIST_EXECUTOR.submit(
+            list_download_files, dirpath, get_db_files_base_dir())
 
     def _list_artifact_files_nginx(self, artifact):
         """Generates a nginx list of files for the given artifact
@@ -95,39 +95,35 @@ class BaseHandlerDownload(BaseHandler):
 
         Returns
         -------
-        list of (str, str, str)
+        list of (str, str, str, str)
             The path information needed by nginx for each file in the artifact
         """
-        basedir = get_db_files_base_dir()
-        basedir_len = len(basedir) + 1
-        to_download = []
-        for i, x in enumerate(artifact.filepaths):
-            # ignore if tgz as they could create problems and the
-            # raw data is in the folder
-            if x['fp_type'] == 'tgz':
-                continue
-            if isdir(x['fp']):
-                # If we have a directory, we actually need to list all the
-                # files from the directory so NGINX can actually download all
-                # of them
-                to_download.extend(self._list_dir_files_nginx(x['fp']))
-            elif x['fp'].startswith(basedir):
-                spath = x['fp'][basedir_len:]
-                to_download.append(
-                    (spath, spath, str(x['checksum']), str(x['fp_size'])))
-            else:
-                to_download.append(
-                    (x['fp'], x['fp'], str(x['checksum']), str(x['fp_size'])))
-
-        for pt in artifact.prep_templates:
-            qmf = pt.qiime_map_fp
-            if qmf is not None:
-                sqmf = qmf
-                if qmf.startswith(basedir):
-                    sqmf = qmf[basedir_len:]
-                fname = 'mapping_files/%s_mapping_file.txt' % artifact.id
-                to_download.append((sqmf, fname, '-', str(getsize(qmf))))
-        return to_download
+        return Artifact.download_manifests([artifact.id])[artifact.id]
+
+    def _list_artifacts_files_nginx(self, artifact_ids):
+        """Generates a nginx list of files for the given artifacts
+
+        Parameters
+        ----------
+        artifact_ids : list of int
+            The artifacts to retrieve the files
+
+        Returns
+        -------
+        tornado.concurrent.Future of list of (str, str, str, str)
+            The path information needed by nginx for each file in the
+            artifacts, in the order of the artifacts
+
+        Notes
+        -----
+        The stored manifests of the artifacts are retrieved, and the missing
+        ones computed, in FILE_LIST_EXECUTOR
+        """
+        def _list():
+            manifests = Artifact.download_manifests(artifact_ids)
+            return [x for aid in artifact_ids for x in manifests[aid]]
+
+        return FILE_LIST_EXECUTOR.submit(_list)
 
     def _write_nginx_file_list(self, to_download):
         """Writes out the nginx file list
@@ -175,7 +171,6 @@ class BaseHandlerDownload(BaseHandler):
 class DownloadHandler(BaseHandlerDownload):
     @authenticated
     @coroutine
-    @execute_as_transaction
     def get(self, filepath_id):
         fid = int(filepath_id)
 
@@ -191,7 +186,8 @@ class DownloadHandler(BaseHandlerDownload):
         if fp_info['filepath_type'] in ('directory', 'html_summary_dir'):
             # This is a directory, we need to list all the files so NGINX
             # can download all of them
-            to_download = self._list_dir_files_nginx(fp_info['fullpath'])
+            to_download = yield self._list_dir_files_nginx(
+                fp_info['fullpath'])
             self._write_nginx_file_list(to_download)
             fname = '%s.zip' % fname
         else:
@@ -210,12 +206,10 @@ class DownloadHandler(BaseHandlerDownload):
 class DownloadStudyBIOMSHandler(BaseHandlerDownload):
     @authenticated
     @coroutine
-    @execute_as_transaction
     def get(self, study_id):
         study_id = int(study_id)
         study = self._check_permissions(study_id)
         # loop over artifacts and retrieve those that we have access to
-        to_download = []
         # The user has access to the study, but we don't know if the user
         # can do whatever he wants to the study or just access the public
         # data. (1) an admin has access to all the data; (2) if the study
@@ -229,9 +223,9 @@ class DownloadStudyBIOMSHandler(BaseHandlerDownload):
             ((self.current_user == study.owner) |
              (self.current_user in study.shared_with)))
 
-        for a in study.artifacts(artifact_type='BIOM'):
-            if full_access or a.visibility == 'public':
-                to_download.extend(self._list_artifact_files_nginx(a))
+        aids = [a.id for a in study.artifacts(artifact_type='BIOM')
+                if full_access or a.visibility == 'public']
+        to_download = yield self._list_artifacts_files_nginx(aids)
 
         self._write_nginx_file_list(to_download)
 
@@ -268,7 +262,6 @@ class DownloadRelease(BaseHandlerDownload):
 class DownloadRawData(BaseHandlerDownload):
     @authenticated
     @coroutine
-    @execute_as_transaction
     def get(self, study_id):
         study_id = int(study_id)
         study = self._check_permissions(study_id)
@@ -281,12 +274,13 @@ class DownloadRawData(BaseHandlerDownload):
                 'No raw data access', self.current_user.email, str(study_id)))
 
         # loop over artifacts and retrieve raw data (no parents)
-        to_download = []
+        aids = []
         for a in study.artifacts():
             if not a.parents:
                 if not is_owner and a.visibility != 'public':
                     continue
-                to_download.extend(self._list_artifact_files_nginx(a))
+                aids.append(a.id)
+        to_download = yield self._list_artifacts_files_nginx(aids)
 
         self._write_nginx_file_list(to_download)
 
@@ -352,7 +346,6 @@ class DownloadUpload(BaseHandlerDownload):
 
 class DownloadPublicHandler(BaseHandlerDownload):
     @coroutine
-    @execute_as_transaction
     def get(self):
         data = self.get_argument("data", None)
         study_id = self.get_argument("study_id",  None)
@@ -435,10 +428,8 @@ class DownloadPublicHandler(BaseHandlerDownload):
                     if data == 'biom':
                         artifacts = study.artifacts(
                             dtype=data_type, artifact_type='BIOM')
-                    for a in artifacts:
-                        if a.visibility != 'public':
-                            continue
-                        to_download.extend(self._list_artifact_files_nginx(a))
+                    to_download = yield self._list_artifacts_files_nginx(
+                        [a.id for a in artifacts if a.visibility == 'public'])
 
                 if not to_download:
                     raise HTTPError(422, reason='Nothing to download. If '
@@ -8,14 +8,17 @@
 
 from os.path import basename, exists
 from json import loads, dumps
+from base64 import b64encode
 from tempfile import NamedTemporaryFile
 
 from tornado.web import authenticated, HTTPError
 
 from qiita_core.qiita_settings import r_client
 from qiita_pet.handlers.base_handlers import BaseHandler
-from qiita_db.util import get_files_from_uploads_folders
+from qiita_db.util import (
+    get_files_from_uploads_folders, get_sample_prep_presence)
 from qiita_db.study import Study
+from qiita_db.user import User
 from qiita_db.metadata_template.sample_template import SampleTemplate
 from qiita_db.metadata_template.util import looks_like_qiime_mapping_file
 from qiita_db.software import Software, Parameters
@@ -23,9 +26,8 @@ from qiita_db.processing_job import ProcessingJob
 from qiita_db.exceptions import QiitaDBUnknownIDError
 
 from qiita_pet.handlers.api_proxy import (
-    data_types_get_req, sample_template_samples_get_req,
-    prep_template_samples_get_req, study_prep_get_req,
-    sample_template_meta_cats_get_req, sample_template_category_get_req,
+    data_types_get_req, sample_template_meta_cats_get_req,
+    sample_template_category_get_req,
     get_sample_template_processing_status,
     check_fp)
 
@@ -456,7 +458,7 @@ class SampleTemplateColumnsHandler(BaseHandler):
 
 
 def _build_sample_summary(study_id, user_id):
-    """Builds the row object for SlickGrid
+    """Builds the sample/preparation presence matrix for SlickGrid
 
     Parameters
     ----------
@@ -467,29 +469,28 @@ def _build_sample_summary(study_id, user_id):
 
     Returns
     -------
-    columns : dicts
+    columns : dict
         keys represent fields and values names for the columns in SlickGrid
-    rows : list of dicts
-        [ {field_1: 'value', ...}, ...]
+    samples : list of str
+        The sample ids of the study, sorted
+    presence : dict of {str: str}
+        The samples in the preparation of each field, as a base64 encoded
+        bitset (see qiita_db.util.get_sample_prep_presence). The rows are
+        built from them in the browser, as they are displayed
     """
-    # Load all samples available into dictionary and set
-    rows = {s: {'sample': s} for s in sample_template_samples_get_req(
-        study_id, user_id)['samples']}
-    samples = rows.keys()
-    # Add one column per prep template highlighting what samples exist
-    preps = study_prep_get_req(study_id, user_id)["info"]
+    samples, preps, presence = get_sample_prep_presence(study_id)
+    editable = Study(study_id).can_edit(User(user_id))
+
     columns = {}
-    for preptype in preps:
-        for prep in preps[preptype]:
-            field = "prep%d" % prep["id"]
-            name = "%s (%d)" % (prep["name"], prep["id"])
-            columns[field] = name
-            prep_samples = prep_template_samples_get_req(
-                prep['id'], user_id)['samples']
-            for s in samples:
-                rows[s][field] = 'X' if s in prep_samples else ''
+    bitsets = {}
+    for prep in preps:
+        if prep['status'] != 'public' and not editable:
+            continue
+        field = "prep%d" % prep["id"]
+        columns[field] = "%s (%d)" % (prep["name"], prep["id"])
+        bitsets[field] = b64encode(presence[prep['id']]).decode('ascii')
 
-    return columns, rows
+    return columns, samples, bitsets
 
 
 class SampleAJAX(BaseHandler):
@@ -509,13 +510,14 @@ class SampleAJAX(BaseHandler):
                 raise HTTPError(500, reason=res['message'])
         categories = res['categories']
 
-        columns, rows = _build_sample_summary(study_id, email)
+        columns, samples, presence = _build_sample_summary(study_id, email)
 
         _, alert_type, alert_msg = get_sample_template_processing_status(
             study_id)
 
         self.render('study_ajax/sample_prep_summary.html',
-                    rows=rows, columns=columns, categories=categories,
+                    samples=samples, presence=presence, columns=columns,
+                    categories=categories,
                     study_id=study_id, alert_type=alert_type,
                     alert_message=alert_msg,
                     user_can_edit=Study(study_id).can_edit(self.current_user))
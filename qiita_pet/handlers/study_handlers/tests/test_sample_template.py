@@ -365,67 +365,25 @@ class TestHelpers(TestHandlerBase):
         self.assertCountEqual(obs, exp)
 
     def test_build_sample_summary(self):
-        cols, rows = _build_sample_summary(1, 'test@foo.bar')
+        cols, samples, presence = _build_sample_summary(1, 'test@foo.bar')
         cols_exp = {
             'prep2': 'Prep information 2 (2)',
             'prep1': 'Prep information 1 (1)'}
-        rows_exp = {
-            '1.SKB2.640194': {
-                'sample': '1.SKB2.640194', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKM4.640180': {
-                'sample': '1.SKM4.640180', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKB3.640195': {
-                'sample': '1.SKB3.640195', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKB6.640176': {
-                'sample': '1.SKB6.640176', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKD6.640190': {
-                'sample': '1.SKD6.640190', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKM6.640187': {
-                'sample': '1.SKM6.640187', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKD9.640182': {
-                'sample': '1.SKD9.640182', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKM8.640201': {
-                'sample': '1.SKM8.640201', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKM2.640199': {
-                'sample': '1.SKM2.640199', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKD2.640178': {
-                'sample': '1.SKD2.640178', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKB7.640196': {
-                'sample': '1.SKB7.640196', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKD4.640185': {
-                'sample': '1.SKD4.640185', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKB8.640193': {
-                'sample': '1.SKB8.640193', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKM3.640197': {
-                'sample': '1.SKM3.640197', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKD5.640186': {
-                'sample': '1.SKD5.640186', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKB1.640202': {
-                'sample': '1.SKB1.640202', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKM1.640183': {
-                'sample': '1.SKM1.640183', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKD1.640179': {
-                'sample': '1.SKD1.640179', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKD3.640198': {
-                'sample': '1.SKD3.640198', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKB5.640181': {
-                'sample': '1.SKB5.640181', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKB4.640189': {
-                'sample': '1.SKB4.640189', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKB9.640200': {
-                'sample': '1.SKB9.640200', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKM9.640192': {
-                'sample': '1.SKM9.640192', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKD8.640184': {
-                'sample': '1.SKD8.640184', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKM5.640177': {
-                'sample': '1.SKM5.640177', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKM7.640188': {
-                'sample': '1.SKM7.640188', 'prep2': 'X', 'prep1': 'X'},
-            '1.SKD7.640191': {
-                'sample': '1.SKD7.640191', 'prep2': 'X', 'prep1': 'X'}}
+        samples_exp = [
+            '1.SKB1.640202', '1.SKB2.640194', '1.SKB3.640195',
+            '1.SKB4.640189', '1.SKB5.640181', '1.SKB6.640176',
+            '1.SKB7.640196', '1.SKB8.640193', '1.SKB9.640200',
+            '1.SKD1.640179', '1.SKD2.640178', '1.SKD3.640198',
+            '1.SKD4.640185', '1.SKD5.640186', '1.SKD6.640190',
+            '1.SKD7.640191', '1.SKD8.640184', '1.SKD9.640182',
+            '1.SKM1.640183', '1.SKM2.640199', '1.SKM3.640197',
+            '1.SKM4.640180', '1.SKM5.640177', '1.SKM6.640187',
+            '1.SKM7.640188', '1.SKM8.640201', '1.SKM9.640192']
+        # all the 27 samples are in both preparations
+        presence_exp = {'prep1': '////4A==', 'prep2': '////4A=='}
         self.assertEqual(cols, cols_exp)
-        self.assertEqual(rows, rows_exp)
+        self.assertEqual(samples, samples_exp)
+        self.assertEqual(presence, presence_exp)
 
 
 class TestSampleTemplateHandler(TestHandlerBase):
@@ -75,10 +75,11 @@ def release_validators(job):
     job : qiita_db.processing_job.ProcessingJob
         The processing job with the information of the parent job
     """
-    with qdb.sql_connection.TRN:
-        qdb.processing_job.ProcessingJob(
-            job.parameters.values['job']).release_validators()
-        job._set_status('success')
+    # release_validators waits for the validators outside of a transaction,
+    # so it can't be called within one
+    qdb.processing_job.ProcessingJob(
+        job.parameters.values['job']).release_validators()
+    job._set_status('success')
 
 
 def submit_to_VAMPS(job):
@@ -311,17 +312,17 @@ def delete_study(job):
                          if a.processing_parameters is None]
             # deleting each of the processing graphs
             for a in artifacts:
-                to_delete = list(a.descendants.nodes())
+                to_delete = a.descendants_lineage.ids
                 to_delete.reverse()
                 for td in to_delete:
-                    qdb.artifact.Artifact.delete(td.id)
+                    qdb.artifact.Artifact.delete(td)
             qdb.analysis.Analysis.delete(analysis.id)
 
         for pt in study.prep_templates():
-            to_delete = list(pt.artifact.descendants.nodes())
+            to_delete = pt.artifact.descendants_lineage.ids
             to_delete.reverse()
             for td in to_delete:
-                qdb.artifact.Artifact.delete(td.id)
+                qdb.artifact.Artifact.delete(td)
             MT.prep_template.PrepTemplate.delete(pt.id)
 
         if MT.sample_template.SampleTemplate.exists(study_id):
@@ -381,10 +382,10 @@ def delete_analysis(job):
                      if a.processing_parameters is None]
         # deleting each of the processing graphs
         for a in artifacts:
-            to_delete = list(a.descendants.nodes())
+            to_delete = a.descendants_lineage.ids
             to_delete.reverse()
             for td in to_delete:
-                qdb.artifact.Artifact.delete(td.id)
+                qdb.artifact.Artifact.delete(td)
         qdb.analysis.Analysis.delete(analysis_id)
 
         r_client.delete('analysis_delete_%d' % analysis_id)